@@ -0,0 +1,445 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from pathlib import Path
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+import numpy as np
+import yaml
+
+# 压测：启动兼容Ollama的本地替身和应用服务（独立进程），灌入合成文档后，
+# 在固定并发下分别压测各接口，输出吞吐、延迟分位数和服务进程的峰值内存，
+# 并与保存的基线比较。全程不访问外网，只依赖 /proc（Linux）读取内存。
+#
+#   python -m benchmarks.run --concurrency 1,8,32 --requests 200
+#   python -m benchmarks.run --save-baseline
+#   python -m benchmarks.run --baseline benchmarks/results/baseline.json
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "src"))
+
+from utils.sample_data import SAMPLE_DOCUMENTS
+
+RESULTS_DIR = ROOT / "benchmarks" / "results"
+API_PREFIX = "/api/v1"
+
+_REGIONS = ["华东区", "华北区", "华南区", "西部区"]
+_QUESTION_TEMPLATES = [
+    "{year}年第{quarter}季度{region}的销售额是多少？",
+    "{year}年第{quarter}季度哪个营销渠道的ROI最高？",
+    "{year}年第{quarter}季度客户续约率和NPS如何？",
+    "{year}年第{quarter}季度供应链有哪些风险？",
+    "对比{year}年第{quarter}季度{region}和其它区域的增长情况",
+]
+
+def synthetic_documents(count: int, seed: int) -> List[Dict[str, Any]]:
+    """以示例文档为模板生成合成文档：替换年份季度、按随机比例缩放数字"""
+    rng = random.Random(seed)
+    documents = []
+    for i in range(count):
+        template = SAMPLE_DOCUMENTS[i % len(SAMPLE_DOCUMENTS)]
+        year = 2018 + (i // len(SAMPLE_DOCUMENTS)) % 8
+        quarter = 1 + (i // (len(SAMPLE_DOCUMENTS) * 8)) % 4
+        factor = rng.uniform(0.6, 1.6)
+        content = template["content"].replace("2024年", f"{year}年").replace("第二季度", f"第{quarter}季度")
+        content = re.sub(
+            r"\d[\d,]*(?:\.\d+)?",
+            lambda m: f"{float(m.group().replace(',', '')) * factor:,.1f}" if len(m.group()) > 2 else m.group(),
+            content
+        )
+        documents.append({
+            "id": f"bench-{i}",
+            "content": content,
+            "metadata": {**template["metadata"], "date": f"{year}-{quarter * 3:02d}-30"}
+        })
+    return documents
+
+def synthetic_questions(count: int, seed: int) -> List[str]:
+    """生成问题列表"""
+    rng = random.Random(seed)
+    return [
+        rng.choice(_QUESTION_TEMPLATES).format(
+            year=rng.randint(2018, 2025), quarter=rng.randint(1, 4), region=rng.choice(_REGIONS)
+        ) + f"（#{i}）"
+        for i in range(count)
+    ]
+
+def _set_path(config: Dict[str, Any], path: str, value: Any):
+    """按点分路径设置配置项"""
+    *parents, key = path.split(".")
+    for name in parents:
+        config = config.setdefault(name, {})
+    config[key] = value
+
+def build_config(work_dir: Path, stub_url: str, overrides: List[str]) -> Path:
+    """在 config/config.yaml 基础上生成压测配置：LLM指向替身，数据写入临时目录，关闭限流"""
+    with open(ROOT / "config" / "config.yaml", "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+    
+    for path, value in (
+        ("llm.default_provider", "ollama"),
+        ("llm.providers.ollama.api_base", stub_url),
+        ("llm.routing.enabled", False),
+        ("vector_store.embedding_provider", "llm"),
+        ("vector_store.persist_directory", str(work_dir / "chroma")),
+        ("vector_store.embedding_cache_dir", str(work_dir / "embedding_cache")),
+        ("cache.backend", "memory"),
+        ("api.rate_limit.requests_per_minute", 10 ** 9),
+        ("api.rate_limit.burst_limit", 10 ** 9),
+        ("app.debug", False),
+    ):
+        _set_path(config, path, value)
+    # --set llm.providers.ollama.max_concurrency=8，值按YAML解析
+    for override in overrides:
+        path, _, value = override.partition("=")
+        _set_path(config, path, yaml.safe_load(value))
+    
+    path = work_dir / "config.yaml"
+    with open(path, "w", encoding="utf-8") as f:
+        yaml.safe_dump(config, f, allow_unicode=True)
+    return path
+
+def read_memory(pid: int) -> Dict[str, float]:
+    """进程当前和峰值常驻内存（MB）"""
+    memory = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    name, value = line.split(":", 1)
+                    memory["rss_mb" if name == "VmRSS" else "peak_rss_mb"] = round(int(value.split()[0]) / 1024, 1)
+    except OSError:
+        pass
+    return memory
+
+def reset_peak_memory(pid: int) -> bool:
+    """重置进程的峰值内存统计（Linux 4.0+），失败时峰值为进程生命周期内的最大值"""
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+async def wait_ready(url: str, process: subprocess.Popen, timeout: float):
+    """等待服务可用"""
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=2.0) as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"process exited with code {process.returncode} before {url} became ready")
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise TimeoutError(f"{url} not ready after {timeout}s")
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    """延迟统计（毫秒）"""
+    if not latencies:
+        return {}
+    values = np.asarray(latencies) * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "mean": round(float(values.mean()), 2),
+        "p50": round(float(p50), 2),
+        "p95": round(float(p95), 2),
+        "p99": round(float(p99), 2),
+        "max": round(float(values.max()), 2),
+    }
+
+Scenario = Callable[[httpx.AsyncClient, int], Awaitable[int]]
+
+def build_scenarios(questions: List[str], documents: List[Dict[str, Any]]) -> Dict[str, Scenario]:
+    """各压测场景：发起一次请求并返回状态码"""
+    
+    async def qa(client: httpx.AsyncClient, i: int) -> int:
+        response = await client.post(f"{API_PREFIX}/qa", json={"question": questions[i % len(questions)]})
+        return response.status_code
+    
+    async def qa_stream(client: httpx.AsyncClient, i: int) -> int:
+        payload = {"question": questions[i % len(questions)]}
+        async with client.stream("POST", f"{API_PREFIX}/qa/stream", json=payload) as response:
+            async for line in response.aiter_lines():
+                if line == "event: error":
+                    return 599
+            return response.status_code
+    
+    async def documents_(client: httpx.AsyncClient, i: int) -> int:
+        document = documents[i % len(documents)]
+        response = await client.post(
+            f"{API_PREFIX}/documents",
+            json={"content": f"{document['content']}\n（补充记录 #{i}）", "metadata": document["metadata"]}
+        )
+        return response.status_code
+    
+    async def insights(client: httpx.AsyncClient, i: int) -> int:
+        response = await client.get(f"{API_PREFIX}/insights")
+        return response.status_code
+    
+    return {"qa": qa, "qa_stream": qa_stream, "documents": documents_, "insights": insights}
+
+async def run_level(
+    client: httpx.AsyncClient,
+    scenario: Scenario,
+    concurrency: int,
+    requests: int,
+    offset: int
+) -> Dict[str, Any]:
+    """以固定并发发起 requests 个请求"""
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    next_index = 0
+    
+    async def worker():
+        nonlocal next_index
+        while next_index < requests:
+            index = next_index
+            next_index += 1
+            started = time.perf_counter()
+            try:
+                status = await scenario(client, offset + index)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - started
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            if status == 200:
+                latencies.append(elapsed)
+    
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": requests,
+        "errors": requests - len(latencies),
+        "status": statuses,
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "latency_ms": latency_summary(latencies),
+    }
+
+async def seed(client: httpx.AsyncClient, documents: List[Dict[str, Any]], batch: int) -> Dict[str, Any]:
+    """通过批量入库接口灌入文档"""
+    started = time.perf_counter()
+    ingested = 0
+    for start in range(0, len(documents), batch):
+        body = "".join(json.dumps(doc, ensure_ascii=False) + "\n" for doc in documents[start:start + batch])
+        response = await client.post(
+            f"{API_PREFIX}/documents/bulk",
+            content=body.encode("utf-8"),
+            headers={"Content-Type": "application/x-ndjson"}
+        )
+        response.raise_for_status()
+        ingested += response.json().get("documents", 0)
+    elapsed = time.perf_counter() - started
+    return {
+        "documents": len(documents),
+        "ingested": ingested,
+        "duration_s": round(elapsed, 3),
+        "throughput_docs": round(len(documents) / elapsed, 2) if elapsed else 0.0,
+    }
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """与基线比较，返回回退项：吞吐下降、p95 上升或峰值内存上升超过容差"""
+    regressions = []
+    print(f"\n{'scenario':<24}{'rps':>18}{'p95 ms':>22}{'peak MB':>20}")
+    for scenario, levels in results["results"].items():
+        for concurrency, current in levels.items():
+            previous = baseline.get("results", {}).get(scenario, {}).get(concurrency)
+            if not previous or not current["latency_ms"] or not previous["latency_ms"]:
+                continue
+            name = f"{scenario}@{concurrency}"
+            checks = (
+                ("rps", previous["throughput_rps"], current["throughput_rps"], -1),
+                ("p95", previous["latency_ms"]["p95"], current["latency_ms"]["p95"], 1),
+                ("peak_rss", previous.get("peak_rss_mb"), current.get("peak_rss_mb"), 1),
+            )
+            cells = []
+            for metric, before, after, direction in checks:
+                if not before or after is None:
+                    cells.append("-")
+                    continue
+                change = (after - before) / before
+                flag = " !" if change * direction > tolerance else ""
+                if flag:
+                    regressions.append(f"{name} {metric}: {before} -> {after} ({change:+.1%})")
+                cells.append(f"{before}->{after} ({change:+.0%}){flag}")
+            print(f"{name:<24}{cells[0]:>18}{cells[1]:>22}{cells[2]:>20}")
+    return regressions
+
+def git_revision() -> Optional[str]:
+    """当前代码版本"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Load and latency benchmark for the AI Analyst API")
+    parser.add_argument("--scenarios", default="qa,qa_stream,documents,insights",
+                        help="comma-separated: qa, qa_stream, documents, insights")
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario and concurrency level")
+    parser.add_argument("--warmup", type=int, default=10, help="unmeasured requests before each scenario")
+    parser.add_argument("--seed-documents", type=int, default=500, help="synthetic documents ingested before the run")
+    parser.add_argument("--seed-batch", type=int, default=200, help="documents per bulk ingest request")
+    parser.add_argument("--distinct-questions", type=int, default=0,
+                        help="size of the question pool; 0 makes every question unique (no response cache hits)")
+    parser.add_argument("--random-seed", type=int, default=42)
+    parser.add_argument("--prefill-ms", type=float, default=20.0, help="stub LLM delay before the first token")
+    parser.add_argument("--token-ms", type=float, default=5.0, help="stub LLM delay per token")
+    parser.add_argument("--tokens", type=int, default=64, help="stub LLM tokens per answer")
+    parser.add_argument("--embed-ms", type=float, default=1.0, help="stub embedding delay per request")
+    parser.add_argument("--dim", type=int, default=384, help="stub embedding dimension")
+    parser.add_argument("--set", dest="overrides", action="append", default=[],
+                        help="config override, e.g. --set llm.providers.ollama.max_concurrency=8")
+    parser.add_argument("--port", type=int, default=18080, help="app server port")
+    parser.add_argument("--stub-port", type=int, default=11500, help="stub LLM port")
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    parser.add_argument("--output", type=Path, default=None, help="result file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--baseline", type=Path, default=None, help="baseline to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="also write results to benchmarks/results/baseline.json")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="relative change treated as a regression")
+    return parser.parse_args()
+
+async def stub_requests(client: httpx.AsyncClient, stub_url: str) -> Dict[str, int]:
+    """替身收到的各接口请求数"""
+    response = await client.get(f"{stub_url}/stats")
+    response.raise_for_status()
+    return response.json()
+
+async def benchmark(args: argparse.Namespace, server_pid: int, stub_url: str) -> Dict[str, Any]:
+    """灌入数据并依次压测各场景"""
+    concurrency_levels = [int(level) for level in args.concurrency.split(",")]
+    scenario_names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    total = args.warmup + args.requests * len(concurrency_levels)
+    documents = synthetic_documents(args.seed_documents, args.random_seed)
+    questions = synthetic_questions(args.distinct_questions or total * len(scenario_names), args.random_seed)
+    scenarios = build_scenarios(questions, synthetic_documents(total, args.random_seed + 1))
+    unknown = set(scenario_names) - set(scenarios)
+    if unknown:
+        raise ValueError(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    
+    limits = httpx.Limits(max_connections=max(concurrency_levels), max_keepalive_connections=max(concurrency_levels))
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=300.0, limits=limits) as client:
+        print(f"seeding {len(documents)} documents")
+        seed_result = await seed(client, documents, args.seed_batch)
+        seed_result.update(read_memory(server_pid))
+        print(f"  {seed_result['throughput_docs']} docs/s")
+        # 入库的向量化经由LLM完成，替身没有收到请求说明服务没有连到替身（例如配置项写错）
+        seed_result["stub_requests"] = await stub_requests(client, stub_url)
+        if not seed_result["stub_requests"].get("embed") and not seed_result["stub_requests"].get("embeddings"):
+            raise RuntimeError(f"stub LLM at {stub_url} received no embedding requests during seeding")
+        
+        results: Dict[str, Dict[str, Any]] = {}
+        for name in scenario_names:
+            # 每个场景使用不同的问题和文档区间，避免命中前一个场景留下的缓存
+            offset = scenario_names.index(name) * total
+            await run_level(client, scenarios[name], min(args.warmup, 4) or 1, args.warmup, offset)
+            offset += args.warmup
+            for concurrency in concurrency_levels:
+                reset_peak_memory(server_pid)
+                result = await run_level(client, scenarios[name], concurrency, args.requests, offset)
+                result.update(read_memory(server_pid))
+                offset += args.requests
+                results.setdefault(name, {})[str(concurrency)] = result
+                latency = result["latency_ms"]
+                print(
+                    f"  {name}@{concurrency}: {result['throughput_rps']} req/s, "
+                    f"p50 {latency.get('p50')} ms, p95 {latency.get('p95')} ms, p99 {latency.get('p99')} ms, "
+                    f"errors {result['errors']}, peak {result.get('peak_rss_mb')} MB"
+                )
+    
+        stub_totals = await stub_requests(client, stub_url)
+    
+    return {"seed": seed_result, "results": results, "stub_requests": stub_totals}
+
+def main() -> int:
+    args = parse_args()
+    with tempfile.TemporaryDirectory(prefix="ai_analyst_bench_") as work_dir:
+        work_dir = Path(work_dir)
+        stub_url = f"http://127.0.0.1:{args.stub_port}"
+        config_path = build_config(work_dir, stub_url, args.overrides)
+        env = {**os.environ, "CONFIG_PATH": str(config_path), "PYTHONUNBUFFERED": "1"}
+        env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+        
+        processes: List[subprocess.Popen] = []
+        try:
+            processes.append(subprocess.Popen(
+                [sys.executable, "-m", "benchmarks.stub_llm", "--port", str(args.stub_port),
+                 "--prefill-ms", str(args.prefill_ms), "--token-ms", str(args.token_ms),
+                 "--tokens", str(args.tokens), "--embed-ms", str(args.embed_ms), "--dim", str(args.dim)],
+                cwd=ROOT, env=env
+            ))
+            server_log = open(work_dir / "server.log", "wb")
+            processes.append(subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", "src",
+                 "--host", "127.0.0.1", "--port", str(args.port), "--log-level", "warning", "--no-access-log"],
+                cwd=ROOT, env=env, stdout=server_log, stderr=subprocess.STDOUT
+            ))
+            asyncio.run(wait_ready(f"{stub_url}/api/tags", processes[0], args.startup_timeout))
+            try:
+                asyncio.run(wait_ready(f"http://127.0.0.1:{args.port}/health", processes[1], args.startup_timeout))
+            except Exception:
+                server_log.flush()
+                sys.stderr.write((work_dir / "server.log").read_text(errors="replace")[-4000:])
+                raise
+            
+            startup_memory = read_memory(processes[1].pid)
+            run = asyncio.run(benchmark(args, processes[1].pid, stub_url))
+        finally:
+            for process in reversed(processes):
+                process.terminate()
+            for process in processes:
+                try:
+                    process.wait(timeout=15)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+    
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        },
+        "startup": startup_memory,
+        **run,
+    }
+    
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    output = args.output or RESULTS_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=2))
+    print(f"\nresults written to {output}")
+    if args.save_baseline:
+        (RESULTS_DIR / "baseline.json").write_text(json.dumps(report, ensure_ascii=False, indent=2))
+        print(f"baseline saved to {RESULTS_DIR / 'baseline.json'}")
+    
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("\nno regressions")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+from typing import Any, Dict, List
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import time
+from aiohttp import web
+
+# 兼容Ollama接口的本地替身，用于离线压测：按配置的延迟模拟预填充和逐token生成，
+# 向量为字符二元组的哈希向量，相似文本的向量相近，检索结果有意义且可复现。
+
+_WORDS = ["根据", "上下文", "，", "本季度", "销售额", "同比", "增长", "15.3%", "，", "主要", "来自", "华东区", "。"]
+
+class StubLLM:
+    """模拟Ollama的 generate / chat / embed 接口"""
+    
+    def __init__(
+        self,
+        prefill_ms: float = 20.0,
+        token_ms: float = 5.0,
+        tokens: int = 64,
+        embed_ms: float = 1.0,
+        dim: int = 384
+    ):
+        self.prefill = prefill_ms / 1000
+        self.token_delay = token_ms / 1000
+        self.tokens = tokens
+        self.embed_delay = embed_ms / 1000
+        self.dim = dim
+        self.requests: Dict[str, int] = {}
+    
+    def _count(self, name: str):
+        self.requests[name] = self.requests.get(name, 0) + 1
+    
+    def _vector(self, text: str) -> List[float]:
+        """字符二元组哈希向量，L2归一化"""
+        vector = [0.0] * self.dim
+        for i in range(max(len(text) - 1, 1)):
+            digest = hashlib.blake2b(text[i:i + 2].encode("utf-8"), digest_size=4).digest()
+            vector[int.from_bytes(digest, "little") % self.dim] += 1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+    
+    def _usage(self, prompt: str, started: float) -> Dict[str, Any]:
+        """Ollama 在最后一条消息中返回的token数和耗时（纳秒）"""
+        generation = self.tokens * self.token_delay
+        return {
+            "done": True,
+            "prompt_eval_count": max(len(prompt) // 2, 1),
+            "eval_count": self.tokens,
+            "prompt_eval_duration": int(self.prefill * 1e9),
+            "eval_duration": int(generation * 1e9),
+            "total_duration": int((time.perf_counter() - started) * 1e9),
+        }
+    
+    async def _respond(self, request: web.Request, prompt: str, chat: bool) -> web.StreamResponse:
+        """按是否流式返回完整回答或逐token的NDJSON"""
+        body = await request.json()
+        started = time.perf_counter()
+        await asyncio.sleep(self.prefill)
+        words = [_WORDS[i % len(_WORDS)] for i in range(self.tokens)]
+        
+        def chunk(text: str) -> Dict[str, Any]:
+            if chat:
+                return {"message": {"role": "assistant", "content": text}, "done": False}
+            return {"response": text, "done": False}
+        
+        if not body.get("stream"):
+            await asyncio.sleep(self.tokens * self.token_delay)
+            return web.json_response({**chunk("".join(words)), **self._usage(prompt, started)})
+        
+        response = web.StreamResponse()
+        response.content_type = "application/x-ndjson"
+        await response.prepare(request)
+        for word in words:
+            await asyncio.sleep(self.token_delay)
+            await response.write((json.dumps(chunk(word), ensure_ascii=False) + "\n").encode("utf-8"))
+        await response.write((json.dumps({**chunk(""), **self._usage(prompt, started)}) + "\n").encode("utf-8"))
+        await response.write_eof()
+        return response
+    
+    async def tags(self, request: web.Request) -> web.Response:
+        return web.json_response({"models": [{"name": "stub"}]})
+    
+    async def generate(self, request: web.Request) -> web.StreamResponse:
+        self._count("generate")
+        body = await request.json()
+        return await self._respond(request, body.get("prompt", ""), chat=False)
+    
+    async def chat(self, request: web.Request) -> web.StreamResponse:
+        self._count("chat")
+        body = await request.json()
+        prompt = "".join(message.get("content", "") for message in body.get("messages", []))
+        return await self._respond(request, prompt, chat=True)
+    
+    async def embed(self, request: web.Request) -> web.Response:
+        self._count("embed")
+        body = await request.json()
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        await asyncio.sleep(self.embed_delay)
+        return web.json_response({"embeddings": [self._vector(text) for text in texts]})
+    
+    async def embeddings(self, request: web.Request) -> web.Response:
+        self._count("embeddings")
+        body = await request.json()
+        await asyncio.sleep(self.embed_delay)
+        return web.json_response({"embedding": self._vector(body["prompt"])})
+    
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.requests)
+    
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.add_routes([
+            web.get("/api/tags", self.tags),
+            web.post("/api/generate", self.generate),
+            web.post("/api/chat", self.chat),
+            web.post("/api/embed", self.embed),
+            web.post("/api/embeddings", self.embeddings),
+            web.get("/stats", self.stats),
+        ])
+        return app
+
+def main():
+    parser = argparse.ArgumentParser(description="Ollama-compatible stub server for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--prefill-ms", type=float, default=20.0, help="delay before the first token")
+    parser.add_argument("--token-ms", type=float, default=5.0, help="delay per generated token")
+    parser.add_argument("--tokens", type=int, default=64, help="tokens per answer")
+    parser.add_argument("--embed-ms", type=float, default=1.0, help="delay per embedding request")
+    parser.add_argument("--dim", type=int, default=384, help="embedding dimension")
+    args = parser.parse_args()
+    
+    stub = StubLLM(args.prefill_ms, args.token_ms, args.tokens, args.embed_ms, args.dim)
+    web.run_app(stub.app(), host=args.host, port=args.port, print=None, access_log=None)
+
+if __name__ == "__main__":
+    main()
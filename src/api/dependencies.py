@@ -0,0 +1,131 @@
+from typing import Optional
+from fastapi import HTTPException, Request
+import hmac
+
+from qa_engine.engine import QAEngine
+from insight_agent.agent import InsightAgent
+from llm.base import BaseLLM
+from llm.factory import create_llm, embedding_model_for
+from llm.local_embedding import LocalEmbeddingEngine
+from retriever.base import BaseRetriever
+from retriever.chroma_retriever import ChromaRetriever
+from utils.cache import Cache, create_cache
+from utils.embedding_cache import EmbeddingCache
+from utils.notification import NotificationManager
+from utils.config import Settings
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+class ComponentContainer:
+    """应用级组件容器，组件在应用生命周期内只构建一次并在请求间共享"""
+    
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self.llm: Optional[BaseLLM] = None
+        self.embedding_engine: Optional[LocalEmbeddingEngine] = None
+        self.retriever: Optional[BaseRetriever] = None
+        self.cache: Optional[Cache] = None
+        self.notification_manager: Optional[NotificationManager] = None
+        self.qa_engine: Optional[QAEngine] = None
+        self.insight_agent: Optional[InsightAgent] = None
+    
+    def build(self) -> "ComponentContainer":
+        """构建所有组件"""
+        vector_config = self.settings.vector_store
+        self.llm = create_llm(self.settings)
+        
+        embedder = None
+        embedding_namespace = "chroma:default"
+        if vector_config.embedding_provider == "llm":
+            embedder = self.llm
+            provider = self.settings.llm.default_provider
+            model = embedding_model_for(provider, self.settings)
+            embedding_namespace = f"{provider}:{model}"
+        elif vector_config.embedding_provider == "local":
+            # 检索、入库和语义缓存共用同一个向量化引擎
+            self.embedding_engine = LocalEmbeddingEngine(
+                vector_config.embedding_model,
+                backend=vector_config.embedding_backend,
+                device=vector_config.embedding_device,
+                max_batch_size=vector_config.embedding_batch_size,
+                max_wait_ms=vector_config.embedding_max_wait_ms,
+                workers=vector_config.embedding_workers,
+                num_threads=vector_config.embedding_threads
+            )
+            embedder = self.embedding_engine
+            embedding_namespace = f"local:{vector_config.embedding_model}:{vector_config.embedding_backend}"
+        
+        embedding_cache = None
+        if vector_config.embedding_cache:
+            embedding_cache = EmbeddingCache(vector_config.embedding_cache_dir, embedding_namespace)
+        self.retriever = ChromaRetriever(vector_config, embedder=embedder, embedding_cache=embedding_cache)
+        self.cache = create_cache(self.settings.cache)
+        self.notification_manager = NotificationManager()
+        
+        self.qa_engine = QAEngine(
+            llm=self.llm,
+            retriever=self.retriever,
+            cache=self.cache,
+            config=self.settings.dict()
+        )
+        self.insight_agent = InsightAgent(
+            self.llm,
+            self.notification_manager,
+            self.settings.insight_agent
+        )
+        return self
+    
+    async def warmup(self) -> None:
+        """预热组件：打开向量集合、探测模型服务，失败只告警不阻塞启动"""
+        await self.cache.connect()
+        
+        if self.embedding_engine is not None:
+            if await self.embedding_engine.warmup():
+                logger.info("向量化模型加载完成")
+            else:
+                logger.warning("向量化模型加载失败")
+        
+        if await self.retriever.warmup():
+            logger.info("向量集合预热完成")
+        else:
+            logger.warning("向量集合预热失败")
+        
+        if await self.llm.ping():
+            logger.info("LLM服务预热完成")
+        else:
+            logger.warning("LLM服务不可用，将在首次请求时重试")
+    
+    async def close(self) -> None:
+        """按依赖的逆序关闭组件"""
+        for name, component in (
+            ("llm", self.llm),
+            ("retriever", self.retriever),
+            ("embedding_engine", self.embedding_engine),
+            ("cache", self.cache),
+        ):
+            if component is None:
+                continue
+            try:
+                await component.close()
+            except Exception as e:
+                logger.error(f"关闭组件 {name} 时出错: {str(e)}")
+
+def get_container(request: Request) -> ComponentContainer:
+    """获取应用级组件容器"""
+    return request.app.state.container
+
+def get_qa_engine(request: Request) -> QAEngine:
+    """获取问答引擎实例"""
+    return get_container(request).qa_engine
+
+def get_insight_agent(request: Request) -> InsightAgent:
+    """获取洞察Agent实例"""
+    return get_container(request).insight_agent
+
+def require_admin(request: Request) -> None:
+    """校验管理接口的 X-Admin-Token，未配置 admin_token 时管理接口不可用"""
+    expected = get_container(request).settings.security.admin_token
+    provided = request.headers.get("X-Admin-Token", "")
+    if not expected or not hmac.compare_digest(provided.encode(), expected.encode()):
+        raise HTTPException(status_code=403, detail="Admin token required")
@@ -1,41 +1,50 @@
-from fastapi import APIRouter, Depends, HTTPException
-from typing import Dict, Any, List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from typing import Dict, Any, List, Optional, AsyncIterator, Union
 from pydantic import BaseModel
+import json
+import math
 
 from qa_engine.engine import QAEngine
+from llm.scheduler import LLMOverloadedError, Priority, llm_priority
 from insight_agent.agent import InsightAgent
-from llm.ollama_llm import OllamaLLM
-from retriever.chroma_retriever import ChromaRetriever
-from utils.cache import Cache
-from utils.notification import NotificationManager
-from utils.config import settings
+from retriever.ingest import BulkIngestor, iter_ndjson
+from utils.profiler import request_profiler
+from utils.timing import start_timings
+from utils.token_quota import TokenQuotaExceededError
+from api.dependencies import ComponentContainer, get_container, get_qa_engine, get_insight_agent, require_admin
 
 # 创建路由
 api_router = APIRouter()
 
-# 创建依赖
-def get_qa_engine() -> QAEngine:
-    """获取问答引擎实例"""
-    llm = OllamaLLM(settings.llm.providers[settings.llm.default_provider].dict())
-    retriever = ChromaRetriever(settings.vector_store)
-    cache = Cache()
-    return QAEngine(llm, retriever, cache, settings.dict())
-
-def get_insight_agent() -> InsightAgent:
-    """获取洞察Agent实例"""
-    llm = OllamaLLM(settings.llm.providers[settings.llm.default_provider].dict())
-    notification_manager = NotificationManager()
-    return InsightAgent(llm, notification_manager, settings.insight_agent)
-
 # 定义请求/响应模型
+class QuestionFilters(BaseModel):
+    category: Optional[Union[str, List[str]]] = None
+    department: Optional[Union[str, List[str]]] = None
+    type: Optional[Union[str, List[str]]] = None
+    date_from: Optional[str] = None  # ISO日期，包含当天
+    date_to: Optional[str] = None
+    
+    def to_criteria(self) -> Optional[Dict[str, Any]]:
+        """转换为检索过滤条件，未设置任何条件时返回None"""
+        return self.dict(exclude_none=True) or None
+
 class QuestionRequest(BaseModel):
     question: str
     chat_history: Optional[List[Dict[str, str]]] = None
+    filters: Optional[QuestionFilters] = None
+    debug: bool = False  # 为True时在响应中返回各阶段耗时
+
+class BatchQuestionRequest(BaseModel):
+    questions: List[str]
+    filters: Optional[QuestionFilters] = None
 
 class QuestionResponse(BaseModel):
     answer: str
     context: Optional[str] = None
     visualization: Optional[Dict[str, Any]] = None
+    prompt_tokens: Optional[int] = None
+    timings: Optional[Dict[str, float]] = None  # 各阶段耗时（毫秒），仅debug时返回
 
 class DocumentRequest(BaseModel):
     content: str
@@ -47,42 +56,133 @@ class InsightResponse(BaseModel):
     data_summary: str
     historical_trends: str
 
+class ProfileRequest(BaseModel):
+    requests: int = 10
+    path_prefix: str = ""
+
+def _overloaded(e: LLMOverloadedError) -> HTTPException:
+    """LLM过载时返回503，并提示客户端重试时间"""
+    return HTTPException(
+        status_code=503,
+        detail=f"服务繁忙，请稍后重试: {str(e)}",
+        headers={"Retry-After": str(math.ceil(e.retry_after))}
+    )
+
+def _quota_exceeded(e: TokenQuotaExceededError) -> HTTPException:
+    """token额度用尽时返回429，并提示客户端重试时间"""
+    return HTTPException(
+        status_code=429,
+        detail=f"token额度已用尽，请稍后重试: {str(e)}",
+        headers={"Retry-After": str(math.ceil(e.retry_after))}
+    )
+
 # 定义路由
 @api_router.post("/qa", response_model=QuestionResponse)
-async def answer_question(request: QuestionRequest):
+async def answer_question(
+    request: QuestionRequest,
+    engine: QAEngine = Depends(get_qa_engine)
+):
     """回答问题接口"""
+    # 未启用 Server-Timing 中间件时，debug 请求单独计时
+    timings = start_timings() if request.debug else None
     try:
-        # 初始化组件
-        llm = OllamaLLM(settings.llm.providers[settings.llm.default_provider].dict())
-        retriever = ChromaRetriever(settings.vector_store)
-        cache = Cache()
-        
-        # 创建问答引擎
-        engine = QAEngine(
-            llm=llm,
-            retriever=retriever,
-            cache=cache,
-            config=settings.dict()
-        )
-        
         # 获取答案
         result = await engine.answer_question(
             question=request.question,
-            chat_history=request.chat_history
+            chat_history=request.chat_history,
+            filter_criteria=request.filters.to_criteria() if request.filters else None
         )
         
         return QuestionResponse(
             answer=result["answer"],
             context=result.get("context"),
-            visualization=result.get("visualization")
+            visualization=result.get("visualization"),
+            prompt_tokens=result.get("prompt_tokens"),
+            timings=timings.as_dict() if timings is not None else None
         )
         
+    except LLMOverloadedError as e:
+        raise _overloaded(e)
+    except TokenQuotaExceededError as e:
+        raise _quota_exceeded(e)
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"问答服务错误: {str(e)}"
         )
 
+def _format_sse(event: str, data: Any) -> str:
+    """格式化一条Server-Sent Events消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@api_router.post("/qa/stream")
+async def answer_question_stream(
+    request: QuestionRequest,
+    engine: QAEngine = Depends(get_qa_engine)
+) -> StreamingResponse:
+    """流式回答问题接口（SSE）：先返回检索到的上下文，再逐个返回token"""
+    async def event_stream() -> AsyncIterator[str]:
+        try:
+            async for item in engine.answer_question_stream(
+                question=request.question,
+                chat_history=request.chat_history,
+                filter_criteria=request.filters.to_criteria() if request.filters else None
+            ):
+                yield _format_sse(item["event"], item["data"])
+        except LLMOverloadedError as e:
+            yield _format_sse("error", {"detail": f"服务繁忙，请稍后重试: {str(e)}", "retry_after": e.retry_after})
+        except TokenQuotaExceededError as e:
+            yield _format_sse("error", {"detail": f"token额度已用尽，请稍后重试: {str(e)}", "retry_after": e.retry_after})
+        except Exception as e:
+            yield _format_sse("error", {"detail": f"问答服务错误: {str(e)}"})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.post("/qa/batch")
+async def answer_questions_batch(
+    request: BatchQuestionRequest,
+    engine: QAEngine = Depends(get_qa_engine)
+) -> StreamingResponse:
+    """批量问答接口：按完成顺序逐行返回 NDJSON 结果，index 为问题在请求中的下标"""
+    if len(request.questions) > engine.batch_max_questions:
+        raise HTTPException(
+            status_code=400,
+            detail=f"单次最多提交 {engine.batch_max_questions} 个问题"
+        )
+    
+    async def result_stream() -> AsyncIterator[str]:
+        try:
+            # 批量问答以批量优先级排队，不挤占交互请求
+            with llm_priority(Priority.BATCH):
+                async for item in engine.answer_many(
+                    questions=request.questions,
+                    filter_criteria=request.filters.to_criteria() if request.filters else None
+                ):
+                    if "error" in item:
+                        line = {"index": item["index"], "question": item["question"], "error": item["error"]}
+                    else:
+                        line = {
+                            "index": item["index"],
+                            "question": item["question"],
+                            "answer": item["answer"],
+                            "context": item.get("context"),
+                            "prompt_tokens": item.get("prompt_tokens"),
+                            "cached": item["cached"]
+                        }
+                    yield json.dumps(line, ensure_ascii=False) + "\n"
+        except Exception as e:
+            yield json.dumps({"error": f"问答服务错误: {str(e)}"}, ensure_ascii=False) + "\n"
+    
+    return StreamingResponse(
+        result_stream(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @api_router.post("/documents")
 async def add_document(
     request: DocumentRequest,
@@ -103,6 +203,46 @@ async def add_document(
             detail=f"Failed to add document: {str(e)}"
         )
 
+@api_router.post("/documents/bulk")
+async def add_documents_bulk(
+    request: Request,
+    container: ComponentContainer = Depends(get_container)
+) -> Dict[str, Any]:
+    """批量添加文档接口
+    
+    请求体为NDJSON（application/x-ndjson，每行一个 {"content", "metadata", "id"} 对象），
+    或以 multipart/form-data 上传的NDJSON文件（字段名 file）。输入按流读取、切块并分批写入。
+    """
+    errors: List[str] = []
+    content_type = request.headers.get("content-type", "")
+    try:
+        if content_type.startswith("multipart/form-data"):
+            form = await request.form()
+            upload = form.get("file")
+            if upload is None or isinstance(upload, str):
+                raise HTTPException(status_code=400, detail="Missing upload field 'file'")
+            
+            async def read_upload() -> AsyncIterator[bytes]:
+                while chunk := await upload.read(64 * 1024):
+                    yield chunk
+            
+            source = read_upload()
+        else:
+            source = request.stream()
+        
+        ingestor = BulkIngestor(container.retriever, container.settings.ingest)
+        stats = await ingestor.ingest(
+            iter_ndjson(source, errors, max_line_bytes=container.settings.ingest.max_line_bytes)
+        )
+        return {**stats, "errors": errors}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to ingest documents: {str(e)}"
+        )
+
 @api_router.get("/insights", response_model=InsightResponse)
 async def get_latest_insights(
     agent: InsightAgent = Depends(get_insight_agent)
@@ -113,8 +253,54 @@ async def get_latest_insights(
             data_summary="示例数据概览",
             historical_trends="示例历史趋势"
         )
+    except LLMOverloadedError as e:
+        raise _overloaded(e)
+    except TokenQuotaExceededError as e:
+        raise _quota_exceeded(e)
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f"Failed to get insights: {str(e)}"
-        ) 
\ No newline at end of file
+        )
+
+@api_router.post("/admin/profile", dependencies=[Depends(require_admin)])
+async def start_profile(request: ProfileRequest) -> Dict[str, Any]:
+    """开始对接下来的N个请求做性能分析"""
+    if request.requests <= 0:
+        raise HTTPException(status_code=400, detail="requests 必须大于0")
+    request_profiler.start(request.requests, request.path_prefix)
+    return request_profiler.status()
+
+@api_router.get("/admin/profile", dependencies=[Depends(require_admin)])
+async def get_profile_status() -> Dict[str, Any]:
+    """性能分析状态"""
+    return request_profiler.status()
+
+@api_router.delete("/admin/profile", dependencies=[Depends(require_admin)])
+async def stop_profile() -> Dict[str, Any]:
+    """停止性能分析，已有结果保留"""
+    request_profiler.stop()
+    return request_profiler.status()
+
+@api_router.get("/admin/profile/download", dependencies=[Depends(require_admin)])
+async def download_profile(format: str = "pstats", sort: str = "cumulative", limit: int = 50) -> Response:
+    """下载性能分析结果：pstats 为二进制格式（snakeviz 等工具可直接打开），text 为文本报告"""
+    if format == "text":
+        try:
+            report = request_profiler.report(sort, limit)
+        except KeyError:
+            raise HTTPException(status_code=400, detail=f"不支持的排序字段: {sort}")
+        if report is None:
+            raise HTTPException(status_code=404, detail="暂无性能分析结果")
+        return Response(report, media_type="text/plain; charset=utf-8")
+    if format != "pstats":
+        raise HTTPException(status_code=400, detail=f"不支持的格式: {format}")
+    
+    data = request_profiler.dump()
+    if data is None:
+        raise HTTPException(status_code=404, detail="暂无性能分析结果")
+    return Response(
+        data,
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": 'attachment; filename="profile.prof"'}
+    )
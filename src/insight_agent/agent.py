@@ -1,9 +1,13 @@
 from typing import Dict, Any, List, Optional
 from datetime import datetime
 import asyncio
+import time
 from utils.logger import get_logger
+from utils.metrics import INSIGHT_SCAN_DURATION
 from utils.notification import NotificationManager
 from llm.base import BaseLLM
+from llm.scheduler import LLMOverloadedError, Priority, llm_priority
+from utils.token_quota import TokenQuotaExceededError
 
 logger = get_logger(__name__)
 
@@ -23,9 +27,15 @@ class InsightAgent:
         self.scan_interval = config.get("scan_interval_minutes", 60)
     
     async def start_monitoring(self):
-        """启动监控任务"""
+        """启动监控任务，以后台优先级调用LLM，不与交互请求争抢"""
+        with llm_priority(Priority.BACKGROUND):
+            await self._monitor_loop()
+    
+    async def _monitor_loop(self):
+        """监控循环"""
         logger.info("启动数据监控任务")
         while True:
+            started = time.perf_counter()
             try:
                 # 执行数据监控与分析
                 insights = await self.analyze_data()
@@ -33,11 +43,13 @@ class InsightAgent:
                 # 如果有重要洞察，发送通知
                 if insights and self._should_notify(insights):
                     await self.send_notifications(insights)
+                INSIGHT_SCAN_DURATION.labels("ok").observe(time.perf_counter() - started)
                 
                 # 等待到下一个扫描周期
                 await asyncio.sleep(self.scan_interval * 60)
                 
             except Exception as e:
+                INSIGHT_SCAN_DURATION.labels("error").observe(time.perf_counter() - started)
                 logger.error(f"数据监控任务出错: {str(e)}")
                 await asyncio.sleep(60)  # 出错后等待1分钟再重试
     
@@ -103,6 +115,9 @@ class InsightAgent:
                 "historical_trends": historical_trends
             }
             
+        except (LLMOverloadedError, TokenQuotaExceededError):
+            # 过载、额度用尽交给调用方处理（接口返回503、429），不当作洞察内容返回
+            raise
         except Exception as e:
             logger.error(f"生成数据洞察时出错: {str(e)}")
             return {
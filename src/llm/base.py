@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, AsyncIterator
 
 class BaseLLM(ABC):
     """LLM基础类，定义统一接口"""
@@ -34,7 +34,47 @@ class BaseLLM(ABC):
         """基于历史对话生成回复"""
         pass
     
+    async def generate_stream(
+        self,
+        prompt: str,
+        system_message: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> AsyncIterator[str]:
+        """流式生成回复，默认实现一次性返回完整回复"""
+        yield await self.generate(
+            prompt,
+            system_message=system_message,
+            temperature=temperature,
+            max_tokens=max_tokens
+        )
+    
+    async def generate_with_history_stream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> AsyncIterator[str]:
+        """基于历史对话流式生成回复，默认实现一次性返回完整回复"""
+        yield await self.generate_with_history(
+            messages,
+            temperature=temperature,
+            max_tokens=max_tokens
+        )
+    
     @abstractmethod
     async def embed_text(self, text: str) -> List[float]:
         """文本向量化"""
-        pass 
\ No newline at end of file
+        pass
+    
+    async def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """批量文本向量化，默认逐条调用 embed_text，结果与输入顺序一致"""
+        return [await self.embed_text(text) for text in texts]
+    
+    async def ping(self) -> bool:
+        """探测模型服务是否可用"""
+        return True
+    
+    async def close(self) -> None:
+        """释放模型占用的资源"""
+        pass
@@ -0,0 +1,77 @@
+from typing import Any, Dict
+from .base import BaseLLM
+from .ollama_llm import OllamaLLM
+from .openai_llm import OpenAILLM
+from .quota import QuotaLLM
+from .routing import RoutingLLM
+from .scheduler import LLMScheduler, Priority, ScheduledLLM
+from utils.config import Settings
+from utils.token_quota import create_token_quota
+
+# 提供方类型到实现类的映射，配置中 type 为空时使用提供方名称
+_PROVIDER_TYPES = {
+    "ollama": OllamaLLM,
+    "openai": OpenAILLM,
+}
+
+def embedding_model_for(name: str, settings: Settings) -> str:
+    """提供方使用的向量化模型
+    
+    未配置时 ollama 沿用 vector_store.embedding_model（同一个本地服务），
+    其余类型使用实现类的默认模型，vector_store 的本地模型名在这些服务上并不存在。
+    """
+    provider = settings.llm.providers[name]
+    if provider.embedding_model:
+        return provider.embedding_model
+    provider_type = provider.type or name
+    if provider_type == "ollama":
+        return settings.vector_store.embedding_model
+    if provider_type not in _PROVIDER_TYPES:
+        raise ValueError(f"Unsupported LLM provider type: {provider_type}")
+    return getattr(_PROVIDER_TYPES[provider_type], "DEFAULT_EMBEDDING_MODEL", "")
+
+def _create_provider(name: str, settings: Settings) -> BaseLLM:
+    """创建单个提供方的LLM，并加上该提供方的准入控制"""
+    provider_config: Dict[str, Any] = settings.llm.providers[name].dict()
+    provider_config["embedding_model"] = embedding_model_for(name, settings)
+    provider_type = provider_config.get("type") or name
+    if provider_type not in _PROVIDER_TYPES:
+        raise ValueError(f"Unsupported LLM provider type: {provider_type}")
+    
+    scheduler_config = settings.llm.scheduler
+    return ScheduledLLM(
+        _PROVIDER_TYPES[provider_type](provider_config),
+        LLMScheduler(
+            name,
+            max_concurrency=provider_config["max_concurrency"],
+            max_queue=provider_config["max_queue"],
+            timeouts={
+                Priority.INTERACTIVE: scheduler_config.interactive_timeout,
+                Priority.BATCH: scheduler_config.batch_timeout,
+                Priority.BACKGROUND: scheduler_config.background_timeout,
+            }
+        )
+    )
+
+def create_llm(settings: Settings) -> BaseLLM:
+    """根据配置创建LLM：开启路由时在默认提供方和备用提供方之间路由，开启token额度时在最外层做额度准入"""
+    routing = settings.llm.routing
+    if not routing.enabled:
+        llm = _create_provider(settings.llm.default_provider, settings)
+    else:
+        names = [settings.llm.default_provider]
+        names.extend(name for name in routing.fallback_providers if name not in names)
+        llm = RoutingLLM(
+            [(name, _create_provider(name, settings)) for name in names],
+            hedge_delay=routing.hedge_delay,
+            failure_threshold=routing.failure_threshold,
+            cooldown=routing.cooldown,
+            ewma_alpha=routing.ewma_alpha
+        )
+    
+    quota = create_token_quota(
+        settings.api.token_quota,
+        redis_url=settings.cache.redis_url,
+        key_prefix=settings.cache.key_prefix
+    )
+    return QuotaLLM(llm, quota) if quota is not None else llm
@@ -0,0 +1,191 @@
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import threading
+import numpy as np
+from utils.executor import BoundedExecutor
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+class LocalEmbeddingEngine:
+    """进程内CPU向量化引擎（sentence-transformers）
+    
+    模型只加载一次，并发的向量化请求经微批处理合并：收到第一个请求后最多等待 max_wait_ms，
+    或凑满 max_batch_size 条文本即提交一批。编码在有界线程池中执行，线程全忙时请求继续排队，
+    下一批自然合并更多文本。backend 可选 torch、int8（torch 动态量化）或 onnx（onnxruntime）。
+    """
+    
+    def __init__(
+        self,
+        model_name: str,
+        backend: str = "torch",
+        device: str = "cpu",
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        workers: int = 1,
+        num_threads: int = 0,
+        normalize: bool = True
+    ):
+        self.model_name = model_name
+        self.backend = backend
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.num_threads = num_threads
+        self.normalize = normalize
+        self._model: Any = None
+        self._load_lock = threading.Lock()
+        self._executor = BoundedExecutor("embedding", max_workers=workers)
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.batches = 0
+        self.texts = 0
+    
+    def _load_model(self) -> Any:
+        """加载模型，按 backend 选择推理方式"""
+        from sentence_transformers import SentenceTransformer
+        
+        if self.backend == "onnx":
+            # 需要 sentence-transformers>=3.2 及 onnx 相关依赖
+            return SentenceTransformer(
+                self.model_name,
+                device="cpu",
+                backend="onnx",
+                model_kwargs={"provider": "CPUExecutionProvider"}
+            )
+        
+        import torch
+        if self.num_threads:
+            torch.set_num_threads(self.num_threads)
+        model = SentenceTransformer(self.model_name, device=self.device)
+        if self.backend == "int8":
+            # 线性层动态量化为int8，CPU上通常快1.5~2倍，向量与原模型有轻微偏差
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        return model
+    
+    def _get_model(self) -> Any:
+        """获取模型，首次调用时加载"""
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    logger.info(f"加载向量化模型 {self.model_name} (backend: {self.backend})")
+                    self._model = self._load_model()
+        return self._model
+    
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """同步编码，在线程池中执行"""
+        vectors = self._get_model().encode(
+            texts,
+            batch_size=self.max_batch_size,
+            normalize_embeddings=self.normalize,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        )
+        return np.asarray(vectors, dtype=np.float32)
+    
+    def _ensure_worker(self):
+        """在当前事件循环中启动微批处理任务"""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._worker is not None and not self._worker.done():
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self._executor.max_workers)
+        self._worker = loop.create_task(self._batch_loop())
+    
+    async def _batch_loop(self):
+        """收集请求组成批次：有空闲线程时才开始收集，线程全忙期间到达的请求留在队列里合并到下一批"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._slots.acquire()
+            try:
+                batch = [await self._queue.get()]
+            except asyncio.CancelledError:
+                self._slots.release()
+                raise
+            size = len(batch[0][0])
+            deadline = loop.time() + self.max_wait
+            while size < self.max_batch_size:
+                if self._queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    item = self._queue.get_nowait()
+                batch.append(item)
+                size += len(item[0])
+            loop.create_task(self._run_batch(batch))
+    
+    async def _run_batch(self, batch: List[Tuple[List[str], asyncio.Future]]):
+        """编码一批文本并按请求拆分结果"""
+        texts = [text for item_texts, _ in batch for text in item_texts]
+        try:
+            vectors = await self._executor.run(self._encode, texts)
+        except Exception as e:
+            logger.error(f"Local embedding error: {str(e)}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+        
+        self.batches += 1
+        self.texts += len(texts)
+        offset = 0
+        for item_texts, future in batch:
+            if not future.done():
+                future.set_result(vectors[offset:offset + len(item_texts)].tolist())
+            offset += len(item_texts)
+    
+    async def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """批量文本向量化，超过 max_batch_size 的请求拆分后并行排队"""
+        if not texts:
+            return []
+        self._ensure_worker()
+        loop = asyncio.get_running_loop()
+        futures = []
+        for start in range(0, len(texts), self.max_batch_size):
+            future = loop.create_future()
+            self._queue.put_nowait((texts[start:start + self.max_batch_size], future))
+            futures.append(future)
+        results = await asyncio.gather(*futures)
+        return [vector for chunk in results for vector in chunk]
+    
+    async def embed_text(self, text: str) -> List[float]:
+        """文本向量化"""
+        return (await self.embed_texts([text]))[0]
+    
+    async def warmup(self) -> bool:
+        """加载模型并编码一次，避免首个请求承担加载耗时"""
+        try:
+            await self._executor.run(self._encode, ["warmup"])
+            return True
+        except Exception as e:
+            logger.error(f"Local embedding warmup error: {str(e)}")
+            return False
+    
+    async def close(self) -> None:
+        """停止微批处理并关闭线程池"""
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        self._executor.shutdown(wait=True)
+    
+    def stats(self) -> Dict[str, Any]:
+        """微批处理统计"""
+        return {
+            "model": self.model_name,
+            "backend": self.backend,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "batches": self.batches,
+            "texts": self.texts,
+            "avg_batch_size": round(self.texts / self.batches, 2) if self.batches else 0.0,
+            "executor": self._executor.stats(),
+        }
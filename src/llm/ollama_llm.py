@@ -1,33 +1,246 @@
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, AsyncIterator
+import asyncio
 import json
+import time
 import aiohttp
 from .base import BaseLLM
 from utils.logger import get_logger
+from utils.metrics import LLM_TIME_TO_FIRST_TOKEN, observe_llm, record_llm_usage
+from utils.token_quota import record_usage
+from utils.tokens import estimate_tokens
 
 logger = get_logger(__name__)
 
+# 连接阶段超时可以安全重试，读超时说明模型仍在生成，重试只会加重负载
+_CONNECT_TIMEOUT_ERRORS = tuple(
+    cls for cls in (getattr(aiohttp, "ConnectionTimeoutError", None),) if cls
+)
+
+class OllamaAPIError(Exception):
+    """Ollama API返回非200状态码"""
+    
+    def __init__(self, status: int, message: str):
+        super().__init__(f"Ollama API error ({status}): {message}")
+        self.status = status
+
 class OllamaLLM(BaseLLM):
     """Ollama LLM实现"""
     
     def _initialize_model(self) -> None:
-        """初始化模型（Ollama不需要初始化）"""
+        """初始化模型（Ollama不需要初始化，HTTP会话在首次请求时创建）"""
+        self.api_base = self.model_config.get("api_base") or "http://localhost:11434"
+        self.max_retries = self.model_config.get("max_retries", 2)
+        self.retry_backoff = self.model_config.get("retry_backoff", 0.5)
+        self.embedding_model = self.model_config.get("embedding_model") or self.model_config["model"]
+        self._legacy_embeddings = False
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._retry_count = 0
+        self._request_count = 0
         return None
     
+    def _get_session(self) -> aiohttp.ClientSession:
+        """获取长连接会话，所有请求复用同一个连接池"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.model_config.get("pool_size", 20),
+                keepalive_timeout=self.model_config.get("keepalive_timeout", 60.0),
+            )
+            timeout = aiohttp.ClientTimeout(
+                total=None,
+                connect=self.model_config.get("connect_timeout", 5.0),
+                sock_read=self.model_config.get("read_timeout", 120.0),
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+    
+    def _is_retryable(self, error: Exception) -> bool:
+        """判断错误是否可以重试：连接错误与5xx"""
+        if isinstance(error, OllamaAPIError):
+            return error.status >= 500
+        if isinstance(error, aiohttp.ServerTimeoutError):
+            return isinstance(error, _CONNECT_TIMEOUT_ERRORS)
+        return isinstance(error, aiohttp.ClientConnectionError)
+    
+    async def _request(
+        self,
+        method: str,
+        endpoint: str,
+        payload: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """发送请求到Ollama API，连接错误和5xx按指数退避重试"""
+        url = f"{self.api_base}/{endpoint}"
+        attempt = 0
+        while True:
+            self._request_count += 1
+            try:
+                session = self._get_session()
+                async with session.request(method, url, json=payload) as response:
+                    if response.status != 200:
+                        error_text = await response.text()
+                        raise OllamaAPIError(response.status, error_text)
+                    return await response.json()
+            except Exception as e:
+                if attempt >= self.max_retries or not self._is_retryable(e):
+                    raise
+                attempt += 1
+                self._retry_count += 1
+                delay = self.retry_backoff * (2 ** (attempt - 1))
+                logger.warning(
+                    f"Ollama request {endpoint} failed ({str(e)}), "
+                    f"retry {attempt}/{self.max_retries} in {delay:.2f}s"
+                )
+                await asyncio.sleep(delay)
+    
     async def _make_request(
         self,
         endpoint: str,
         payload: Dict[str, Any]
     ) -> Dict[str, Any]:
         """发送请求到Ollama API"""
-        api_base = self.model_config.get("api_base", "http://localhost:11434")
-        url = f"{api_base}/{endpoint}"
+        return await self._request("POST", endpoint, payload)
+    
+    def _record_usage(self, response: Dict[str, Any]):
+        """记录Ollama返回的token数及预填充、生成耗时（纳秒）"""
+        record_llm_usage(
+            "ollama",
+            response.get("prompt_eval_count"),
+            response.get("eval_count"),
+            response["prompt_eval_duration"] / 1e9 if response.get("prompt_eval_duration") else None,
+            response["eval_duration"] / 1e9 if response.get("eval_duration") else None
+        )
+        record_usage(response.get("prompt_eval_count"), response.get("eval_count"))
+    
+    def pool_stats(self) -> Dict[str, int]:
+        """连接池统计：使用中/空闲连接数、请求数与重试次数"""
+        in_use = 0
+        idle = 0
+        if self._session is not None and not self._session.closed:
+            connector = self._session.connector
+            in_use = len(getattr(connector, "_acquired", ()))
+            idle = sum(len(conns) for conns in getattr(connector, "_conns", {}).values())
+        return {
+            "in_use": in_use,
+            "idle": idle,
+            "limit": self.model_config.get("pool_size", 20),
+            "requests": self._request_count,
+            "retries": self._retry_count,
+        }
+    
+    async def ping(self) -> bool:
+        """探测Ollama服务是否可用"""
+        try:
+            await self._request("GET", "api/tags")
+            return True
+        except Exception as e:
+            logger.warning(f"Ollama ping error: {str(e)}")
+            return False
+    
+    async def close(self) -> None:
+        """关闭HTTP会话及连接池"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
+    def _build_generate_payload(
+        self,
+        prompt: str,
+        system_message: Optional[str],
+        temperature: Optional[float],
+        max_tokens: Optional[int],
+        stream: bool
+    ) -> Dict[str, Any]:
+        """构建 api/generate 请求体"""
+        payload = {
+            "model": self.model_config["model"],
+            "prompt": prompt,
+            "stream": stream,
+            "options": {
+                "temperature": temperature or self.model_config.get("temperature", 0.7),
+                "num_predict": max_tokens or self.model_config.get("max_tokens", 2000),
+            }
+        }
+        
+        if system_message:
+            payload["system"] = system_message
+        
+        return payload
+    
+    def _build_chat_payload(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: Optional[float],
+        max_tokens: Optional[int],
+        stream: bool
+    ) -> Dict[str, Any]:
+        """构建 api/chat 请求体"""
+        # 构建对话历史
+        formatted_messages = []
+        for msg in messages:
+            role = msg.get("role", "user")
+            content = msg.get("content", "")
+            if role == "system":
+                formatted_messages.append({"system": content})
+            else:
+                formatted_messages.append({"role": role, "content": content})
+        
+        return {
+            "model": self.model_config["model"],
+            "messages": formatted_messages,
+            "stream": stream,
+            "options": {
+                "temperature": temperature or self.model_config.get("temperature", 0.7),
+                "num_predict": max_tokens or self.model_config.get("max_tokens", 2000),
+            }
+        }
+    
+    async def _stream_request(
+        self,
+        endpoint: str,
+        payload: Dict[str, Any]
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """以NDJSON流的方式请求Ollama API，逐行返回解析后的数据块
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload) as response:
-                if response.status != 200:
-                    error_text = await response.text()
-                    raise Exception(f"Ollama API error: {error_text}")
-                return await response.json()
+        只有在收到第一个数据块之前的失败会重试，已经开始输出后不再重试。
+        """
+        url = f"{self.api_base}/{endpoint}"
+        attempt = 0
+        request_started = time.perf_counter()
+        while True:
+            self._request_count += 1
+            started = False
+            try:
+                session = self._get_session()
+                async with session.post(url, json=payload) as response:
+                    if response.status != 200:
+                        error_text = await response.text()
+                        raise OllamaAPIError(response.status, error_text)
+                    async for line in response.content:
+                        line = line.strip()
+                        if not line:
+                            continue
+                        chunk = json.loads(line)
+                        if "error" in chunk:
+                            raise OllamaAPIError(response.status, chunk["error"])
+                        if not started:
+                            LLM_TIME_TO_FIRST_TOKEN.labels("ollama").observe(time.perf_counter() - request_started)
+                        started = True
+                        if chunk.get("done"):
+                            self._record_usage(chunk)
+                        yield chunk
+                        if chunk.get("done"):
+                            return
+                    return
+            except Exception as e:
+                if started or attempt >= self.max_retries or not self._is_retryable(e):
+                    raise
+                attempt += 1
+                self._retry_count += 1
+                delay = self.retry_backoff * (2 ** (attempt - 1))
+                logger.warning(
+                    f"Ollama stream {endpoint} failed ({str(e)}), "
+                    f"retry {attempt}/{self.max_retries} in {delay:.2f}s"
+                )
+                await asyncio.sleep(delay)
     
     async def generate(
         self,
@@ -38,28 +251,40 @@ class OllamaLLM(BaseLLM):
     ) -> str:
         """生成回复"""
         try:
-            # 构建请求
-            payload = {
-                "model": self.model_config["model"],
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "temperature": temperature or self.model_config.get("temperature", 0.7),
-                    "num_predict": max_tokens or self.model_config.get("max_tokens", 2000),
-                }
-            }
-            
-            if system_message:
-                payload["system"] = system_message
+            payload = self._build_generate_payload(
+                prompt, system_message, temperature, max_tokens, stream=False
+            )
             
             # 发送请求
-            response = await self._make_request("api/generate", payload)
+            with observe_llm("ollama", "generate"):
+                response = await self._make_request("api/generate", payload)
+            self._record_usage(response)
             return response.get("response", "")
             
         except Exception as e:
             logger.error(f"Ollama generate error: {str(e)}")
             raise
     
+    async def generate_stream(
+        self,
+        prompt: str,
+        system_message: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> AsyncIterator[str]:
+        """流式生成回复"""
+        try:
+            payload = self._build_generate_payload(
+                prompt, system_message, temperature, max_tokens, stream=True
+            )
+            with observe_llm("ollama", "generate_stream"):
+                async for chunk in self._stream_request("api/generate", payload):
+                    if token := chunk.get("response"):
+                        yield token
+        except Exception as e:
+            logger.error(f"Ollama generate_stream error: {str(e)}")
+            raise
+    
     async def generate_with_history(
         self,
         messages: List[Dict[str, str]],
@@ -68,47 +293,113 @@ class OllamaLLM(BaseLLM):
     ) -> str:
         """基于历史对话生成回复"""
         try:
-            # 构建对话历史
-            formatted_messages = []
-            for msg in messages:
-                role = msg.get("role", "user")
-                content = msg.get("content", "")
-                if role == "system":
-                    formatted_messages.append({"system": content})
-                else:
-                    formatted_messages.append({"role": role, "content": content})
-            
-            # 构建请求
-            payload = {
-                "model": self.model_config["model"],
-                "messages": formatted_messages,
-                "stream": False,
-                "options": {
-                    "temperature": temperature or self.model_config.get("temperature", 0.7),
-                    "num_predict": max_tokens or self.model_config.get("max_tokens", 2000),
-                }
-            }
+            payload = self._build_chat_payload(
+                messages, temperature, max_tokens, stream=False
+            )
             
             # 发送请求
-            response = await self._make_request("api/chat", payload)
+            with observe_llm("ollama", "chat"):
+                response = await self._make_request("api/chat", payload)
+            self._record_usage(response)
             return response.get("message", {}).get("content", "")
             
         except Exception as e:
             logger.error(f"Ollama generate_with_history error: {str(e)}")
             raise
     
+    async def generate_with_history_stream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> AsyncIterator[str]:
+        """基于历史对话流式生成回复"""
+        try:
+            payload = self._build_chat_payload(
+                messages, temperature, max_tokens, stream=True
+            )
+            with observe_llm("ollama", "chat_stream"):
+                async for chunk in self._stream_request("api/chat", payload):
+                    if token := chunk.get("message", {}).get("content"):
+                        yield token
+        except Exception as e:
+            logger.error(f"Ollama generate_with_history_stream error: {str(e)}")
+            raise
+    
+    def _split_embedding_batches(self, texts: List[str]) -> List[List[int]]:
+        """按条数和估算token数把输入切分为子批次，返回每个子批次的下标"""
+        max_size = self.model_config.get("embed_batch_size", 64)
+        max_tokens = self.model_config.get("embed_batch_tokens", 8192)
+        batches: List[List[int]] = []
+        current: List[int] = []
+        current_tokens = 0
+        for i, text in enumerate(texts):
+            tokens = estimate_tokens(text)
+            if current and (len(current) >= max_size or current_tokens + tokens > max_tokens):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(i)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+    
+    async def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """调用批量向量化接口 api/embed，旧版本Ollama回退到逐条的 api/embeddings"""
+        if self._legacy_embeddings:
+            return [await self._embed_legacy(text) for text in texts]
+        try:
+            response = await self._make_request(
+                "api/embed",
+                {"model": self.embedding_model, "input": texts}
+            )
+        except OllamaAPIError as e:
+            if e.status != 404:
+                raise
+            logger.warning("Ollama不支持 api/embed，回退到逐条向量化接口")
+            self._legacy_embeddings = True
+            return [await self._embed_legacy(text) for text in texts]
+        embeddings = response.get("embeddings", [])
+        if len(embeddings) != len(texts):
+            raise OllamaAPIError(200, f"expected {len(texts)} embeddings, got {len(embeddings)}")
+        return embeddings
+    
+    async def _embed_legacy(self, text: str) -> List[float]:
+        """逐条向量化接口"""
+        response = await self._make_request(
+            "api/embeddings",
+            {"model": self.embedding_model, "prompt": text}
+        )
+        return response.get("embedding", [])
+    
     async def embed_text(self, text: str) -> List[float]:
         """文本向量化"""
+        return (await self.embed_texts([text]))[0]
+    
+    async def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """批量文本向量化
+        
+        输入按 embed_batch_size / embed_batch_tokens 切分为子批次，子批次以
+        embed_concurrency 为上限并发请求，结果按输入顺序返回。
+        """
+        if not texts:
+            return []
         try:
-            # 构建请求
-            payload = {
-                "model": self.model_config["model"],
-                "prompt": text
-            }
+            batches = self._split_embedding_batches(texts)
+            semaphore = asyncio.Semaphore(self.model_config.get("embed_concurrency", 4))
             
-            # 发送请求
-            response = await self._make_request("api/embeddings", payload)
-            return response.get("embedding", [])
+            async def run(indices: List[int]) -> List[List[float]]:
+                async with semaphore:
+                    return await self._embed_batch([texts[i] for i in indices])
+            
+            with observe_llm("ollama", "embed"):
+                results = await asyncio.gather(*[run(indices) for indices in batches])
+            
+            embeddings: List[List[float]] = [None] * len(texts)
+            for indices, vectors in zip(batches, results):
+                for i, vector in zip(indices, vectors):
+                    embeddings[i] = vector
+            return embeddings
         except Exception as e:
-            logger.error(f"Ollama embed_text error: {str(e)}")
-            raise 
\ No newline at end of file
+            logger.error(f"Ollama embed_texts error: {str(e)}")
+            raise
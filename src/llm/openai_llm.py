@@ -1 +1,225 @@
- 
\ No newline at end of file
+from typing import Dict, Any, List, Optional, AsyncIterator
+import time
+import httpx
+from openai import AsyncOpenAI
+from .base import BaseLLM
+from utils.logger import get_logger
+from utils.metrics import LLM_TIME_TO_FIRST_TOKEN, observe_llm, record_llm_usage
+from utils.token_quota import record_usage
+from utils.tokens import estimate_tokens
+
+logger = get_logger(__name__)
+
+class OpenAILLM(BaseLLM):
+    """OpenAI兼容接口的LLM实现（OpenAI、vLLM、LM Studio 等）"""
+    
+    DEFAULT_EMBEDDING_MODEL = "text-embedding-3-small"
+    
+    def _initialize_model(self) -> None:
+        """初始化模型（客户端在首次请求时创建）"""
+        self.api_base = self.model_config.get("api_base") or "https://api.openai.com/v1"
+        self.embedding_model = self.model_config.get("embedding_model") or self.DEFAULT_EMBEDDING_MODEL
+        self._client: Optional[AsyncOpenAI] = None
+        return None
+    
+    def _get_client(self) -> AsyncOpenAI:
+        """获取客户端，所有请求复用同一个HTTP连接池"""
+        if self._client is None:
+            pool_size = self.model_config.get("pool_size", 20)
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=pool_size,
+                    max_keepalive_connections=pool_size,
+                    keepalive_expiry=self.model_config.get("keepalive_timeout", 60.0),
+                ),
+                timeout=httpx.Timeout(
+                    self.model_config.get("read_timeout", 120.0),
+                    connect=self.model_config.get("connect_timeout", 5.0),
+                ),
+            )
+            self._client = AsyncOpenAI(
+                # 本地部署的兼容服务通常不校验密钥，但客户端要求非空
+                api_key=self.model_config.get("api_key") or "EMPTY",
+                base_url=self.api_base,
+                max_retries=self.model_config.get("max_retries", 2),
+                http_client=http_client,
+            )
+        return self._client
+    
+    def _build_request(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: Optional[float],
+        max_tokens: Optional[int],
+        stream: bool
+    ) -> Dict[str, Any]:
+        """构建 chat.completions 请求参数"""
+        request = {
+            "model": self.model_config["model"],
+            "messages": messages,
+            "temperature": temperature if temperature is not None else self.model_config.get("temperature", 0.7),
+            "max_tokens": max_tokens or self.model_config.get("max_tokens", 2000),
+            "stream": stream,
+        }
+        if stream:
+            # 流式响应默认不带用量，要求服务在最后一个数据块中返回token数
+            request["stream_options"] = {"include_usage": True}
+        return request
+    
+    @staticmethod
+    def _prompt_messages(prompt: str, system_message: Optional[str]) -> List[Dict[str, str]]:
+        """单轮提示转换为消息列表"""
+        messages = []
+        if system_message:
+            messages.append({"role": "system", "content": system_message})
+        messages.append({"role": "user", "content": prompt})
+        return messages
+    
+    async def _complete(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: Optional[float],
+        max_tokens: Optional[int]
+    ) -> str:
+        """非流式生成"""
+        with observe_llm("openai", "chat"):
+            response = await self._get_client().chat.completions.create(
+                **self._build_request(messages, temperature, max_tokens, stream=False)
+            )
+        if response.usage is not None:
+            record_llm_usage("openai", response.usage.prompt_tokens, response.usage.completion_tokens)
+            record_usage(response.usage.prompt_tokens, response.usage.completion_tokens)
+        return response.choices[0].message.content or ""
+    
+    async def _complete_stream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: Optional[float],
+        max_tokens: Optional[int]
+    ) -> AsyncIterator[str]:
+        """流式生成"""
+        with observe_llm("openai", "chat_stream"):
+            started = time.perf_counter()
+            stream = await self._get_client().chat.completions.create(
+                **self._build_request(messages, temperature, max_tokens, stream=True)
+            )
+            first_token = True
+            try:
+                async for chunk in stream:
+                    if chunk.usage is not None:
+                        record_llm_usage("openai", chunk.usage.prompt_tokens, chunk.usage.completion_tokens)
+                        record_usage(chunk.usage.prompt_tokens, chunk.usage.completion_tokens)
+                    if chunk.choices and (token := chunk.choices[0].delta.content):
+                        if first_token:
+                            first_token = False
+                            LLM_TIME_TO_FIRST_TOKEN.labels("openai").observe(time.perf_counter() - started)
+                        yield token
+            finally:
+                await stream.close()
+    
+    async def generate(
+        self,
+        prompt: str,
+        system_message: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> str:
+        """生成回复"""
+        try:
+            return await self._complete(
+                self._prompt_messages(prompt, system_message), temperature, max_tokens
+            )
+        except Exception as e:
+            logger.error(f"OpenAI generate error: {str(e)}")
+            raise
+    
+    async def generate_stream(
+        self,
+        prompt: str,
+        system_message: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> AsyncIterator[str]:
+        """流式生成回复"""
+        try:
+            async for token in self._complete_stream(
+                self._prompt_messages(prompt, system_message), temperature, max_tokens
+            ):
+                yield token
+        except Exception as e:
+            logger.error(f"OpenAI generate_stream error: {str(e)}")
+            raise
+    
+    async def generate_with_history(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> str:
+        """基于历史对话生成回复"""
+        try:
+            return await self._complete(messages, temperature, max_tokens)
+        except Exception as e:
+            logger.error(f"OpenAI generate_with_history error: {str(e)}")
+            raise
+    
+    async def generate_with_history_stream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> AsyncIterator[str]:
+        """基于历史对话流式生成回复"""
+        try:
+            async for token in self._complete_stream(messages, temperature, max_tokens):
+                yield token
+        except Exception as e:
+            logger.error(f"OpenAI generate_with_history_stream error: {str(e)}")
+            raise
+    
+    async def embed_text(self, text: str) -> List[float]:
+        """文本向量化"""
+        return (await self.embed_texts([text]))[0]
+    
+    async def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """批量文本向量化，按 embed_batch_size / embed_batch_tokens 拆分请求，结果与输入顺序一致"""
+        if not texts:
+            return []
+        max_size = self.model_config.get("embed_batch_size", 64)
+        max_tokens = self.model_config.get("embed_batch_tokens", 8192)
+        embeddings: List[List[float]] = []
+        batch: List[str] = []
+        batch_tokens = 0
+        try:
+            for text in [*texts, None]:
+                tokens = estimate_tokens(text) if text is not None else 0
+                if batch and (text is None or len(batch) >= max_size or batch_tokens + tokens > max_tokens):
+                    with observe_llm("openai", "embed"):
+                        response = await self._get_client().embeddings.create(
+                            model=self.embedding_model,
+                            input=batch
+                        )
+                    embeddings.extend(item.embedding for item in sorted(response.data, key=lambda d: d.index))
+                    batch, batch_tokens = [], 0
+                if text is not None:
+                    batch.append(text)
+                    batch_tokens += tokens
+            return embeddings
+        except Exception as e:
+            logger.error(f"OpenAI embed_texts error: {str(e)}")
+            raise
+    
+    async def ping(self) -> bool:
+        """探测服务是否可用"""
+        try:
+            await self._get_client().models.list()
+            return True
+        except Exception as e:
+            logger.warning(f"OpenAI ping failed: {str(e)}")
+            return False
+    
+    async def close(self) -> None:
+        """关闭HTTP连接池"""
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
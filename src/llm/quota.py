@@ -0,0 +1,153 @@
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+from llm.base import BaseLLM
+from llm.scheduler import LLMOverloadedError
+from utils.token_quota import TokenQuota, TokenUsage, current_principals, reset_usage, start_usage
+from utils.tokens import estimate_tokens
+
+class QuotaLLM(BaseLLM):
+    """按token额度做准入的LLM包装
+    
+    当前请求带有额度主体时，生成前按 提示词估算token数 + max_tokens 预扣额度，
+    结束后按模型服务报告的实际用量多退少补。被准入控制拒绝、或流式调用在首个token前被取消时
+    请求没有消耗模型算力，全额退还；其余未报告用量的失败保留预扣值。
+    后台任务（无额度主体）和向量化不计额度。
+    """
+    
+    def __init__(self, llm: BaseLLM, quota: TokenQuota):
+        self.llm = llm
+        self.quota = quota
+        super().__init__(llm.model_config)
+    
+    def _initialize_model(self) -> Any:
+        """复用被包装LLM的模型"""
+        return self.llm.model
+    
+    def __getattr__(self, name: str) -> Any:
+        # 未定义的属性（如 stats）转发给被包装的LLM
+        if name == "llm":
+            raise AttributeError(name)
+        return getattr(self.llm, name)
+    
+    def _estimate(self, texts: List[Optional[str]], max_tokens: Optional[int]) -> int:
+        """预扣的token数：提示词估算值加上最多生成的token数"""
+        return sum(estimate_tokens(text) for text in texts if text) + (
+            max_tokens or self.model_config.get("max_tokens") or 0
+        )
+    
+    async def _settle(self, reserved: List[Tuple[str, str, int]], usage: TokenUsage, consumed: bool):
+        """结算：有实际用量时按实际用量，未到达模型服务时全额退还，否则保留预扣值"""
+        if usage.reported:
+            await self.quota.reconcile(reserved, usage.total)
+        elif not consumed:
+            await self.quota.release(reserved)
+    
+    async def _run(self, estimate: int, call: Callable[[], Awaitable[str]]) -> str:
+        """预扣额度后调用，结束后按实际用量结算"""
+        principals = current_principals()
+        if not principals:
+            return await call()
+        reserved = await self.quota.reserve(principals, estimate)
+        usage, token = start_usage()
+        consumed = True
+        try:
+            return await call()
+        except LLMOverloadedError:
+            consumed = False
+            raise
+        finally:
+            reset_usage(token)
+            await self._settle(reserved, usage, consumed)
+    
+    async def _run_stream(self, estimate: int, call: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """预扣额度后流式调用，结束后按实际用量结算"""
+        principals = current_principals()
+        if not principals:
+            async for token in call():
+                yield token
+            return
+        reserved = await self.quota.reserve(principals, estimate)
+        usage, usage_token = start_usage()
+        started = False
+        consumed = True
+        try:
+            async for token in call():
+                started = True
+                yield token
+        except (LLMOverloadedError, asyncio.CancelledError):
+            consumed = started
+            raise
+        finally:
+            reset_usage(usage_token)
+            await self._settle(reserved, usage, consumed)
+    
+    async def generate(
+        self,
+        prompt: str,
+        system_message: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> str:
+        """预扣额度后生成回复"""
+        return await self._run(
+            self._estimate([prompt, system_message], max_tokens),
+            lambda: self.llm.generate(prompt, system_message, temperature, max_tokens)
+        )
+    
+    async def generate_with_history(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> str:
+        """预扣额度后基于历史对话生成回复"""
+        return await self._run(
+            self._estimate([message.get("content") for message in messages], max_tokens),
+            lambda: self.llm.generate_with_history(messages, temperature, max_tokens)
+        )
+    
+    async def generate_stream(
+        self,
+        prompt: str,
+        system_message: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> AsyncIterator[str]:
+        """预扣额度后流式生成回复"""
+        async for token in self._run_stream(
+            self._estimate([prompt, system_message], max_tokens),
+            lambda: self.llm.generate_stream(prompt, system_message, temperature, max_tokens)
+        ):
+            yield token
+    
+    async def generate_with_history_stream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> AsyncIterator[str]:
+        """预扣额度后基于历史对话流式生成回复"""
+        async for token in self._run_stream(
+            self._estimate([message.get("content") for message in messages], max_tokens),
+            lambda: self.llm.generate_with_history_stream(messages, temperature, max_tokens)
+        ):
+            yield token
+    
+    async def embed_text(self, text: str) -> List[float]:
+        """文本向量化"""
+        return await self.llm.embed_text(text)
+    
+    async def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """批量文本向量化"""
+        return await self.llm.embed_texts(texts)
+    
+    async def ping(self) -> bool:
+        """探测模型服务是否可用"""
+        return await self.llm.ping()
+    
+    async def close(self) -> None:
+        """关闭被包装的LLM和额度存储"""
+        try:
+            await self.llm.close()
+        finally:
+            await self.quota.close()
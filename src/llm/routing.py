@@ -0,0 +1,274 @@
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import time
+from .base import BaseLLM
+from .scheduler import LLMOverloadedError
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+class _Backend:
+    """单个后端的延迟、错误率与熔断状态"""
+    
+    def __init__(self, name: str, llm: BaseLLM, initial_latency: float):
+        self.name = name
+        self.llm = llm
+        self.latency = initial_latency
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.half_open_probe = False
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.hedged = 0
+    
+    def available(self, now: float) -> bool:
+        """熔断关闭，或冷却结束后允许一个探测请求（半开）"""
+        if self.open_until == 0.0:
+            return True
+        return now >= self.open_until and not self.half_open_probe
+    
+    def score(self) -> float:
+        """路由得分，越小越优先：EWMA延迟按错误率和在途请求数放大"""
+        return self.latency * (1 + 4 * self.error_rate) * (1 + self.in_flight)
+
+class RoutingLLM(BaseLLM):
+    """多后端路由LLM
+    
+    按 EWMA 延迟与错误率为每个请求选择后端；请求超过 hedge_delay 仍未完成时，
+    向次优后端发送对冲请求，先返回者胜出；连续失败 failure_threshold 次的后端熔断
+    cooldown 秒，冷却后放行一个探测请求决定是否恢复。后端过载（准入控制拒绝）时
+    立即转到下一个后端，不计入错误。
+    流式请求不做对冲，只在首个token之前失败时切换后端。向量化始终使用第一个后端，
+    以保证向量空间一致。
+    """
+    
+    def __init__(
+        self,
+        backends: List[Tuple[str, BaseLLM]],
+        hedge_delay: float = 2.0,
+        failure_threshold: int = 5,
+        cooldown: float = 30.0,
+        ewma_alpha: float = 0.2,
+        initial_latency: float = 1.0
+    ):
+        self.backends = [_Backend(name, llm, initial_latency) for name, llm in backends]
+        self.hedge_delay = hedge_delay
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.ewma_alpha = ewma_alpha
+        super().__init__(backends[0][1].model_config)
+    
+    def _initialize_model(self) -> Any:
+        """使用第一个后端的模型"""
+        return self.backends[0].llm.model
+    
+    def _ordered(self) -> List[_Backend]:
+        """按路由得分排序的可用后端；全部熔断时仍返回全部后端，由请求结果决定"""
+        now = time.monotonic()
+        available = [backend for backend in self.backends if backend.available(now)]
+        return sorted(available or self.backends, key=lambda backend: backend.score())
+    
+    def _record(self, backend: _Backend, latency: Optional[float], failed: bool):
+        """更新后端的延迟、错误率与熔断状态"""
+        alpha = self.ewma_alpha
+        backend.error_rate = (1 - alpha) * backend.error_rate + alpha * (1.0 if failed else 0.0)
+        backend.half_open_probe = False
+        if failed:
+            backend.failures += 1
+            backend.consecutive_failures += 1
+            if backend.consecutive_failures >= self.failure_threshold:
+                if backend.open_until == 0.0:
+                    logger.warning(f"LLM后端 {backend.name} 连续失败 {backend.consecutive_failures} 次，熔断 {self.cooldown}s")
+                backend.open_until = time.monotonic() + self.cooldown
+        else:
+            backend.latency = (1 - alpha) * backend.latency + alpha * latency
+            backend.consecutive_failures = 0
+            if backend.open_until:
+                logger.info(f"LLM后端 {backend.name} 已恢复")
+            backend.open_until = 0.0
+    
+    async def _attempt(self, backend: _Backend, call: Callable[[BaseLLM], Awaitable[Any]]) -> Any:
+        """在指定后端上执行一次请求并记录结果"""
+        if backend.open_until and time.monotonic() >= backend.open_until:
+            backend.half_open_probe = True
+        backend.in_flight += 1
+        backend.requests += 1
+        started = time.monotonic()
+        try:
+            result = await call(backend.llm)
+        except LLMOverloadedError:
+            # 过载不是后端故障，不影响熔断
+            backend.half_open_probe = False
+            raise
+        except asyncio.CancelledError:
+            backend.half_open_probe = False
+            raise
+        except Exception:
+            self._record(backend, None, failed=True)
+            raise
+        finally:
+            backend.in_flight -= 1
+        self._record(backend, time.monotonic() - started, failed=False)
+        return result
+    
+    async def _call(self, call: Callable[[BaseLLM], Awaitable[Any]]) -> Any:
+        """按路由顺序执行请求：超时对冲、失败转移"""
+        candidates = self._ordered()
+        pending: Dict[asyncio.Task, _Backend] = {}
+        last_error: Optional[Exception] = None
+        try:
+            while candidates or pending:
+                if candidates and not pending:
+                    backend = candidates.pop(0)
+                    pending[asyncio.ensure_future(self._attempt(backend, call))] = backend
+                
+                # 只有还有备选后端时才需要等待对冲时间
+                timeout = self.hedge_delay if candidates and self.hedge_delay > 0 else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    backend = candidates.pop(0)
+                    backend.hedged += 1
+                    logger.info(f"LLM请求超过 {self.hedge_delay}s 未完成，对冲到后端 {backend.name}")
+                    pending[asyncio.ensure_future(self._attempt(backend, call))] = backend
+                    continue
+                
+                for task in done:
+                    backend = pending.pop(task)
+                    if task.exception() is None:
+                        return task.result()
+                    last_error = task.exception()
+                    logger.warning(f"LLM后端 {backend.name} 请求失败: {str(last_error)}")
+            raise last_error or RuntimeError("no LLM backend available")
+        finally:
+            for task in pending:
+                task.cancel()
+            # 等待落败的请求真正结束，释放连接并更新在途计数
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+    
+    async def _stream(self, call: Callable[[BaseLLM], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """流式请求：首个token之前失败时切换到下一个后端"""
+        last_error: Optional[Exception] = None
+        for backend in self._ordered():
+            if backend.open_until and time.monotonic() >= backend.open_until:
+                backend.half_open_probe = True
+            backend.in_flight += 1
+            backend.requests += 1
+            started = time.monotonic()
+            first_token = False
+            settled = False
+            try:
+                async for token in call(backend.llm):
+                    if not first_token:
+                        first_token = True
+                        # 以首个token延迟作为流式请求的延迟样本
+                        self._record(backend, time.monotonic() - started, failed=False)
+                        settled = True
+                    yield token
+                if not first_token:
+                    self._record(backend, time.monotonic() - started, failed=False)
+                    settled = True
+                return
+            except LLMOverloadedError as e:
+                backend.half_open_probe = False
+                settled = True
+                last_error = e
+            except Exception as e:
+                self._record(backend, None, failed=True)
+                settled = True
+                if first_token:
+                    raise
+                last_error = e
+                logger.warning(f"LLM后端 {backend.name} 流式请求失败: {str(e)}")
+            finally:
+                backend.in_flight -= 1
+                # 首个token之前被取消（如客户端断开）：探测没有结果，放行下一次探测
+                if not settled:
+                    backend.half_open_probe = False
+        raise last_error or RuntimeError("no LLM backend available")
+    
+    async def generate(
+        self,
+        prompt: str,
+        system_message: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> str:
+        """生成回复"""
+        return await self._call(
+            lambda llm: llm.generate(prompt, system_message, temperature, max_tokens)
+        )
+    
+    async def generate_with_history(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> str:
+        """基于历史对话生成回复"""
+        return await self._call(
+            lambda llm: llm.generate_with_history(messages, temperature, max_tokens)
+        )
+    
+    async def generate_stream(
+        self,
+        prompt: str,
+        system_message: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> AsyncIterator[str]:
+        """流式生成回复"""
+        async for token in self._stream(
+            lambda llm: llm.generate_stream(prompt, system_message, temperature, max_tokens)
+        ):
+            yield token
+    
+    async def generate_with_history_stream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> AsyncIterator[str]:
+        """基于历史对话流式生成回复"""
+        async for token in self._stream(
+            lambda llm: llm.generate_with_history_stream(messages, temperature, max_tokens)
+        ):
+            yield token
+    
+    async def embed_text(self, text: str) -> List[float]:
+        """文本向量化，固定使用第一个后端"""
+        return await self.backends[0].llm.embed_text(text)
+    
+    async def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """批量文本向量化，固定使用第一个后端"""
+        return await self.backends[0].llm.embed_texts(texts)
+    
+    async def ping(self) -> bool:
+        """任一后端可用即可"""
+        results = await asyncio.gather(*(backend.llm.ping() for backend in self.backends))
+        return any(results)
+    
+    async def close(self) -> None:
+        """关闭所有后端"""
+        for backend in self.backends:
+            try:
+                await backend.llm.close()
+            except Exception as e:
+                logger.error(f"关闭LLM后端 {backend.name} 时出错: {str(e)}")
+    
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """各后端的路由统计"""
+        return {
+            backend.name: {
+                "latency": round(backend.latency, 3),
+                "error_rate": round(backend.error_rate, 3),
+                "circuit_open": backend.open_until > 0.0,
+                "in_flight": backend.in_flight,
+                "requests": backend.requests,
+                "failures": backend.failures,
+                "hedged": backend.hedged,
+            }
+            for backend in self.backends
+        }
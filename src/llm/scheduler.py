@@ -0,0 +1,282 @@
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+import asyncio
+import heapq
+import itertools
+import time
+from llm.base import BaseLLM
+from utils.logger import get_logger
+from utils.metrics import LLM_ACTIVE, LLM_QUEUE_DEPTH, LLM_QUEUE_WAIT, LLM_SHED
+
+logger = get_logger(__name__)
+
+class Priority(IntEnum):
+    """LLM请求优先级，数值越小越优先"""
+    INTERACTIVE = 0
+    BATCH = 1
+    BACKGROUND = 2
+
+_priority: ContextVar[Priority] = ContextVar("llm_priority", default=Priority.INTERACTIVE)
+_deadline: ContextVar[Optional[float]] = ContextVar("llm_deadline", default=None)
+
+@contextmanager
+def llm_priority(priority: Priority, timeout: Optional[float] = None):
+    """在当前上下文中设置LLM请求的优先级和截止时间（秒），子任务继承该设置"""
+    priority_token = _priority.set(priority)
+    deadline_token = _deadline.set(time.monotonic() + timeout if timeout else None)
+    try:
+        yield
+    finally:
+        _deadline.reset(deadline_token)
+        _priority.reset(priority_token)
+
+class LLMOverloadedError(Exception):
+    """LLM服务过载，请求被准入控制拒绝"""
+    
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class LLMScheduler:
+    """LLM准入控制：并发上限、按优先级排队、超出截止时间时快速拒绝
+    
+    同时执行的请求数不超过 max_concurrency，其余请求按优先级（同级先到先得）排队。
+    排队数达到 max_queue 时，新请求若比队尾请求优先则挤掉队尾请求，否则直接拒绝。
+    预计等待时间由排在前面的请求数和平均执行时间（EWMA）估算，超过请求截止时间时直接拒绝；
+    已入队的请求排到截止时间仍未获得槽位时同样被拒绝，调用方据此返回 503 和 Retry-After。
+    """
+    
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: int = 4,
+        max_queue: int = 64,
+        timeouts: Optional[Dict[Priority, float]] = None,
+        initial_service_time: float = 2.0
+    ):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.timeouts = timeouts or {}
+        self.service_time = initial_service_time
+        self.active = 0
+        self._queue: List[Tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+        self._waiting = {priority: 0 for priority in Priority}
+        self.completed = 0
+        self.shed = 0
+    
+    def _estimate_wait(self, ahead: int) -> float:
+        """排在前面 ahead 个请求时的预计等待时间"""
+        if self.active < self.max_concurrency and ahead == 0:
+            return 0.0
+        return (ahead // self.max_concurrency + 1) * self.service_time
+    
+    def _set_waiting(self, priority: Priority, delta: int):
+        """更新排队计数及指标"""
+        self._waiting[priority] += delta
+        LLM_QUEUE_DEPTH.labels(self.name, priority.name.lower()).set(self._waiting[priority])
+    
+    def _reject(self, priority: Priority, reason: str, retry_after: float) -> LLMOverloadedError:
+        """记录拒绝并构造异常"""
+        self.shed += 1
+        LLM_SHED.labels(self.name, priority.name.lower(), reason).inc()
+        return LLMOverloadedError(
+            f"LLM provider {self.name} is overloaded ({reason})",
+            retry_after=max(retry_after, 1.0)
+        )
+    
+    def _deadline_for(self, priority: Priority) -> Optional[float]:
+        """请求的截止时间：上下文中显式设置的优先，否则按优先级的默认超时"""
+        deadline = _deadline.get()
+        if deadline is None and self.timeouts.get(priority):
+            deadline = time.monotonic() + self.timeouts[priority]
+        return deadline
+    
+    def _remove_entry(self, entry: Tuple[int, int, asyncio.Future], priority: Priority):
+        """放弃排队：移出队列并取消等待的future"""
+        self._queue.remove(entry)
+        heapq.heapify(self._queue)
+        self._set_waiting(priority, -1)
+        entry[2].cancel()
+    
+    async def acquire(self, priority: Optional[Priority] = None) -> None:
+        """获取执行槽位"""
+        priority = _priority.get() if priority is None else priority
+        if self.active < self.max_concurrency and not self._queue:
+            self.active += 1
+            LLM_ACTIVE.labels(self.name).set(self.active)
+            LLM_QUEUE_WAIT.labels(self.name, priority.name.lower()).observe(0)
+            return
+        
+        ahead = sum(count for p, count in self._waiting.items() if p <= priority)
+        estimated = self._estimate_wait(ahead)
+        deadline = self._deadline_for(priority)
+        if deadline is not None and time.monotonic() + estimated > deadline:
+            raise self._reject(priority, "deadline", estimated)
+        
+        if len(self._queue) >= self.max_queue:
+            # 队列已满：挤掉优先级最低且最晚到达的请求，新请求不比它优先时直接拒绝
+            victim = max(self._queue) if self._queue else None
+            if victim is None or victim[0] <= priority:
+                raise self._reject(priority, "queue_full", estimated)
+            self._queue.remove(victim)
+            heapq.heapify(self._queue)
+            victim_priority = Priority(victim[0])
+            self._set_waiting(victim_priority, -1)
+            if not victim[2].done():
+                victim[2].set_exception(self._reject(victim_priority, "preempted", self.service_time))
+        
+        future = asyncio.get_running_loop().create_future()
+        entry = (int(priority), next(self._counter), future)
+        heapq.heappush(self._queue, entry)
+        self._set_waiting(priority, 1)
+        started = time.monotonic()
+        try:
+            if deadline is None:
+                await future
+            else:
+                # 入队时的等待时间只是估算，排队超过截止时间仍未轮到时放弃
+                await asyncio.wait_for(asyncio.shield(future), max(deadline - time.monotonic(), 0.0))
+        except asyncio.TimeoutError:
+            if entry in self._queue:
+                self._remove_entry(entry, priority)
+                raise self._reject(priority, "deadline", self.service_time)
+            # 截止时刻恰好拿到槽位（或被挤出），按结果继续
+            await future
+        except asyncio.CancelledError:
+            if entry in self._queue:
+                self._remove_entry(entry, priority)
+            elif future.done() and not future.cancelled() and future.exception() is None:
+                # 槽位已经移交给本请求，转交给下一个
+                self.release()
+            raise
+        LLM_QUEUE_WAIT.labels(self.name, priority.name.lower()).observe(time.monotonic() - started)
+    
+    def release(self, service_time: Optional[float] = None) -> None:
+        """释放槽位，直接移交给队首请求"""
+        if service_time is not None:
+            self.completed += 1
+            self.service_time = 0.8 * self.service_time + 0.2 * service_time
+        while self._queue:
+            priority, _, future = heapq.heappop(self._queue)
+            self._set_waiting(Priority(priority), -1)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+        LLM_ACTIVE.labels(self.name).set(self.active)
+    
+    async def run(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """在槽位内执行协程"""
+        await self.acquire()
+        started = time.monotonic()
+        try:
+            return await fn()
+        finally:
+            self.release(time.monotonic() - started)
+    
+    async def stream(self, fn: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """在槽位内执行流式生成，流结束或被关闭时释放槽位"""
+        await self.acquire()
+        started = time.monotonic()
+        try:
+            async for token in fn():
+                yield token
+        finally:
+            self.release(time.monotonic() - started)
+    
+    def stats(self) -> Dict[str, Any]:
+        """调度统计"""
+        return {
+            "max_concurrency": self.max_concurrency,
+            "active": self.active,
+            "waiting": {priority.name.lower(): count for priority, count in self._waiting.items()},
+            "service_time": round(self.service_time, 3),
+            "completed": self.completed,
+            "shed": self.shed,
+        }
+
+class ScheduledLLM(BaseLLM):
+    """为LLM加上准入控制的包装，生成请求经调度器排队，向量化直接透传"""
+    
+    def __init__(self, llm: BaseLLM, scheduler: LLMScheduler):
+        self.llm = llm
+        self.scheduler = scheduler
+        super().__init__(llm.model_config)
+    
+    def _initialize_model(self) -> Any:
+        """复用被包装LLM的模型"""
+        return self.llm.model
+    
+    def __getattr__(self, name: str) -> Any:
+        # 未定义的属性（如 pool_stats）转发给被包装的LLM
+        if name == "llm":
+            raise AttributeError(name)
+        return getattr(self.llm, name)
+    
+    async def generate(
+        self,
+        prompt: str,
+        system_message: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> str:
+        """排队后生成回复"""
+        return await self.scheduler.run(
+            lambda: self.llm.generate(prompt, system_message, temperature, max_tokens)
+        )
+    
+    async def generate_with_history(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> str:
+        """排队后基于历史对话生成回复"""
+        return await self.scheduler.run(
+            lambda: self.llm.generate_with_history(messages, temperature, max_tokens)
+        )
+    
+    async def generate_stream(
+        self,
+        prompt: str,
+        system_message: Optional[str] = None,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> AsyncIterator[str]:
+        """排队后流式生成回复"""
+        async for token in self.scheduler.stream(
+            lambda: self.llm.generate_stream(prompt, system_message, temperature, max_tokens)
+        ):
+            yield token
+    
+    async def generate_with_history_stream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> AsyncIterator[str]:
+        """排队后基于历史对话流式生成回复"""
+        async for token in self.scheduler.stream(
+            lambda: self.llm.generate_with_history_stream(messages, temperature, max_tokens)
+        ):
+            yield token
+    
+    async def embed_text(self, text: str) -> List[float]:
+        """文本向量化"""
+        return await self.llm.embed_text(text)
+    
+    async def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """批量文本向量化"""
+        return await self.llm.embed_texts(texts)
+    
+    async def ping(self) -> bool:
+        """探测模型服务是否可用"""
+        return await self.llm.ping()
+    
+    async def close(self) -> None:
+        """关闭被包装的LLM"""
+        await self.llm.close()
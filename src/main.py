@@ -3,14 +3,19 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse, RedirectResponse
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from fastapi.staticfiles import StaticFiles
-from prometheus_client import make_asgi_app
+from contextlib import asynccontextmanager
 import asyncio
 
 from api.router import api_router
+from api.dependencies import ComponentContainer
 from utils.config import settings
 from utils.logger import setup_logging, get_logger
 from handlers.error_handlers import setup_exception_handlers
-from utils.rate_limiter import RateLimitMiddleware
+from utils.rate_limiter import RateLimitMiddleware, create_rate_limiter
+from utils.metrics import RequestMetricsMiddleware, mark_process_dead, metrics_endpoint
+from utils.profiler import ProfilerMiddleware
+from utils.timing import ServerTimingMiddleware
+from utils.token_quota import TokenQuotaMiddleware
 # 暂时注释掉示例数据初始化相关导入
 # from utils.sample_data import initialize_sample_data
 # from retriever.chroma_retriever import ChromaRetriever
@@ -19,10 +24,25 @@ from utils.rate_limiter import RateLimitMiddleware
 setup_logging()  # 只调用设置函数，不赋值
 logger = get_logger(__name__)  # 使用get_logger获取logger
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动时构建并预热组件，关闭时释放资源"""
+    logger.info("应用启动")
+    container = ComponentContainer(settings).build()
+    await container.warmup()
+    app.state.container = container
+    try:
+        yield
+    finally:
+        await container.close()
+        mark_process_dead()
+        logger.info("应用关闭")
+
 app = FastAPI(
     title=settings.app.name,
     version=settings.app.version,
     description="Enterprise AI Analyst API",
+    lifespan=lifespan,
 )
 
 # 添加中间件
@@ -37,9 +57,20 @@ app.add_middleware(
 app.add_middleware(TrustedHostMiddleware, allowed_hosts=["*"])
 app.add_middleware(
     RateLimitMiddleware,
-    requests_per_minute=settings.api.rate_limit.requests_per_minute,
-    burst_limit=settings.api.rate_limit.burst_limit,
+    limiter=create_rate_limiter(
+        settings.api.rate_limit,
+        redis_url=settings.cache.redis_url,
+        key_prefix=settings.cache.key_prefix
+    ),
 )
+if settings.api.token_quota.enabled:
+    app.add_middleware(TokenQuotaMiddleware, api_key_header=settings.api.token_quota.api_key_header)
+# 按需性能分析，通过 /admin/profile 开启
+app.add_middleware(ProfilerMiddleware)
+if settings.api.server_timing:
+    app.add_middleware(ServerTimingMiddleware)
+# 最外层中间件，耗时包含限流等所有中间件
+app.add_middleware(RequestMetricsMiddleware)
 
 # 设置异常处理器
 setup_exception_handlers(app)
@@ -47,22 +78,15 @@ setup_exception_handlers(app)
 # 添加路由
 app.include_router(api_router, prefix=settings.api.prefix)
 
-# 添加静态文件支持
-app.mount("/", StaticFiles(directory="src/static", html=True), name="static")
-
 # 添加 Prometheus metrics
-metrics_app = make_asgi_app()
-app.mount("/metrics", metrics_app)
+app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
 
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
 
-# 简化启动事件
-@app.on_event("startup")
-async def startup_event():
-    """应用启动时执行的操作"""
-    logger.info("应用启动")
+# 添加静态文件支持，挂载在根路径，必须最后注册，否则会遮住 /metrics 和 /health
+app.mount("/", StaticFiles(directory="src/static", html=True), name="static")
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,105 @@
+from typing import Dict, Any, List, Optional, Set, Tuple
+from retriever.chunking import split_sentences
+from utils.tokens import estimate_tokens, split_terms
+
+class ContextBuilder:
+    """在token预算内组装问答上下文
+    
+    依次丢弃距离超过阈值的检索结果、去除近似重复的段落，把过长的段落裁剪为与问题最相关的句子，
+    最后按相关度顺序填充到总预算为止。对CPU上运行的小模型，提示词长度是推理耗时的主要来源。
+    """
+    
+    def __init__(
+        self,
+        max_tokens: int = 1500,
+        max_tokens_per_hit: int = 400,
+        min_tokens_per_hit: int = 32,
+        max_distance: float = 0.0,
+        dedup_threshold: float = 0.85
+    ):
+        self.max_tokens = max_tokens
+        self.max_tokens_per_hit = max_tokens_per_hit
+        self.min_tokens_per_hit = min_tokens_per_hit
+        self.max_distance = max_distance
+        self.dedup_threshold = dedup_threshold
+    
+    @staticmethod
+    def _shingles(text: str) -> Set[str]:
+        """三字符片段集合，用于估算段落相似度"""
+        text = "".join(text.split()).casefold()
+        if len(text) <= 3:
+            return {text}
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+    
+    def _is_duplicate(self, shingles: Set[str], kept: List[Set[str]]) -> bool:
+        """与已选段落的Jaccard相似度达到阈值即视为重复"""
+        for other in kept:
+            union = len(shingles | other)
+            if union and len(shingles & other) / union >= self.dedup_threshold:
+                return True
+        return False
+    
+    def _trim(self, content: str, question_terms: Set[str], budget: int) -> Tuple[str, int]:
+        """把段落裁剪到预算内：优先保留与问题词项重合最多的句子，输出时保持原有顺序"""
+        tokens = estimate_tokens(content)
+        if tokens <= budget:
+            return content, tokens
+        
+        sentences = [(s, estimate_tokens(s)) for s in split_sentences(content)]
+        ranked = sorted(
+            range(len(sentences)),
+            key=lambda i: (-len(question_terms.intersection(split_terms(sentences[i][0]))), i)
+        )
+        selected = []
+        used = 0
+        for i in ranked:
+            if used + sentences[i][1] <= budget:
+                selected.append(i)
+                used += sentences[i][1]
+        if not selected:
+            return "", 0
+        return "".join(sentences[i][0] for i in sorted(selected)).strip(), used
+    
+    def build(self, question: str, documents: List[Dict[str, Any]]) -> Tuple[str, Dict[str, int]]:
+        """根据检索结果生成上下文文本及统计信息"""
+        question_terms = set(split_terms(question))
+        stats = {
+            "retrieved": len(documents),
+            "dropped_distance": 0,
+            "dropped_duplicate": 0,
+            "trimmed": 0,
+            "used": 0,
+            "context_tokens": 0,
+        }
+        
+        # 检索结果已按相关度排序（混合检索时为融合后的顺序）
+        kept_shingles: List[Set[str]] = []
+        parts = []
+        remaining = self.max_tokens
+        for doc in documents:
+            distance: Optional[float] = doc.get("distance")
+            if self.max_distance and distance is not None and distance > self.max_distance:
+                stats["dropped_distance"] += 1
+                continue
+            
+            shingles = self._shingles(doc["content"])
+            if self._is_duplicate(shingles, kept_shingles):
+                stats["dropped_duplicate"] += 1
+                continue
+            
+            budget = min(self.max_tokens_per_hit, remaining)
+            if budget < self.min_tokens_per_hit:
+                break
+            text, tokens = self._trim(doc["content"], question_terms, budget)
+            if not text:
+                continue
+            if text != doc["content"]:
+                stats["trimmed"] += 1
+            
+            kept_shingles.append(shingles)
+            parts.append(text)
+            remaining -= tokens
+            stats["used"] += 1
+            stats["context_tokens"] += tokens
+        
+        return "\n\n".join(parts), stats
@@ -1,4 +1,7 @@
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, AsyncIterator, Tuple
+import asyncio
+import hashlib
+import json
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
 
@@ -6,6 +9,11 @@ from llm.base import BaseLLM
 from retriever.base import BaseRetriever
 from utils.logger import get_logger
 from utils.cache import Cache
+from utils.singleflight import SingleFlight
+from utils.timing import span
+from utils.tokens import estimate_tokens
+from .context_builder import ContextBuilder
+from .semantic_cache import SemanticCache
 
 logger = get_logger(__name__)
 
@@ -23,8 +31,51 @@ class QAEngine:
         self.retriever = retriever
         self.cache = cache
         self.config = config
+        self.semantic_cache = self._initialize_semantic_cache()
+        self.context_builder = self._initialize_context_builder()
+        batch_config = self.config.get("qa", {}).get("batch", {})
+        self.batch_max_questions = batch_config.get("max_questions", 500)
+        self.batch_concurrency = batch_config.get("concurrency", 4)
+        self.single_flight = SingleFlight()
         self._initialize_prompts()
     
+    def _initialize_semantic_cache(self) -> Optional[SemanticCache]:
+        """根据配置初始化语义缓存"""
+        cache_config = self.config.get("qa", {}).get("semantic_cache", {})
+        if not cache_config.get("enabled", False):
+            return None
+        return SemanticCache(
+            embed_fn=self._embed_question,
+            similarity_threshold=cache_config.get("similarity_threshold", 0.92),
+            max_entries=cache_config.get("max_entries", 5000),
+            max_scopes=cache_config.get("max_scopes", 256),
+            ttl=cache_config.get("ttl", 3600)
+        )
+    
+    def _initialize_context_builder(self) -> ContextBuilder:
+        """根据配置初始化上下文组装器"""
+        context_config = self.config.get("qa", {}).get("context", {})
+        self.top_k = context_config.get("top_k", 5)
+        return ContextBuilder(
+            max_tokens=context_config.get("max_tokens", 1500),
+            max_tokens_per_hit=context_config.get("max_tokens_per_hit", 400),
+            min_tokens_per_hit=context_config.get("min_tokens_per_hit", 32),
+            max_distance=context_config.get("max_distance", 0.0),
+            dedup_threshold=context_config.get("dedup_threshold", 0.85)
+        )
+    
+    async def _embed_question(self, question: str) -> List[float]:
+        """使用与检索相同的向量化函数向量化问题"""
+        return (await self.retriever.embed_texts([question]))[0]
+    
+    def _semantic_scope(self, filter_criteria: Optional[Dict[str, Any]]) -> str:
+        """语义缓存作用域：不同过滤条件、不同知识库版本的答案互不复用"""
+        return json.dumps(
+            [filter_criteria or {}, self.retriever.get_epoch(filter_criteria)],
+            sort_keys=True,
+            ensure_ascii=False
+        )
+    
     def _initialize_prompts(self):
         """初始化提示模板"""
         self.qa_prompt = PromptTemplate(
@@ -43,13 +94,70 @@ class QAEngine:
         self,
         question: str,
         filter_criteria: Optional[Dict[str, Any]] = None
+    ) -> Tuple[str, Dict[str, int]]:
+        """获取相关上下文，按token预算裁剪"""
+        with span("retrieval"):
+            documents = await self.retriever.search(
+                query=question,
+                filter_criteria=filter_criteria,
+                top_k=self.top_k
+            )
+        with span("prompt"):
+            return self.context_builder.build(question, documents)
+    
+    def _prompt_tokens(self, prompt: str, chat_history: Optional[List[Dict[str, str]]]) -> int:
+        """估算本次请求的提示词token数"""
+        return estimate_tokens(prompt) + sum(
+            estimate_tokens(message.get("content", "")) for message in chat_history or []
+        )
+    
+    def _build_messages(
+        self,
+        question: str,
+        context: str,
+        chat_history: Optional[List[Dict[str, str]]]
+    ) -> List[Dict[str, str]]:
+        """构建带历史对话的消息列表"""
+        return [
+            *chat_history,
+            {
+                "role": "system",
+                "content": self.qa_prompt.format(
+                    context=context,
+                    question=question
+                )
+            }
+        ]
+    
+    def _cache_key(
+        self,
+        question: str,
+        chat_history: Optional[List[Dict[str, str]]],
+        filter_criteria: Optional[Dict[str, Any]]
     ) -> str:
-        """获取相关上下文"""
-        documents = await self.retriever.search(
-            query=question,
-            filter_criteria=filter_criteria
+        """问答缓存键：规范化问题 + 过滤条件 + 历史对话摘要 + 知识库版本
+        
+        知识库写入后版本变化，旧键自然失效，无需依赖短TTL。
+        """
+        normalized = " ".join(question.split()).casefold().rstrip("?？。.!！")
+        history_digest = hashlib.sha1(
+            json.dumps(chat_history or [], sort_keys=True, ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
+        raw = json.dumps(
+            [normalized, filter_criteria or {}, history_digest],
+            sort_keys=True,
+            ensure_ascii=False
         )
-        return "\n\n".join([doc["content"] for doc in documents])
+        digest = hashlib.sha1(raw.encode("utf-8")).hexdigest()
+        return f"qa:v2:{digest}:{self.retriever.get_epoch(filter_criteria)}"
+    
+    def _cached_events(self, response: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """把缓存的回答转换为流式事件"""
+        return [
+            {"event": "context", "data": response.get("context")},
+            {"event": "token", "data": response["answer"]},
+            {"event": "done", "data": {"cached": True}},
+        ]
     
     async def answer_question(
         self,
@@ -59,46 +167,288 @@ class QAEngine:
     ) -> Dict[str, Any]:
         """回答问题"""
         # 检查缓存
-        cache_key = f"qa:{question}"
-        if cached_response := await self.cache.get(cache_key):
+        cache_key = self._cache_key(question, chat_history, filter_criteria)
+        with span("cache"):
+            cached_response = await self.cache.get(cache_key)
+        if cached_response:
             logger.info(f"Cache hit for question: {question}")
             return cached_response
         
-        # 获取相关上下文
-        context = await self._get_relevant_context(
-            question=question,
-            filter_criteria=filter_criteria
+        # 并发的相同请求只执行一次检索与生成
+        return await self.single_flight.do(
+            cache_key,
+            lambda: self._answer_uncached(
+                question, cache_key, chat_history, filter_criteria
+            )
         )
+    
+    async def _answer_uncached(
+        self,
+        question: str,
+        cache_key: str,
+        chat_history: Optional[List[Dict[str, str]]],
+        filter_criteria: Optional[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """缓存未命中时检索并生成回答"""
+        # 语义缓存只用于无历史对话的问题，带历史时答案依赖上下文
+        semantic_vector = None
+        use_semantic = self.semantic_cache is not None and not chat_history
+        if use_semantic:
+            scope = self._semantic_scope(filter_criteria)
+            with span("semantic_cache"):
+                semantic_response, semantic_vector = await self.semantic_cache.lookup(question, scope)
+            if semantic_response is not None:
+                return semantic_response
         
-        # 生成回答
-        if chat_history:
-            response = await self.llm.generate_with_history(
-                messages=[
-                    *chat_history,
-                    {
-                        "role": "system",
-                        "content": self.qa_prompt.format(
-                            context=context,
-                            question=question
-                        )
-                    }
-                ]
+        # 检索并生成回答
+        with span("retrieval"):
+            documents = await self.retriever.search(
+                query=question,
+                filter_criteria=filter_criteria,
+                top_k=self.top_k
             )
-        else:
-            response = await self.llm.generate(
-                prompt=self.qa_prompt.format(
-                    context=context,
-                    question=question
-                )
+        return await self._generate_answer(
+            question,
+            cache_key,
+            documents,
+            chat_history=chat_history,
+            semantic_vector=semantic_vector,
+            semantic_scope=scope if use_semantic else None
+        )
+    
+    async def _generate_answer(
+        self,
+        question: str,
+        cache_key: str,
+        documents: List[Dict[str, Any]],
+        chat_history: Optional[List[Dict[str, str]]] = None,
+        semantic_vector: Optional[Any] = None,
+        semantic_scope: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """根据检索结果组装上下文、生成回答并写入缓存"""
+        with span("prompt"):
+            context, context_stats = self.context_builder.build(question, documents)
+            prompt = self.qa_prompt.format(
+                context=context,
+                question=question
             )
+            prompt_tokens = self._prompt_tokens(prompt, chat_history)
+        logger.info(f"prompt_tokens={prompt_tokens} context={context_stats}")
+        
+        # 生成回答
+        with span("llm"):
+            if chat_history:
+                response = await self.llm.generate_with_history(
+                    messages=self._build_messages(question, context, chat_history)
+                )
+            else:
+                response = await self.llm.generate(prompt=prompt)
         
         result = {
             "question": question,
             "answer": response,
-            "context": context
+            "context": context,
+            "prompt_tokens": prompt_tokens,
+            "context_stats": context_stats
         }
         
         # 缓存结果
         await self.cache.set(cache_key, result)
+        if semantic_scope is not None:
+            self.semantic_cache.store(semantic_vector, result, semantic_scope)
+        
+        return result
+    
+    async def answer_many(
+        self,
+        questions: List[str],
+        filter_criteria: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """批量回答问题，按完成顺序产出结果
+        
+        规范化后相同的问题只回答一次；未命中缓存的问题共用一次向量化和一次多查询检索，
+        生成阶段的并发数不超过 batch_concurrency。每个结果带有问题在输入中的下标 index，
+        单个问题失败时产出带 error 的结果，不影响其他问题。
+        """
+        groups: Dict[str, List[int]] = {}
+        for index, question in enumerate(questions):
+            groups.setdefault(self._cache_key(question, None, filter_criteria), []).append(index)
+        
+        def _items(key: str, result: Dict[str, Any], **extra) -> List[Dict[str, Any]]:
+            return [{**result, **extra, "index": i, "question": questions[i]} for i in groups[key]]
+        
+        # 精确缓存
+        pending = []
+        for key, cached in zip(groups, await self.cache.get_many(list(groups))):
+            if cached:
+                for item in _items(key, cached, cached=True):
+                    yield item
+            else:
+                pending.append(key)
+        if not pending:
+            return
+        
+        pending_questions = [questions[groups[key][0]] for key in pending]
+        try:
+            embeddings = await self.retriever.embed_texts(pending_questions)
+        except Exception as e:
+            logger.warning(f"批量向量化失败，检索时逐个向量化: {str(e)}")
+            embeddings = None
+        
+        # 语义缓存
+        semantic_vectors: Dict[str, Any] = {}
+        scope = None
+        if self.semantic_cache is not None:
+            scope = self._semantic_scope(filter_criteria)
+            remaining = []
+            for i, key in enumerate(pending):
+                response, semantic_vectors[key] = await self.semantic_cache.lookup(
+                    pending_questions[i],
+                    scope,
+                    embeddings[i] if embeddings else None
+                )
+                if response is not None:
+                    for item in _items(key, response, cached=True):
+                        yield item
+                else:
+                    remaining.append(i)
+            pending = [pending[i] for i in remaining]
+            pending_questions = [pending_questions[i] for i in remaining]
+            if embeddings:
+                embeddings = [embeddings[i] for i in remaining]
+            if not pending:
+                return
+        
+        # 一次多查询检索
+        all_documents = await self.retriever.search_many(
+            pending_questions,
+            filter_criteria=filter_criteria,
+            top_k=self.top_k,
+            query_embeddings=embeddings
+        )
+        
+        semaphore = asyncio.Semaphore(self.batch_concurrency)
+        
+        async def _bounded_generate(key: str, question: str, documents: List[Dict[str, Any]]) -> Dict[str, Any]:
+            async with semaphore:
+                return await self._generate_answer(
+                    question,
+                    key,
+                    documents,
+                    semantic_vector=semantic_vectors.get(key),
+                    semantic_scope=scope
+                )
+        
+        async def _answer(key: str, question: str, documents: List[Dict[str, Any]]):
+            # 与其他请求中的相同问题共享一次生成
+            try:
+                result = await self.single_flight.do(
+                    key,
+                    lambda: _bounded_generate(key, question, documents)
+                )
+                return key, result, None
+            except Exception as e:
+                logger.error(f"批量问答失败: {question}, error: {str(e)}")
+                return key, None, str(e)
+        
+        tasks = [
+            asyncio.ensure_future(_answer(key, question, documents))
+            for key, question, documents in zip(pending, pending_questions, all_documents)
+        ]
+        try:
+            for future in asyncio.as_completed(tasks):
+                key, result, error = await future
+                if error is not None:
+                    for i in groups[key]:
+                        yield {"index": i, "question": questions[i], "error": error}
+                else:
+                    for item in _items(key, result, cached=False):
+                        yield item
+        finally:
+            # 客户端断开时取消尚未完成的生成
+            for task in tasks:
+                task.cancel()
+    
+    async def answer_question_stream(
+        self,
+        question: str,
+        chat_history: Optional[List[Dict[str, str]]] = None,
+        filter_criteria: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """流式回答问题
+        
+        依次产出 context、若干 token 和 done 事件；流正常结束后完整回答写入缓存。
+        并发的相同请求共享同一个上游生成流。
+        """
+        cache_key = self._cache_key(question, chat_history, filter_criteria)
+        with span("cache"):
+            cached_response = await self.cache.get(cache_key)
+        if cached_response:
+            logger.info(f"Cache hit for question: {question}")
+            for event in self._cached_events(cached_response):
+                yield event
+            return
+        
+        async for event in self.single_flight.stream(
+            cache_key,
+            lambda: self._stream_uncached(
+                question, cache_key, chat_history, filter_criteria
+            )
+        ):
+            yield event
+    
+    async def _stream_uncached(
+        self,
+        question: str,
+        cache_key: str,
+        chat_history: Optional[List[Dict[str, str]]],
+        filter_criteria: Optional[Dict[str, Any]]
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """缓存未命中时检索并流式生成回答"""
+        semantic_vector = None
+        use_semantic = self.semantic_cache is not None and not chat_history
+        if use_semantic:
+            scope = self._semantic_scope(filter_criteria)
+            with span("semantic_cache"):
+                semantic_response, semantic_vector = await self.semantic_cache.lookup(question, scope)
+            if semantic_response is not None:
+                for event in self._cached_events(semantic_response):
+                    yield event
+                return
+        
+        context, context_stats = await self._get_relevant_context(
+            question=question,
+            filter_criteria=filter_criteria
+        )
+        yield {"event": "context", "data": context}
+        prompt = self.qa_prompt.format(
+            context=context,
+            question=question
+        )
+        prompt_tokens = self._prompt_tokens(prompt, chat_history)
+        logger.info(f"prompt_tokens={prompt_tokens} context={context_stats}")
+        
+        if chat_history:
+            tokens = self.llm.generate_with_history_stream(
+                messages=self._build_messages(question, context, chat_history)
+            )
+        else:
+            tokens = self.llm.generate_stream(prompt=prompt)
+        
+        parts = []
+        async for token in tokens:
+            parts.append(token)
+            yield {"event": "token", "data": token}
+        
+        result = {
+            "question": question,
+            "answer": "".join(parts),
+            "context": context,
+            "prompt_tokens": prompt_tokens,
+            "context_stats": context_stats
+        }
+        await self.cache.set(cache_key, result)
+        if use_semantic:
+            self.semantic_cache.store(semantic_vector, result, scope)
         
-        return result 
\ No newline at end of file
+        yield {"event": "done", "data": {"cached": False, "prompt_tokens": prompt_tokens}}
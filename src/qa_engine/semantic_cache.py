@@ -0,0 +1,259 @@
+from typing import Dict, Any, List, Optional, Tuple, Callable, Awaitable
+from collections import OrderedDict
+import re
+import time
+import numpy as np
+from utils.logger import get_logger
+from utils.metrics import CACHE_EVICTIONS, record_cache
+
+logger = get_logger(__name__)
+
+_NUMBER_PATTERN = re.compile(r"\d+(?:\.\d+)?")
+_CN_DIGITS = {"一": 1, "二": 2, "两": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+_CN_PERIOD_PATTERN = re.compile(r"([一二两三四五六七八九十]+)(?=季度|月|周|期|年|号|日)")
+_RELATIVE_PERIOD_PATTERN = re.compile(r"[本上下今去明前]半?(?:季度|月|年|周)")
+# 地区、机构等专名：两个汉字加常见后缀（华东区、广东省、销售部）
+_CJK_ENTITY_PATTERN = re.compile(r"[\u4e00-\u9fff]{2}(?:区|省|市|县|州|部|店|组)")
+_ASCII_WORD_PATTERN = re.compile(r"[A-Za-z][A-Za-z0-9_-]*")
+
+def _cn_number(text: str) -> int:
+    """一到九十九的中文数字"""
+    if "十" not in text:
+        return _CN_DIGITS.get(text, 0)
+    tens, _, ones = text.partition("十")
+    return (_CN_DIGITS.get(tens, 0) or 1) * 10 + _CN_DIGITS.get(ones, 0)
+
+def key_terms(question: str) -> frozenset:
+    """问题中必须完全一致才能复用答案的词项：数字、时间段、专名和代码
+    
+    通用的句向量对“第二季度华东区”和“第三季度华东区”这类只差一个数字或地名的问题给出很高的相似度，
+    相似度阈值无法区分，因此命中时还要求两者的关键词项相同。
+    """
+    terms = {f"n:{float(number):g}" for number in _NUMBER_PATTERN.findall(question)}
+    terms.update(f"n:{_cn_number(number)}" for number in _CN_PERIOD_PATTERN.findall(question))
+    terms.update(f"p:{period}" for period in _RELATIVE_PERIOD_PATTERN.findall(question))
+    terms.update(f"e:{entity}" for entity in _CJK_ENTITY_PATTERN.findall(question))
+    for match in _ASCII_WORD_PATTERN.finditer(question):
+        word = match.group()
+        # 含数字或大写字母的英文词（Q2、SKU-9931、East），句首单词的大写不算
+        if any(c.isdigit() for c in word) or (match.start() > 0 and any(c.isupper() for c in word)):
+            terms.add(f"w:{word.lower()}")
+    return frozenset(terms)
+
+def _guard(question: str) -> int:
+    """关键词项集合的哈希，与向量一起存入矩阵旁的数组，检索时按整数比较"""
+    return hash(key_terms(question))
+
+class _ScopeIndex:
+    """单个作用域（同一组过滤条件）内的问题向量矩阵"""
+    
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._reset()
+    
+    def _reset(self):
+        """清空所有条目"""
+        self.matrix: Optional[np.ndarray] = None
+        self.valid = np.zeros(0, dtype=bool)
+        self.expires_at = np.zeros(0, dtype=np.float64)
+        self.last_used = np.zeros(0, dtype=np.float64)
+        self.guards = np.zeros(0, dtype=np.int64)
+        self.values: List[Optional[Dict[str, Any]]] = []
+        self.size = 0
+    
+    def _grow(self, dim: int):
+        """按倍数扩容，直到 capacity 为止"""
+        old = 0 if self.matrix is None else self.matrix.shape[0]
+        new = min(self.capacity, max(16, old * 2))
+        matrix = np.zeros((new, dim), dtype=np.float32)
+        if self.matrix is not None:
+            matrix[:old] = self.matrix
+        self.matrix = matrix
+        self.valid = np.concatenate([self.valid, np.zeros(new - old, dtype=bool)])
+        self.expires_at = np.concatenate([self.expires_at, np.zeros(new - old)])
+        self.last_used = np.concatenate([self.last_used, np.zeros(new - old)])
+        self.guards = np.concatenate([self.guards, np.zeros(new - old, dtype=np.int64)])
+        self.values.extend([None] * (new - old))
+    
+    def search(self, vector: np.ndarray, now: float, guard: int = 0) -> Tuple[int, float]:
+        """返回关键词项相同的条目中最相似的有效条目下标及相似度，没有时返回 (-1, -1.0)"""
+        if self.size == 0 or self.matrix is None or self.matrix.shape[1] != vector.shape[0]:
+            return -1, -1.0
+        n = self.size
+        alive = self.valid[:n] & (self.expires_at[:n] > now) & (self.guards[:n] == guard)
+        if not alive.any():
+            return -1, -1.0
+        scores = self.matrix[:n] @ vector
+        scores[~alive] = -np.inf
+        index = int(np.argmax(scores))
+        return index, float(scores[index])
+    
+    def insert(
+        self,
+        vector: np.ndarray,
+        value: Dict[str, Any],
+        expires_at: float,
+        now: float,
+        guard: int = 0
+    ) -> bool:
+        """插入条目，返回是否淘汰了旧条目"""
+        if self.matrix is not None and self.matrix.shape[1] != vector.shape[0]:
+            # 向量维度变化（如更换了embedding模型），旧条目全部失效
+            self._reset()
+        
+        evicted = False
+        n = self.size
+        free = np.flatnonzero(~self.valid[:n] | (self.expires_at[:n] <= now))
+        if free.size:
+            slot = int(free[0])
+        elif n < self.capacity:
+            if self.matrix is None or n >= self.matrix.shape[0]:
+                self._grow(vector.shape[0])
+            slot = n
+            self.size += 1
+        else:
+            slot = int(np.argmin(self.last_used[:n]))
+            evicted = True
+        
+        self.matrix[slot] = vector
+        self.valid[slot] = True
+        self.expires_at[slot] = expires_at
+        self.last_used[slot] = now
+        self.guards[slot] = guard
+        self.values[slot] = value
+        return evicted
+
+class SemanticCache:
+    """语义答案缓存
+    
+    将问题向量化后在内存矩阵中做批量余弦相似度检索，相似度超过阈值、且数字、时间段和专名
+    等关键词项完全相同时直接复用已缓存的答案，从而让同义改写的问题也能命中缓存，
+    而只差一个季度或地区的问题不会拿到别的问题的答案。不同过滤条件对应不同作用域，
+    互不共享答案。
+    """
+    
+    def __init__(
+        self,
+        embed_fn: Callable[[str], Awaitable[List[float]]],
+        similarity_threshold: float = 0.92,
+        max_entries: int = 5000,
+        max_scopes: int = 256,
+        ttl: int = 3600
+    ):
+        """初始化语义缓存
+        
+        Args:
+            embed_fn: 问题向量化函数
+            similarity_threshold: 命中所需的最小余弦相似度
+            max_entries: 每个作用域的最大条目数，超出按LRU淘汰
+            max_scopes: 最大作用域数，超出时淘汰最久未使用的作用域
+            ttl: 条目过期时间（秒）
+        """
+        self.embed_fn = embed_fn
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.max_scopes = max_scopes
+        self.ttl = ttl
+        self._scopes: "OrderedDict[str, _ScopeIndex]" = OrderedDict()
+        self.lookups = 0
+        self.hits = 0
+        self.evictions = 0
+        self.llm_calls_saved = 0
+    
+    async def embed(
+        self,
+        question: str,
+        embedding: Optional[List[float]] = None
+    ) -> Optional[np.ndarray]:
+        """向量化并归一化问题，已有向量时直接归一化，失败时返回None"""
+        try:
+            if embedding is None:
+                embedding = await self.embed_fn(question)
+            vector = np.asarray(embedding, dtype=np.float32)
+        except Exception as e:
+            logger.warning(f"语义缓存向量化失败: {str(e)}")
+            return None
+        norm = np.linalg.norm(vector)
+        if vector.ndim != 1 or norm == 0:
+            return None
+        return vector / norm
+    
+    async def lookup(
+        self,
+        question: str,
+        scope: str = "",
+        embedding: Optional[List[float]] = None
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[np.ndarray]]:
+        """查找语义相近的已缓存答案
+        
+        Args:
+            question: 问题文本
+            scope: 作用域
+            embedding: 已计算好的问题向量，为空时调用 embed_fn
+            
+        Returns:
+            (命中的结果或None, 问题向量)。问题向量可直接传给 store 复用。
+        """
+        self.lookups += 1
+        vector = await self.embed(question, embedding)
+        if vector is None:
+            return None, None
+        
+        index = self._scopes.get(scope)
+        if index is None:
+            record_cache("semantic", 0, 1)
+            return None, vector
+        self._scopes.move_to_end(scope)
+        
+        now = time.monotonic()
+        slot, similarity = index.search(vector, now, _guard(question))
+        if slot < 0 or similarity < self.similarity_threshold:
+            record_cache("semantic", 0, 1)
+            return None, vector
+        
+        index.last_used[slot] = now
+        self.hits += 1
+        record_cache("semantic", 1, 0)
+        self.llm_calls_saved += 1
+        logger.info(f"语义缓存命中 (similarity={similarity:.3f}): {question}")
+        return {**index.values[slot], "semantic_similarity": similarity}, vector
+    
+    def store(
+        self,
+        vector: Optional[np.ndarray],
+        result: Dict[str, Any],
+        scope: str = ""
+    ):
+        """写入缓存条目，关键词项取自 result 中的原问题"""
+        if vector is None:
+            return
+        index = self._scopes.get(scope)
+        if index is None:
+            index = self._scopes[scope] = _ScopeIndex(self.max_entries)
+            while len(self._scopes) > self.max_scopes:
+                _, dropped = self._scopes.popitem(last=False)
+                dropped_entries = int(dropped.valid[:dropped.size].sum())
+                self.evictions += dropped_entries
+                CACHE_EVICTIONS.labels("semantic", "capacity").inc(dropped_entries)
+        self._scopes.move_to_end(scope)
+        
+        now = time.monotonic()
+        if index.insert(vector, result, now + self.ttl, now, _guard(result.get("question", ""))):
+            self.evictions += 1
+            CACHE_EVICTIONS.labels("semantic", "capacity").inc()
+    
+    def clear(self):
+        """清空所有作用域"""
+        self._scopes.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        """语义缓存统计"""
+        return {
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": self.hits / self.lookups if self.lookups else 0.0,
+            "llm_calls_saved": self.llm_calls_saved,
+            "evictions": self.evictions,
+            "scopes": len(self._scopes),
+            "entries": sum(int(i.valid[:i.size].sum()) for i in self._scopes.values()),
+        }
@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 from utils.config import VectorStoreConfig
 
 class BaseRetriever(ABC):
@@ -45,4 +45,47 @@ class BaseRetriever(ABC):
         metadata: Optional[Dict[str, Any]] = None
     ) -> bool:
         """更新文档"""
-        pass 
\ No newline at end of file
+        pass
+    
+    async def search_many(
+        self,
+        queries: List[str],
+        filter_criteria: Optional[Dict[str, Any]] = None,
+        top_k: int = 5,
+        query_embeddings: Optional[List[List[float]]] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """批量搜索，默认实现逐个调用 search"""
+        return [await self.search(query, filter_criteria, top_k) for query in queries]
+    
+    async def upsert_sources(
+        self,
+        sources: List[Tuple[str, List[Dict[str, Any]]]]
+    ) -> Dict[str, int]:
+        """按源文档写入切块，默认实现全部重写"""
+        documents = [
+            {**chunk, "id": f"{source_id}:{index}"}
+            for source_id, chunks in sources
+            for index, chunk in enumerate(chunks)
+        ]
+        if not await self.add_documents(documents):
+            raise RuntimeError("failed to add documents")
+        return {"added": len(documents), "updated": 0, "unchanged": 0, "removed": 0}
+    
+    async def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """使用检索器的向量化函数批量向量化文本"""
+        raise NotImplementedError("retriever does not expose its embedding function")
+    
+    def get_epoch(
+        self,
+        filter_criteria: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """知识库版本标记，知识库变化后应返回不同的值"""
+        return "0"
+    
+    async def warmup(self) -> bool:
+        """预热检索器"""
+        return True
+    
+    async def close(self) -> None:
+        """释放检索器占用的资源"""
+        pass
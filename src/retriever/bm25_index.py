@@ -0,0 +1,185 @@
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from collections import Counter
+from pathlib import Path
+import heapq
+import math
+import os
+import pickle
+import threading
+import time
+from utils.tokens import split_terms
+
+_FORMAT_VERSION = 1
+
+class BM25Index:
+    """进程内BM25倒排索引，用于精确数字、产品名和中文术语的词项检索
+    
+    词项由 split_terms 切分（中文按二字组），不依赖分词词典。索引以 pickle 格式保存在
+    向量集合所在目录，保存时压缩掉已删除文档的空位，启动时直接加载。
+    所有读写都在锁内进行，可以同时被写入线程和事件循环访问。
+    """
+    
+    def __init__(self, path: Path, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._reset()
+        self.dirty = False
+        self.saved_at = time.monotonic()
+    
+    def _reset(self):
+        """清空索引"""
+        self._doc_ids: List[Optional[str]] = []
+        self._doc_lengths: List[int] = []
+        self._doc_terms: List[Tuple[str, ...]] = []
+        self._slots: Dict[str, int] = {}
+        self._free: List[int] = []
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._total_length = 0
+    
+    def __len__(self) -> int:
+        return len(self._slots)
+    
+    def _remove_locked(self, doc_id: str):
+        """删除文档，调用方持有锁"""
+        slot = self._slots.pop(doc_id, None)
+        if slot is None:
+            return
+        for term in self._doc_terms[slot]:
+            postings = self._postings[term]
+            del postings[slot]
+            if not postings:
+                del self._postings[term]
+        self._total_length -= self._doc_lengths[slot]
+        self._doc_ids[slot] = None
+        self._doc_lengths[slot] = 0
+        self._doc_terms[slot] = ()
+        self._free.append(slot)
+    
+    def add(self, doc_ids: List[str], texts: List[str]):
+        """添加或替换文档"""
+        analyzed = [Counter(split_terms(text)) for text in texts]
+        with self._lock:
+            for doc_id, counts in zip(doc_ids, analyzed):
+                self._remove_locked(doc_id)
+                if self._free:
+                    slot = self._free.pop()
+                else:
+                    slot = len(self._doc_ids)
+                    self._doc_ids.append(None)
+                    self._doc_lengths.append(0)
+                    self._doc_terms.append(())
+                length = sum(counts.values())
+                self._doc_ids[slot] = doc_id
+                self._doc_lengths[slot] = length
+                self._doc_terms[slot] = tuple(counts)
+                self._slots[doc_id] = slot
+                self._total_length += length
+                for term, tf in counts.items():
+                    self._postings.setdefault(term, {})[slot] = tf
+            self.dirty = True
+    
+    def remove(self, doc_ids: Iterable[str]):
+        """删除文档"""
+        with self._lock:
+            for doc_id in doc_ids:
+                self._remove_locked(doc_id)
+            self.dirty = True
+    
+    def search(
+        self,
+        query: str,
+        top_k: int = 20,
+        allowed: Optional[Set[str]] = None
+    ) -> List[Tuple[str, float]]:
+        """返回BM25得分最高的文档ID及得分，allowed 不为空时只在这些文档中检索"""
+        terms = set(split_terms(query))
+        with self._lock:
+            total = len(self._slots)
+            if not total or not terms:
+                return []
+            allowed_slots = None
+            if allowed is not None:
+                allowed_slots = {self._slots[doc_id] for doc_id in allowed if doc_id in self._slots}
+            average_length = self._total_length / total
+            scores: Dict[int, float] = {}
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+                for slot, tf in postings.items():
+                    if allowed_slots is not None and slot not in allowed_slots:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[slot] / average_length)
+                    scores[slot] = scores.get(slot, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+            best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+            return [(self._doc_ids[slot], score) for slot, score in best]
+    
+    def rebuild(self, doc_ids: List[str], texts: List[str]):
+        """用全部文档重建索引"""
+        with self._lock:
+            self._reset()
+        self.add(doc_ids, texts)
+    
+    def load(self) -> bool:
+        """从磁盘加载索引，文件不存在或格式不符时返回False"""
+        try:
+            with open(self.path, "rb") as f:
+                data = pickle.load(f)
+        except FileNotFoundError:
+            return False
+        if data.get("version") != _FORMAT_VERSION:
+            return False
+        
+        with self._lock:
+            self._reset()
+            self._doc_ids = data["doc_ids"]
+            self._doc_lengths = data["doc_lengths"]
+            self._postings = data["postings"]
+            self._slots = {doc_id: slot for slot, doc_id in enumerate(self._doc_ids)}
+            self._total_length = sum(self._doc_lengths)
+            doc_terms: List[List[str]] = [[] for _ in self._doc_ids]
+            for term, postings in self._postings.items():
+                for slot in postings:
+                    doc_terms[slot].append(term)
+            self._doc_terms = [tuple(terms) for terms in doc_terms]
+            self.dirty = False
+        return True
+    
+    def save(self):
+        """压缩空位后原子写入磁盘
+        
+        锁内只复制一份快照（逐个倒排表的浅拷贝），压缩和序列化在锁外进行，
+        保存期间检索和写入不会被阻塞。
+        """
+        with self._lock:
+            doc_ids = list(self._doc_ids)
+            doc_lengths = list(self._doc_lengths)
+            snapshot = {term: postings.copy() for term, postings in self._postings.items()}
+            self.dirty = False
+            self.saved_at = time.monotonic()
+        
+        live = [slot for slot, doc_id in enumerate(doc_ids) if doc_id is not None]
+        remap = {slot: index for index, slot in enumerate(live)}
+        data = {
+            "version": _FORMAT_VERSION,
+            "doc_ids": [doc_ids[slot] for slot in live],
+            "doc_lengths": [doc_lengths[slot] for slot in live],
+            "postings": {
+                term: {remap[slot]: tf for slot, tf in postings.items()}
+                for term, postings in snapshot.items()
+            },
+        }
+        
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+    
+    def save_if_due(self, interval: float):
+        """有未保存的修改且距上次保存超过 interval 秒时保存"""
+        if self.dirty and time.monotonic() - self.saved_at >= interval:
+            self.save()
@@ -1,27 +1,87 @@
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Set, Tuple
 import chromadb
 from chromadb.config import Settings
+from chromadb.utils import embedding_functions
 import aiohttp
 import numpy as np
+import json
+import time
+from pathlib import Path
 from .base import BaseRetriever
+from .bm25_index import BM25Index
+from .metadata_index import MetadataIndex
+from .chunking import content_id
+from .epochs import CorpusEpochs
+from .fingerprint_index import FingerprintIndex
 from utils.logger import get_logger
 from utils.config import VectorStoreConfig
+from utils.embedding_cache import CachedEmbedder, EmbeddingCache
+from utils.executor import BoundedExecutor
+from utils.metrics import RETRIEVAL_HITS, RETRIEVAL_LATENCY
 
 logger = get_logger(__name__)
 
 class ChromaRetriever(BaseRetriever):
     """ChromaDB检索器实现"""
     
-    def __init__(self, config: VectorStoreConfig):
-        """初始化检索器"""
+    def __init__(
+        self,
+        config: VectorStoreConfig,
+        embedder: Optional[Any] = None,
+        embedding_cache: Optional[EmbeddingCache] = None
+    ):
+        """初始化检索器
+        
+        Args:
+            config: 向量存储配置
+            embedder: 提供 embed_texts 批量向量化接口的对象（如LLM）；为空时使用集合内置的向量化函数
+            embedding_cache: 持久化向量缓存，入库和检索都先查缓存，只对未命中的文本向量化
+        """
         self.config = config
+        self.embedder = embedder
+        self.embedding_function = embedding_functions.DefaultEmbeddingFunction()
+        self.embedding_cache = embedding_cache
+        # 入库使用的向量化：内置向量化函数在写入线程池中计算，批量入库不占用检索线程
+        self._write_embedder = embedder
+        if embedding_cache is not None:
+            # 集合内置的向量化函数同样经过缓存，此后所有写入和检索都使用外部计算的向量
+            if embedder is not None:
+                self.embedder = self._write_embedder = CachedEmbedder(embedder.embed_texts, embedding_cache)
+            else:
+                self.embedder = CachedEmbedder(self._embed_with_function, embedding_cache)
+                self._write_embedder = CachedEmbedder(self._embed_for_write, embedding_cache)
         self.client = self._initialize_client()
+        self.epochs = CorpusEpochs(
+            Path(self.config.persist_directory) / f"{self.config.collection_name}.epochs.json",
+            partition_field=self.config.epoch_partition_field
+        )
+        self.fingerprints = FingerprintIndex(
+            Path(self.config.persist_directory) / f"{self.config.collection_name}.fingerprints.sqlite3"
+        )
+        self.lexical = BM25Index(
+            Path(self.config.persist_directory) / f"{self.config.collection_name}.bm25.pkl"
+        ) if self.config.hybrid_search else None
+        self.metadata_index = MetadataIndex(
+            fields=self.config.metadata_index_fields,
+            date_field=self.config.metadata_date_field
+        )
+        # chromadb是同步API，检索和写入分别放到独立的有界线程池，
+        # 避免阻塞事件循环，也避免大批量写入占满线程导致查询排队
+        self._search_executor = BoundedExecutor(
+            "chroma-search",
+            max_workers=self.config.search_workers,
+            max_queue=self.config.search_max_queue
+        )
+        self._write_executor = BoundedExecutor(
+            "chroma-write",
+            max_workers=self.config.write_workers
+        )
     
     def _initialize_client(self) -> chromadb.Client:
         """初始化ChromaDB客户端"""
         client = chromadb.Client(
             Settings(
-                persist_directory="data/chroma",
+                persist_directory=self.config.persist_directory,
                 is_persistent=True,
                 anonymized_telemetry=False  # 关闭遥测
             )
@@ -29,11 +89,105 @@ class ChromaRetriever(BaseRetriever):
         
         # 获取或创建集合
         self.collection = client.get_or_create_collection(
-            name=self.config.collection_name
+            name=self.config.collection_name,
+            embedding_function=self.embedding_function
         )
         
         return client
     
+    def _load_indexes(self, count: int):
+        """从集合构建元数据索引；词项索引优先从磁盘加载，与集合文档数不一致时重建"""
+        rebuild_lexical = self.lexical is not None and not (
+            self.lexical.load() and len(self.lexical) == count
+        )
+        include = ["metadatas", "documents"] if rebuild_lexical else ["metadatas"]
+        doc_ids, texts, metadatas = [], [], []
+        for offset in range(0, count, 1000):
+            page = self.collection.get(offset=offset, limit=1000, include=include)
+            doc_ids.extend(page["ids"])
+            metadatas.extend(page["metadatas"])
+            if rebuild_lexical:
+                texts.extend(page["documents"])
+        self.metadata_index.rebuild(doc_ids, metadatas)
+        if rebuild_lexical:
+            self.lexical.rebuild(doc_ids, texts)
+            self.lexical.save()
+            logger.info(f"词项索引已重建，文档数: {len(self.lexical)}")
+    
+    async def warmup(self) -> bool:
+        """预热集合，触发集合与索引加载"""
+        try:
+            count = await self._search_executor.run(self.collection.count)
+            logger.info(f"ChromaDB集合 {self.config.collection_name} 已加载，文档数: {count}")
+            await self._write_executor.run(self._load_indexes, count)
+            return True
+        except Exception as e:
+            logger.error(f"ChromaDB warmup error: {str(e)}")
+            return False
+    
+    async def close(self) -> None:
+        """关闭线程池与指纹索引，保存词项索引"""
+        self._search_executor.shutdown(wait=True)
+        self._write_executor.shutdown(wait=True)
+        self.fingerprints.close()
+        if self.embedding_cache is not None:
+            self.embedding_cache.close()
+        if self.lexical is not None and self.lexical.dirty:
+            self.lexical.save()
+    
+    def executor_stats(self) -> Dict[str, Dict[str, int]]:
+        """检索与写入线程池的排队与执行统计"""
+        return {
+            "search": self._search_executor.stats(),
+            "write": self._write_executor.stats(),
+        }
+    
+    def get_epoch(
+        self,
+        filter_criteria: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """知识库版本标记"""
+        return self.epochs.token(filter_criteria)
+    
+    def _sync_indexes(
+        self,
+        ids: List[str],
+        texts: Optional[List[str]],
+        metadatas: List[Optional[Dict[str, Any]]],
+        removed_ids: Optional[List[str]] = None
+    ):
+        """同步元数据索引和词项索引，在写入线程中调用；texts 为空表示内容未变"""
+        if removed_ids:
+            self.metadata_index.remove(removed_ids)
+        if ids:
+            self.metadata_index.add(ids, metadatas)
+        if self.lexical is None:
+            return
+        if removed_ids:
+            self.lexical.remove(removed_ids)
+        if ids and texts is not None:
+            self.lexical.add(ids, texts)
+        self.lexical.save_if_due(self.config.lexical_save_interval)
+    
+    async def _embed_with_function(
+        self,
+        texts: List[str],
+        executor: Optional[BoundedExecutor] = None
+    ) -> List[List[float]]:
+        """使用集合内置的向量化函数，默认在检索线程池中计算"""
+        embeddings = await (executor or self._search_executor).run(self.embedding_function, texts)
+        return [np.asarray(vector, dtype=np.float32).tolist() for vector in embeddings]
+    
+    async def _embed_for_write(self, texts: List[str]) -> List[List[float]]:
+        """入库时在写入线程池中向量化"""
+        return await self._embed_with_function(texts, self._write_executor)
+    
+    async def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """批量向量化，与入库和检索使用同一个向量化函数"""
+        if self.embedder is not None:
+            return await self.embedder.embed_texts(texts)
+        return await self._embed_with_function(texts)
+    
     async def add_documents(
         self,
         documents: List[Dict[str, Any]],
@@ -41,20 +195,34 @@ class ChromaRetriever(BaseRetriever):
     ) -> bool:
         """添加文档到知识库"""
         try:
-            # 准备数据
-            ids = [str(i) for i in range(len(documents))]
-            texts = [doc["content"] for doc in documents]
-            metadatas = [
-                {**doc.get("metadata", {}), **(metadata or {})}
-                for doc in documents
-            ]
+            # 准备数据：未指定ID时使用内容哈希，重复入库同一内容会覆盖而不是冲突
+            merged: Dict[str, Dict[str, Any]] = {}
+            for doc in documents:
+                doc_metadata = {**(doc.get("metadata") or {}), **(metadata or {})}
+                doc_id = str(doc.get("id") or content_id(doc["content"], doc_metadata))
+                merged[doc_id] = {"content": doc["content"], "metadata": doc_metadata}
+            ids = list(merged)
+            texts = [doc["content"] for doc in merged.values()]
+            # chromadb不接受空的元数据字典，空元数据以None写入
+            metadatas = [doc["metadata"] or None for doc in merged.values()]
+            
+            # 使用外部向量化时批量计算向量，否则由集合内置函数在写入线程中计算
+            embeddings = None
+            if self._write_embedder is not None:
+                embeddings = await self._write_embedder.embed_texts(texts)
+            
+            def _add():
+                self.collection.upsert(
+                    ids=ids,
+                    documents=texts,
+                    embeddings=embeddings,
+                    metadatas=metadatas
+                )
+                self.epochs.bump(metadatas)
+                self._sync_indexes(ids, texts, metadatas)
             
             # 添加到集合
-            self.collection.add(
-                ids=ids,
-                documents=texts,
-                metadatas=metadatas
-            )
+            await self._write_executor.run(_add)
             
             return True
             
@@ -62,43 +230,216 @@ class ChromaRetriever(BaseRetriever):
             logger.error(f"ChromaDB add_documents error: {str(e)}")
             return False
     
+    def _structured_filters(
+        self,
+        filter_criteria: Optional[Dict[str, Any]]
+    ) -> Optional[Dict[str, Any]]:
+        """过滤条件只包含索引字段取值和日期范围时返回该条件，否则（chromadb where 表达式）返回None"""
+        if not filter_criteria:
+            return None
+        allowed = {*self.metadata_index.fields, "date_from", "date_to"}
+        if set(filter_criteria) - allowed:
+            return None
+        if any(isinstance(value, dict) for value in filter_criteria.values()):
+            return None
+        return filter_criteria
+    
+    def _where_clause(self, filters: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """把结构化过滤条件中的字段取值转换为 chromadb where 表达式（日期范围不包含在内）"""
+        clauses = []
+        for field in self.metadata_index.fields:
+            value = filters.get(field)
+            if value is None:
+                continue
+            if isinstance(value, (list, tuple, set)):
+                clauses.append({field: {"$in": list(value)}})
+            else:
+                clauses.append({field: value})
+        if not clauses:
+            return None
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+    
     async def search(
         self,
         query: str,
         filter_criteria: Optional[Dict[str, Any]] = None,
         top_k: int = 5
     ) -> List[Dict[str, Any]]:
-        """搜索相关文档"""
+        """搜索相关文档
+        
+        开启混合检索时，向量检索结果与BM25词项检索结果按倒数排名融合（RRF）。
+        结构化过滤条件（category/department/type 取值、date_from/date_to）先通过元数据索引
+        解析为候选文档集合，向量检索和词项检索都只在候选集合内进行。
+        """
+        return (await self.search_many([query], filter_criteria, top_k))[0]
+    
+    async def search_many(
+        self,
+        queries: List[str],
+        filter_criteria: Optional[Dict[str, Any]] = None,
+        top_k: int = 5,
+        query_embeddings: Optional[List[List[float]]] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """一次检索多个查询，所有查询共用一次向量化和一次 collection.query 调用
+        
+        Args:
+            queries: 查询文本列表
+            filter_criteria: 所有查询共用的过滤条件
+            top_k: 每个查询返回的文档数
+            query_embeddings: 已计算好的查询向量（须来自 embed_texts），为空时在此计算
+            
+        Returns:
+            与 queries 顺序一致的检索结果列表
+        """
+        if not queries:
+            return []
+        started = time.perf_counter()
         try:
+            vector_top_k = self.config.vector_top_k or top_k
+            n_results = vector_top_k
+            where = filter_criteria
+            query_ids = None
+            candidates = None
+            if (structured := self._structured_filters(filter_criteria)) is not None:
+                stage_started = time.perf_counter()
+                candidates = self.metadata_index.resolve(structured)
+                RETRIEVAL_LATENCY.labels("filter").observe(time.perf_counter() - stage_started)
+                if not candidates:
+                    return [[] for _ in queries]
+                if len(candidates) <= self.config.filter_max_candidate_ids:
+                    where, query_ids = None, list(candidates)
+                else:
+                    # 候选集过大时字段取值下推为 where，日期范围在结果上过滤，因此多取一些
+                    where = self._where_clause(structured)
+                    n_results = vector_top_k * self.config.filter_overfetch
+            
             # 执行搜索
-            results = self.collection.query(
-                query_texts=[query],
-                n_results=top_k,
-                where=filter_criteria
-            )
+            if query_embeddings is not None:
+                query_args = {"query_embeddings": query_embeddings}
+            elif self.embedder is not None:
+                stage_started = time.perf_counter()
+                query_args = {"query_embeddings": await self.embedder.embed_texts(queries)}
+                RETRIEVAL_LATENCY.labels("embed").observe(time.perf_counter() - stage_started)
+            else:
+                query_args = {"query_texts": queries}
             
-            # 格式化结果
-            documents = []
-            for i in range(len(results["documents"][0])):
-                documents.append({
-                    "content": results["documents"][0][i],
-                    "metadata": results["metadatas"][0][i],
-                    "distance": results["distances"][0][i]
+            def _query():
+                # 词项检索与向量检索一起在检索线程池中执行，不占用事件循环
+                lexical_hits = [[] for _ in queries]
+                if self.lexical is not None:
+                    stage_started = time.perf_counter()
+                    lexical_hits = [
+                        self.lexical.search(query, self.config.lexical_top_k, allowed=candidates)
+                        for query in queries
+                    ]
+                    RETRIEVAL_LATENCY.labels("lexical").observe(time.perf_counter() - stage_started)
+                
+                stage_started = time.perf_counter()
+                results = self.collection.query(
+                    **query_args,
+                    ids=query_ids,
+                    n_results=n_results,
+                    where=where
+                )
+                # 只在词项检索中命中的文档需要单独取回，过滤条件同样生效
+                vector_ids = {doc_id for ids in results["ids"] for doc_id in ids}
+                lexical_only = list({
+                    doc_id: None
+                    for hits in lexical_hits
+                    for doc_id, _ in hits
+                    if doc_id not in vector_ids
                 })
+                extra = None
+                if lexical_only:
+                    extra = self.collection.get(
+                        ids=lexical_only,
+                        where=filter_criteria if candidates is None else None,
+                        include=["documents", "metadatas"]
+                    )
+                RETRIEVAL_LATENCY.labels("vector").observe(time.perf_counter() - stage_started)
+                return results, lexical_hits, extra
+            
+            results, lexical_hits, extra = await self._search_executor.run(_query)
             
-            return documents
+            lexical_documents: Dict[str, Dict[str, Any]] = {}
+            if extra is not None:
+                for i, doc_id in enumerate(extra["ids"]):
+                    lexical_documents[doc_id] = {
+                        "content": extra["documents"][i],
+                        "metadata": extra["metadatas"][i],
+                        "distance": None
+                    }
+            
+            fused = [
+                self._fuse_results(results, q, lexical_hits[q], lexical_documents, candidates, vector_top_k, top_k)
+                for q in range(len(queries))
+            ]
+            for hits in fused:
+                RETRIEVAL_HITS.observe(len(hits))
+            return fused
             
         except Exception as e:
             logger.error(f"ChromaDB search error: {str(e)}")
-            return []
+            return [[] for _ in queries]
+        finally:
+            RETRIEVAL_LATENCY.labels("total").observe(time.perf_counter() - started)
+    
+    def _fuse_results(
+        self,
+        results: Dict[str, Any],
+        q: int,
+        lexical_hits: List[Tuple[str, float]],
+        lexical_documents: Dict[str, Dict[str, Any]],
+        candidates: Optional[Set[str]],
+        vector_top_k: int,
+        top_k: int
+    ) -> List[Dict[str, Any]]:
+        """格式化第 q 个查询的向量检索结果，并与词项检索结果融合"""
+        documents: Dict[str, Dict[str, Any]] = {}
+        for i in range(len(results["documents"][q])):
+            doc_id = results["ids"][q][i]
+            if candidates is not None and doc_id not in candidates:
+                continue
+            documents[doc_id] = {
+                "content": results["documents"][q][i],
+                "metadata": results["metadatas"][q][i],
+                "distance": results["distances"][q][i]
+            }
+            if len(documents) >= vector_top_k:
+                break
+        vector_ranked = list(documents)
+        if not lexical_hits:
+            return list(documents.values())[:top_k]
+        
+        for doc_id, _ in lexical_hits:
+            if doc_id not in documents and doc_id in lexical_documents:
+                documents[doc_id] = lexical_documents[doc_id]
+        
+        # 倒数排名融合：score = Σ 1 / (rrf_k + rank)
+        scores: Dict[str, float] = {}
+        for rank, doc_id in enumerate(vector_ranked):
+            scores[doc_id] = 1.0 / (self.config.rrf_k + rank + 1)
+        for rank, (doc_id, _) in enumerate(lexical_hits):
+            if doc_id in documents:
+                scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (self.config.rrf_k + rank + 1)
+        
+        ranked = sorted(scores, key=scores.get, reverse=True)[:top_k]
+        return [{**documents[doc_id], "score": scores[doc_id]} for doc_id in ranked]
     
     async def delete_documents(
         self,
         document_ids: List[str]
     ) -> bool:
         """删除文档"""
-        try:
+        def _delete():
+            existing = self.collection.get(ids=document_ids, include=["metadatas"])
             self.collection.delete(ids=document_ids)
+            self.fingerprints.remove_chunks(document_ids)
+            self.epochs.bump(existing["metadatas"] or [])
+            self._sync_indexes([], None, [], removed_ids=document_ids)
+        
+        try:
+            await self._write_executor.run(_delete)
             return True
         except Exception as e:
             logger.error(f"ChromaDB delete_documents error: {str(e)}")
@@ -111,16 +452,139 @@ class ChromaRetriever(BaseRetriever):
         metadata: Optional[Dict[str, Any]] = None
     ) -> bool:
         """更新文档"""
+        new_metadata = {
+            **(document.get("metadata") or {}),
+            **(metadata or {})
+        }
+        
+        def _update(
+            content_changed: bool,
+            embeddings: Optional[List[List[float]]],
+            old_metadatas: List[Optional[Dict[str, Any]]]
+        ):
+            if content_changed:
+                self.collection.update(
+                    ids=[document_id],
+                    documents=[document["content"]],
+                    embeddings=embeddings,
+                    metadatas=[new_metadata or None]
+                )
+            else:
+                self.collection.update(
+                    ids=[document_id],
+                    metadatas=[new_metadata or None]
+                )
+            # 集合的 update 对不存在的文档不做任何事，索引同样不应出现该文档
+            if old_metadatas:
+                self._sync_indexes(
+                    [document_id],
+                    [document["content"]] if content_changed else None,
+                    [new_metadata]
+                )
+            # 手动更新后指纹不再对应源文档，下次重新入库时强制重写该块
+            self.fingerprints.remove_chunks([document_id])
+            # 新旧元数据所在的分区都需要失效
+            self.epochs.bump([*old_metadatas, new_metadata])
+        
         try:
-            self.collection.update(
+            existing = await self._write_executor.run(
+                self.collection.get,
                 ids=[document_id],
-                documents=[document["content"]],
-                metadatas=[{
-                    **document.get("metadata", {}),
-                    **(metadata or {})
-                }]
+                include=["documents", "metadatas"]
             )
+            old_metadatas = existing["metadatas"] or []
+            content_changed = not existing["documents"] or existing["documents"][0] != document["content"]
+            if not content_changed and old_metadatas and (old_metadatas[0] or {}) == new_metadata:
+                return True
+            
+            # 内容未变时只更新元数据，不重新向量化
+            embeddings = None
+            if content_changed and self._write_embedder is not None:
+                embeddings = await self._write_embedder.embed_texts([document["content"]])
+            await self._write_executor.run(_update, content_changed, embeddings, old_metadatas)
             return True
         except Exception as e:
             logger.error(f"ChromaDB update_document error: {str(e)}")
-            return False 
\ No newline at end of file
+            return False
+    
+    async def upsert_sources(
+        self,
+        sources: List[Tuple[str, List[Dict[str, Any]]]]
+    ) -> Dict[str, int]:
+        """按源文档增量写入切块
+        
+        对比指纹索引中记录的块哈希，只向量化并写入新增或内容变化的块，
+        仅元数据变化的块只更新元数据，源文档中已消失的块被删除。
+        
+        Args:
+            sources: [(source_id, [{"content", "metadata"}, ...])]，块按顺序排列
+            
+        Returns:
+            新增、更新、未变和删除的块数
+        """
+        counts = {"added": 0, "updated": 0, "unchanged": 0, "removed": 0}
+        latest = dict(sources)
+        existing = await self._write_executor.run(self.fingerprints.get_sources, list(latest))
+        
+        write_ids, write_texts, write_metadatas = [], [], []
+        metadata_ids, metadata_values = [], []
+        removed_ids = []
+        records: Dict[str, List[Tuple[int, str, str, str]]] = {}
+        for source_id, chunks in latest.items():
+            previous = existing.get(source_id, {})
+            rows = []
+            for index, chunk in enumerate(chunks):
+                chunk_metadata = chunk.get("metadata") or {}
+                chunk_id = f"{source_id}:{index}"
+                content_hash = content_id(chunk["content"])
+                metadata_hash = content_id(
+                    json.dumps(chunk_metadata, sort_keys=True, ensure_ascii=False)
+                )
+                rows.append((index, chunk_id, content_hash, metadata_hash))
+                
+                old = previous.get(index)
+                if old is None or old[1] != content_hash:
+                    counts["added" if old is None else "updated"] += 1
+                    write_ids.append(chunk_id)
+                    write_texts.append(chunk["content"])
+                    write_metadatas.append(chunk_metadata or None)
+                elif old[2] != metadata_hash:
+                    counts["updated"] += 1
+                    metadata_ids.append(chunk_id)
+                    metadata_values.append(chunk_metadata or None)
+                else:
+                    counts["unchanged"] += 1
+            
+            stale = [chunk_id for index, (chunk_id, _, _) in previous.items() if index >= len(chunks)]
+            removed_ids.extend(stale)
+            counts["removed"] += len(stale)
+            records[source_id] = rows
+        
+        if not (write_ids or metadata_ids or removed_ids):
+            return counts
+        
+        embeddings = None
+        if write_texts and self._write_embedder is not None:
+            embeddings = await self._write_embedder.embed_texts(write_texts)
+        
+        def _write():
+            touched = [*write_ids, *metadata_ids, *removed_ids]
+            old_metadatas = self.collection.get(ids=touched, include=["metadatas"])["metadatas"] or []
+            if removed_ids:
+                self.collection.delete(ids=removed_ids)
+            if write_ids:
+                self.collection.upsert(
+                    ids=write_ids,
+                    documents=write_texts,
+                    embeddings=embeddings,
+                    metadatas=write_metadatas
+                )
+            if metadata_ids:
+                self.collection.update(ids=metadata_ids, metadatas=metadata_values)
+            self.fingerprints.replace_sources(records)
+            self.epochs.bump([*old_metadatas, *write_metadatas, *metadata_values])
+            self._sync_indexes(write_ids, write_texts, write_metadatas, removed_ids=removed_ids)
+            self._sync_indexes(metadata_ids, None, metadata_values)
+        
+        await self._write_executor.run(_write)
+        return counts
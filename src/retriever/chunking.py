@@ -0,0 +1,74 @@
+from typing import Any, Dict, List, Optional
+import hashlib
+import json
+import re
+from utils.tokens import estimate_tokens
+
+# 在中英文句末标点和换行之后切分句子，标点保留在前一句
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[。！？!?；;\n])")
+
+def content_id(content: str, metadata: Optional[Dict[str, Any]] = None) -> str:
+    """根据内容（及元数据）生成稳定的文档ID，相同内容重复入库得到相同ID"""
+    digest = hashlib.sha256(content.encode("utf-8"))
+    if metadata:
+        digest.update(json.dumps(metadata, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    return digest.hexdigest()[:32]
+
+def split_sentences(text: str) -> List[str]:
+    """切分句子，去掉空白句"""
+    return [s for s in _SENTENCE_BOUNDARY.split(text) if s.strip()]
+
+def _hard_split(text: str, max_tokens: int) -> List[str]:
+    """没有句子边界可用时按字符切分超长文本"""
+    pieces = []
+    while text:
+        # 按估算比例取一段，再逐步收缩直到不超过预算
+        length = max(1, int(len(text) * max_tokens / max(estimate_tokens(text), 1)))
+        while length > 1 and estimate_tokens(text[:length]) > max_tokens:
+            length = int(length * 0.9)
+        pieces.append(text[:length])
+        text = text[length:]
+    return pieces
+
+def split_text(text: str, max_tokens: int = 512, overlap_tokens: int = 64) -> List[str]:
+    """把文本切分为不超过 max_tokens 的块
+    
+    优先在句子边界切分，相邻块之间保留不超过 overlap_tokens 的重叠句子，
+    以免答案跨块时丢失上下文。
+    """
+    text = text.strip()
+    if not text:
+        return []
+    if estimate_tokens(text) <= max_tokens:
+        return [text]
+    
+    units: List[tuple] = []
+    for sentence in split_sentences(text):
+        tokens = estimate_tokens(sentence)
+        if tokens > max_tokens:
+            units.extend((piece, estimate_tokens(piece)) for piece in _hard_split(sentence, max_tokens))
+        else:
+            units.append((sentence, tokens))
+    
+    chunks: List[str] = []
+    current: List[tuple] = []
+    current_tokens = 0
+    for unit in units:
+        if current and current_tokens + unit[1] > max_tokens:
+            chunks.append("".join(u[0] for u in current).strip())
+            # 从上一块末尾带入重叠句子
+            overlap: List[tuple] = []
+            overlap_size = 0
+            for previous in reversed(current):
+                if overlap_size + previous[1] > overlap_tokens:
+                    break
+                overlap.insert(0, previous)
+                overlap_size += previous[1]
+            if overlap_size + unit[1] > max_tokens:
+                overlap, overlap_size = [], 0
+            current, current_tokens = overlap, overlap_size
+        current.append(unit)
+        current_tokens += unit[1]
+    if current:
+        chunks.append("".join(u[0] for u in current).strip())
+    return [chunk for chunk in chunks if chunk]
@@ -0,0 +1,133 @@
+from typing import Any, Dict, Iterable, Optional
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from utils.logger import get_logger
+
+try:
+    import fcntl
+except ImportError:  # Windows：只能保证单进程内的互斥
+    fcntl = None
+
+logger = get_logger(__name__)
+
+# 文件系统时间戳的粒度上限（部分文件系统为1~2秒），同一粒度内的两次写入修改时间可能相同
+_MTIME_GRANULARITY_NS = 2_000_000_000
+
+class CorpusEpochs:
+    """知识库版本号（epoch）
+    
+    每次写入知识库时递增全局epoch；如果配置了分区字段（如 category），写入涉及的
+    分区epoch也会递增。问答缓存键中带上epoch，知识库变化后旧缓存自然失效，
+    而某个分区的写入不会影响只查询其他分区的缓存。
+    
+    版本号持久化到集合目录下的JSON文件。递增时在旁边的 .lock 文件上加排他锁（flock），
+    在锁内重新读取、递增并写回，多个worker并发写入不会丢失递增。读取时用文件的
+    修改时间、inode和大小判断是否被其他进程改过；读到的文件如果刚修改不久（仍在
+    时间戳粒度内），下次读取仍比较文件内容，不会漏掉同一时间戳内的第二次写入。
+    """
+    
+    _thread_lock = threading.Lock()
+    
+    def __init__(self, path: Path, partition_field: Optional[str] = None):
+        self.path = path
+        self.lock_path = path.with_name(path.name + ".lock")
+        self.partition_field = partition_field
+        self.epoch = 0
+        self.partitions: Dict[str, int] = {}
+        self._signature = None
+        self._stable = False
+        self._reload()
+    
+    @contextmanager
+    def _locked(self):
+        """跨进程互斥：在锁文件上加排他锁"""
+        with self._thread_lock:
+            if fcntl is None:
+                yield
+                return
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.lock_path, "a") as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    
+    def _reload(self, force: bool = False):
+        """文件被其他进程修改过时重新加载；force 为True时总是读取文件内容"""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        signature = (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+        if not force and self._stable and signature == self._signature:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.epoch = data.get("epoch", 0)
+            self.partitions = data.get("partitions", {})
+            self._signature = signature
+            # 读取时文件已修改超过一个时间戳粒度，之后的写入一定会改变修改时间
+            self._stable = time.time_ns() - stat.st_mtime_ns > _MTIME_GRANULARITY_NS
+        except Exception as e:
+            logger.warning(f"读取知识库版本文件失败: {str(e)}")
+    
+    def _save(self):
+        """原子写入版本文件"""
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(
+                    {"epoch": self.epoch, "partitions": self.partitions},
+                    f,
+                    ensure_ascii=False
+                )
+            os.replace(tmp_path, self.path)
+            stat = os.stat(self.path)
+            self._signature = (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+            self._stable = False
+        except Exception as e:
+            logger.warning(f"写入知识库版本文件失败: {str(e)}")
+    
+    def bump(self, metadatas: Iterable[Optional[Dict[str, Any]]] = ()):
+        """知识库发生写入后递增版本号，读取、递增、写回在文件锁内完成"""
+        values = set()
+        if self.partition_field:
+            values = {
+                str(metadata[self.partition_field])
+                for metadata in metadatas
+                if metadata and self.partition_field in metadata
+            }
+        with self._locked():
+            self._reload(force=True)
+            self.epoch += 1
+            for value in values:
+                self.partitions[value] = self.partitions.get(value, 0) + 1
+            self._save()
+    
+    def _partition_value(self, filter_criteria: Optional[Dict[str, Any]]) -> Optional[str]:
+        """过滤条件是否把查询限定在单个分区内，是则返回分区值"""
+        if not self.partition_field or not filter_criteria:
+            return None
+        clauses = filter_criteria.get("$and", [filter_criteria])
+        for clause in clauses:
+            condition = clause.get(self.partition_field)
+            if isinstance(condition, dict):
+                condition = condition.get("$eq")
+            if isinstance(condition, (str, int, float, bool)):
+                return str(condition)
+        return None
+    
+    def token(self, filter_criteria: Optional[Dict[str, Any]] = None) -> str:
+        """返回查询对应的版本标记，用于构建缓存键"""
+        self._reload()
+        value = self._partition_value(filter_criteria)
+        if value is not None:
+            return f"{self.partition_field}={value}:{self.partitions.get(value, 0)}"
+        return f"all:{self.epoch}"
@@ -0,0 +1,77 @@
+from typing import Dict, Iterable, List, Tuple
+from pathlib import Path
+import sqlite3
+import threading
+
+class FingerprintIndex:
+    """内容指纹索引：记录每个源文档切块后的块ID与内容哈希
+    
+    与向量集合存放在同一目录下的SQLite文件中。重新入库同一个源文档时，
+    据此判断哪些块是新增、变化、未变或已消失，只对新增和变化的块做向量化与写入。
+    """
+    
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """CREATE TABLE IF NOT EXISTS chunks (
+                    source_id TEXT NOT NULL,
+                    chunk_index INTEGER NOT NULL,
+                    chunk_id TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    metadata_hash TEXT NOT NULL,
+                    PRIMARY KEY (source_id, chunk_index)
+                )"""
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_chunks_chunk_id ON chunks (chunk_id)"
+            )
+    
+    def get_sources(self, source_ids: List[str]) -> Dict[str, Dict[int, Tuple[str, str, str]]]:
+        """查询源文档已入库的块：{source_id: {chunk_index: (chunk_id, content_hash, metadata_hash)}}"""
+        result: Dict[str, Dict[int, Tuple[str, str, str]]] = {sid: {} for sid in source_ids}
+        with self._lock:
+            # SQLite单条语句的参数个数有限，分批查询
+            for start in range(0, len(source_ids), 500):
+                batch = source_ids[start:start + 500]
+                rows = self._conn.execute(
+                    "SELECT source_id, chunk_index, chunk_id, content_hash, metadata_hash "
+                    f"FROM chunks WHERE source_id IN ({','.join('?' * len(batch))})",
+                    batch
+                ).fetchall()
+                for source_id, chunk_index, chunk_id, content_hash, metadata_hash in rows:
+                    result[source_id][chunk_index] = (chunk_id, content_hash, metadata_hash)
+        return result
+    
+    def replace_sources(
+        self,
+        sources: Dict[str, List[Tuple[int, str, str, str]]]
+    ):
+        """用新的块列表覆盖源文档的指纹记录：{source_id: [(chunk_index, chunk_id, content_hash, metadata_hash)]}"""
+        with self._lock, self._conn:
+            for source_id, rows in sources.items():
+                self._conn.execute("DELETE FROM chunks WHERE source_id = ?", (source_id,))
+                self._conn.executemany(
+                    "INSERT INTO chunks (source_id, chunk_index, chunk_id, content_hash, metadata_hash) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [(source_id, *row) for row in rows]
+                )
+    
+    def remove_chunks(self, chunk_ids: Iterable[str]):
+        """删除指定块的指纹记录"""
+        chunk_ids = list(chunk_ids)
+        with self._lock, self._conn:
+            for start in range(0, len(chunk_ids), 500):
+                batch = chunk_ids[start:start + 500]
+                self._conn.execute(
+                    f"DELETE FROM chunks WHERE chunk_id IN ({','.join('?' * len(batch))})",
+                    batch
+                )
+    
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,174 @@
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
+import json
+import time
+from .base import BaseRetriever
+from .chunking import content_id, split_text
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+async def iter_ndjson(
+    chunks: AsyncIterator[bytes],
+    errors: Optional[List[str]] = None,
+    max_line_bytes: int = 0
+) -> AsyncIterator[Dict[str, Any]]:
+    """从字节流中逐行解析NDJSON，不会把整个输入读入内存
+    
+    每个数据块只切分一次，未结束的行以片段列表暂存，长行的处理是线性的。
+    无法解析的行会被跳过，超过 max_line_bytes 的行（0表示不限制）不再缓存并被丢弃，
+    错误信息追加到 errors 中。
+    """
+    pending: List[bytes] = []
+    pending_size = 0
+    oversized = False
+    line_number = 0
+    async for chunk in chunks:
+        *complete, tail = chunk.split(b"\n")
+        for part in complete:
+            line_number += 1
+            if oversized or (max_line_bytes and pending_size + len(part) > max_line_bytes):
+                _add_error(errors, f"line {line_number}: line exceeds {max_line_bytes} bytes")
+            elif document := _parse_line(b"".join([*pending, part]), line_number, errors):
+                yield document
+            pending, pending_size, oversized = [], 0, False
+        if oversized or not tail:
+            continue
+        if max_line_bytes and pending_size + len(tail) > max_line_bytes:
+            pending, pending_size, oversized = [], 0, True
+        else:
+            pending.append(tail)
+            pending_size += len(tail)
+    
+    if oversized:
+        _add_error(errors, f"line {line_number + 1}: line exceeds {max_line_bytes} bytes")
+    elif pending:
+        if document := _parse_line(b"".join(pending), line_number + 1, errors):
+            yield document
+
+def _add_error(errors: Optional[List[str]], message: str):
+    """记录错误，最多保留100条"""
+    if errors is not None and len(errors) < 100:
+        errors.append(message)
+
+def _parse_line(line: bytes, line_number: int, errors: Optional[List[str]]) -> Optional[Dict[str, Any]]:
+    """解析单行文档"""
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        document = json.loads(line)
+        if not isinstance(document, dict) or not isinstance(document.get("content"), str):
+            raise ValueError("each line must be an object with a string 'content'")
+        return document
+    except Exception as e:
+        _add_error(errors, f"line {line_number}: {str(e)}")
+        return None
+
+class BulkIngestor:
+    """批量入库：切块、按批写入并对上游施加背压
+    
+    解析出的文档切块后按源文档组成批次（每批约 batch_size 个块）放入有界队列，
+    由 write_concurrency 个写入任务并发增量写入知识库。队列满时生产者暂停读取上游输入，
+    因此内存占用与上传大小无关。重复入库未变化的文档不会重新向量化。
+    """
+    
+    def __init__(self, retriever: BaseRetriever, config: Any):
+        self.retriever = retriever
+        self.chunk_max_tokens = config.chunk_max_tokens
+        self.chunk_overlap_tokens = config.chunk_overlap_tokens
+        self.batch_size = config.batch_size
+        self.max_pending_batches = config.max_pending_batches
+        self.write_concurrency = config.write_concurrency
+        self.documents = 0
+        self.chunks = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.failed_chunks = 0
+        self.changes = {"added": 0, "updated": 0, "unchanged": 0, "removed": 0}
+    
+    def chunk_document(self, document: Dict[str, Any]) -> Tuple[str, List[Dict[str, Any]]]:
+        """把文档切分为块，返回源文档ID和按顺序排列的块
+        
+        块ID为 "{source_id}:{chunk_index}"，同一源文档重新入库时按序号与已有块比对。
+        """
+        metadata = document.get("metadata") or {}
+        source_id = str(document.get("id") or content_id(document["content"], metadata))
+        pieces = split_text(
+            document["content"],
+            max_tokens=self.chunk_max_tokens,
+            overlap_tokens=self.chunk_overlap_tokens
+        )
+        return source_id, [
+            {
+                "id": f"{source_id}:{index}",
+                "content": piece,
+                "metadata": {**metadata, "source_id": source_id, "chunk_index": index},
+            }
+            for index, piece in enumerate(pieces)
+        ]
+    
+    async def _write_batches(self, queue: "asyncio.Queue[Optional[List[Tuple[str, List[Dict[str, Any]]]]]]"):
+        """写入任务：从队列取批次增量写入知识库"""
+        while (batch := await queue.get()) is not None:
+            try:
+                counts = await self.retriever.upsert_sources(batch)
+                self.batches += 1
+                for key, value in counts.items():
+                    self.changes[key] = self.changes.get(key, 0) + value
+            except Exception as e:
+                logger.error(f"批量写入失败: {str(e)}")
+                self.failed_batches += 1
+                self.failed_chunks += sum(len(chunks) for _, chunks in batch)
+            finally:
+                queue.task_done()
+    
+    async def ingest(self, documents: AsyncIterator[Dict[str, Any]]) -> Dict[str, Any]:
+        """消费文档流并写入知识库，返回吞吐统计"""
+        started = time.perf_counter()
+        queue: "asyncio.Queue[Optional[List[Tuple[str, List[Dict[str, Any]]]]]]" = asyncio.Queue(
+            maxsize=self.max_pending_batches
+        )
+        writers = [
+            asyncio.create_task(self._write_batches(queue))
+            for _ in range(self.write_concurrency)
+        ]
+        
+        try:
+            # 同一源文档的块必须在同一批次内，才能判断哪些旧块已消失
+            batch: List[Tuple[str, List[Dict[str, Any]]]] = []
+            batch_chunks = 0
+            async for document in documents:
+                self.documents += 1
+                source_id, chunks = self.chunk_document(document)
+                batch.append((source_id, chunks))
+                batch_chunks += len(chunks)
+                self.chunks += len(chunks)
+                if batch_chunks >= self.batch_size:
+                    # 队列满时在此等待，上游读取随之暂停
+                    await queue.put(batch)
+                    batch, batch_chunks = [], 0
+            if batch:
+                await queue.put(batch)
+            for _ in writers:
+                await queue.put(None)
+            await asyncio.gather(*writers)
+        except BaseException:
+            for writer in writers:
+                writer.cancel()
+            raise
+        
+        elapsed = time.perf_counter() - started
+        stats = {
+            "documents": self.documents,
+            "chunks": self.chunks,
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+            "failed_chunks": self.failed_chunks,
+            **self.changes,
+            "elapsed_seconds": round(elapsed, 3),
+            "docs_per_sec": round(self.documents / elapsed, 2) if elapsed else 0.0,
+            "chunks_per_sec": round(self.chunks / elapsed, 2) if elapsed else 0.0,
+        }
+        logger.info(f"批量入库完成: {stats}")
+        return stats
@@ -0,0 +1,145 @@
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from bisect import bisect_left, bisect_right, insort
+import threading
+import numpy as np
+
+def _pack_slots(slots: List[int], size: int) -> int:
+    """槽位列表转换为位图"""
+    selected = np.zeros(size, dtype=bool)
+    selected[slots] = True
+    return int.from_bytes(np.packbits(selected, bitorder="little").tobytes(), "little")
+
+def _unpack(mask: int, size: int) -> np.ndarray:
+    """位图转换为置位的槽位数组"""
+    if not mask:
+        return np.zeros(0, dtype=np.int64)
+    raw = np.frombuffer(mask.to_bytes((size + 7) // 8, "little"), dtype=np.uint8)
+    return np.flatnonzero(np.unpackbits(raw, bitorder="little"))
+
+class MetadataIndex:
+    """元数据二级索引：按字段取值维护位图，按日期维护有序索引
+    
+    每个文档占一个槽位，字段取值对应一个以槽位为位的整数位图；日期索引为 (日期, 槽位) 的有序列表。
+    过滤条件在检索前解析为候选文档ID集合，向量检索只在候选集合内进行。
+    日期按字符串比较，要求使用 ISO 格式（如 2024-06-30）。
+    """
+    
+    def __init__(self, fields: List[str], date_field: Optional[str] = "date"):
+        self.fields = list(fields)
+        self.date_field = date_field
+        self._lock = threading.Lock()
+        self._reset()
+    
+    def _reset(self):
+        """清空索引"""
+        self._doc_ids: List[Optional[str]] = []
+        self._slots: Dict[str, int] = {}
+        self._free: List[int] = []
+        self._values: List[Dict[str, Any]] = []
+        self._bitmaps: Dict[str, Dict[Any, int]] = {field: {} for field in self.fields}
+        self._dates: List[Tuple[str, int]] = []
+        self._live = 0
+    
+    def __len__(self) -> int:
+        return len(self._slots)
+    
+    def _remove_locked(self, doc_id: str):
+        """删除文档，调用方持有锁"""
+        slot = self._slots.pop(doc_id, None)
+        if slot is None:
+            return
+        bit = 1 << slot
+        for field, value in self._values[slot].items():
+            if field == self.date_field:
+                index = bisect_left(self._dates, (value, slot))
+                if index < len(self._dates) and self._dates[index] == (value, slot):
+                    self._dates.pop(index)
+                continue
+            bitmaps = self._bitmaps[field]
+            bitmaps[value] &= ~bit
+            if not bitmaps[value]:
+                del bitmaps[value]
+        self._live &= ~bit
+        self._doc_ids[slot] = None
+        self._values[slot] = {}
+        self._free.append(slot)
+    
+    def add(self, doc_ids: List[str], metadatas: List[Optional[Dict[str, Any]]]):
+        """添加或替换文档的元数据"""
+        with self._lock:
+            groups: Dict[Tuple[str, Any], List[int]] = {}
+            new_slots = []
+            new_dates = []
+            # 同一批中重复的文档ID以最后一次为准，否则第二次删除时前一次的位图尚未写入
+            for doc_id, metadata in dict(zip(doc_ids, metadatas)).items():
+                self._remove_locked(doc_id)
+                if self._free:
+                    slot = self._free.pop()
+                else:
+                    slot = len(self._doc_ids)
+                    self._doc_ids.append(None)
+                    self._values.append({})
+                values = {}
+                metadata = metadata or {}
+                for field in self.fields:
+                    value = metadata.get(field)
+                    if value is not None:
+                        values[field] = value
+                        groups.setdefault((field, value), []).append(slot)
+                if self.date_field and metadata.get(self.date_field) is not None:
+                    date = str(metadata[self.date_field])
+                    values[self.date_field] = date
+                    new_dates.append((date, slot))
+                self._doc_ids[slot] = doc_id
+                self._values[slot] = values
+                self._slots[doc_id] = slot
+                new_slots.append(slot)
+            
+            # 同一取值的槽位合并后一次写入位图，避免逐个对大整数做位运算
+            size = len(self._doc_ids)
+            for (field, value), slots in groups.items():
+                bitmaps = self._bitmaps[field]
+                bitmaps[value] = bitmaps.get(value, 0) | _pack_slots(slots, size)
+            self._live |= _pack_slots(new_slots, size)
+            if new_dates:
+                self._dates.extend(new_dates)
+                self._dates.sort()
+    
+    def remove(self, doc_ids: Iterable[str]):
+        """删除文档"""
+        with self._lock:
+            for doc_id in doc_ids:
+                self._remove_locked(doc_id)
+    
+    def rebuild(self, doc_ids: List[str], metadatas: List[Optional[Dict[str, Any]]]):
+        """用全部文档重建索引"""
+        with self._lock:
+            self._reset()
+        self.add(doc_ids, metadatas)
+    
+    def resolve(self, filters: Dict[str, Any]) -> Set[str]:
+        """把过滤条件解析为候选文档ID集合
+        
+        字段取值可以是单个值或列表（任一匹配）；date_from / date_to 为闭区间。
+        不同条件之间取交集。
+        """
+        with self._lock:
+            mask = self._live
+            for field in self.fields:
+                if filters.get(field) is None:
+                    continue
+                values = filters[field] if isinstance(filters[field], (list, tuple, set)) else [filters[field]]
+                field_mask = 0
+                for value in values:
+                    field_mask |= self._bitmaps[field].get(value, 0)
+                mask &= field_mask
+            
+            date_from = filters.get("date_from")
+            date_to = filters.get("date_to")
+            if mask and self.date_field and (date_from or date_to):
+                lo = bisect_left(self._dates, (str(date_from),)) if date_from else 0
+                # date_to 包含当天，带时间的日期（2024-06-30T12:00）同样落在区间内
+                hi = bisect_right(self._dates, (str(date_to) + "\uffff",)) if date_to else len(self._dates)
+                mask &= _pack_slots([slot for _, slot in self._dates[lo:hi]], len(self._doc_ids))
+            
+            return {self._doc_ids[slot] for slot in _unpack(mask, len(self._doc_ids))}
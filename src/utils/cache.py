@@ -1,44 +1,163 @@
-from typing import Any, Optional
-import json
-from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from collections import OrderedDict
+import asyncio
+import heapq
+import sys
+import time
 from utils.logger import get_logger
+from utils.metrics import CACHE_EVICTIONS, record_cache
 
 logger = get_logger(__name__)
 
+# 写入时顺带清理的过期键数量上限，保证单次set的开销有界
+_SWEEP_BATCH = 32
+
+class _Entry:
+    """缓存条目"""
+    
+    __slots__ = ("value", "expires_at", "size")
+    
+    def __init__(self, value: Any, expires_at: float, size: int):
+        self.value = value
+        self.expires_at = expires_at
+        self.size = size
+
+def _estimate_size(value: Any, _depth: int = 0) -> int:
+    """粗略估算对象占用的内存字节数"""
+    size = sys.getsizeof(value)
+    if _depth >= 4:
+        return size
+    if isinstance(value, dict):
+        size += sum(
+            _estimate_size(k, _depth + 1) + _estimate_size(v, _depth + 1)
+            for k, v in value.items()
+        )
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(_estimate_size(v, _depth + 1) for v in value)
+    return size
+
 class Cache:
-    """缓存实现类，使用内存作为后端存储"""
+    """缓存实现类，使用内存作为后端存储
+    
+    - get/set 均为 O(1)：OrderedDict 维护 LRU 顺序，读取时惰性判断过期
+    - 过期键由最小堆按过期时间排序，写入时与后台任务分批清理
+    - 超过 max_entries / max_bytes 时按 LRU 淘汰
+    """
     
-    def __init__(self):
-        """初始化内存存储"""
-        self._storage = {}
-        self._expiry = {}
-        self.default_ttl = 3600  # 默认1小时过期
+    def __init__(
+        self,
+        default_ttl: int = 3600,
+        max_entries: int = 10000,
+        max_bytes: int = 0,
+        sweep_interval: float = 30.0,
+        name: str = "memory"
+    ):
+        """初始化内存存储
+        
+        Args:
+            default_ttl: 默认过期时间（秒）
+            max_entries: 最大条目数，0表示不限制
+            max_bytes: 估算内存上限（字节），0表示不限制
+            sweep_interval: 后台清理过期键的间隔（秒），0表示不启动后台清理
+            name: 指标中的缓存名称
+        """
+        self._storage: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._expiry_heap: List[Tuple[float, str]] = []
+        self._bytes = 0
+        self._sweeper: Optional[asyncio.Task] = None
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
     
     async def connect(self):
-        """内存存储不需要连接"""
-        pass
-    
-    def _is_expired(self, key: str) -> bool:
-        """检查键是否过期"""
-        if key in self._expiry:
-            return datetime.now() > self._expiry[key]
-        return False
-    
-    def _clean_expired(self):
-        """清理过期的键"""
-        now = datetime.now()
-        expired_keys = [k for k, v in self._expiry.items() if now > v]
-        for key in expired_keys:
-            self._storage.pop(key, None)
-            self._expiry.pop(key, None)
+        """内存存储不需要连接，仅启动后台过期清理任务"""
+        if self.sweep_interval > 0 and self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_loop())
+    
+    async def close(self):
+        """停止后台清理任务"""
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+    
+    async def _sweep_loop(self):
+        """后台定期清理过期键"""
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                self._sweep()
+            except Exception as e:
+                logger.error(f"Cache sweep error: {str(e)}")
+    
+    def _remove(self, key: str) -> Optional[_Entry]:
+        """移除键并更新内存统计"""
+        entry = self._storage.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+        return entry
+    
+    def _sweep(self, limit: Optional[int] = None) -> int:
+        """按过期时间顺序清理已过期的键，返回清理数量"""
+        now = time.monotonic()
+        heap = self._expiry_heap
+        removed = 0
+        while heap and heap[0][0] <= now and (limit is None or removed < limit):
+            expires_at, key = heapq.heappop(heap)
+            entry = self._storage.get(key)
+            # 键被覆盖后堆里会留下旧的过期时间，需跳过
+            if entry is not None and entry.expires_at == expires_at:
+                self._remove(key)
+                self.expirations += 1
+                removed += 1
+        if removed:
+            CACHE_EVICTIONS.labels(self.name, "expired").inc(removed)
+        
+        # 频繁覆盖同一个键会让堆中堆积失效记录，超过阈值时重建
+        if len(heap) > 2 * len(self._storage) + 1024:
+            self._expiry_heap = [(e.expires_at, k) for k, e in self._storage.items()]
+            heapq.heapify(self._expiry_heap)
+        return removed
+    
+    def _evict(self):
+        """超出容量限制时按LRU顺序淘汰"""
+        while self._storage and (
+            (self.max_entries and len(self._storage) > self.max_entries)
+            or (self.max_bytes and self._bytes > self.max_bytes)
+        ):
+            _, entry = self._storage.popitem(last=False)
+            self._bytes -= entry.size
+            self.evictions += 1
+            CACHE_EVICTIONS.labels(self.name, "capacity").inc()
     
     async def get(self, key: str) -> Optional[Any]:
         """获取缓存值"""
         try:
-            self._clean_expired()
-            if key in self._storage and not self._is_expired(key):
-                return self._storage[key]
-            return None
+            entry = self._storage.get(key)
+            if entry is None:
+                self.misses += 1
+                record_cache(self.name, 0, 1)
+                return None
+            if entry.expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                CACHE_EVICTIONS.labels(self.name, "expired").inc()
+                record_cache(self.name, 0, 1)
+                return None
+            self._storage.move_to_end(key)
+            self.hits += 1
+            record_cache(self.name, 1, 0)
+            return entry.value
         except Exception as e:
             logger.error(f"Cache get error: {str(e)}")
             return None
@@ -51,19 +170,38 @@ class Cache:
     ) -> bool:
         """设置缓存值"""
         try:
-            self._storage[key] = value
-            expiry_time = datetime.now() + timedelta(seconds=ttl or self.default_ttl)
-            self._expiry[key] = expiry_time
+            expires_at = time.monotonic() + (ttl or self.default_ttl)
+            size = _estimate_size(value) if self.max_bytes else 0
+            
+            self._remove(key)
+            self._storage[key] = _Entry(value, expires_at, size)
+            self._bytes += size
+            heapq.heappush(self._expiry_heap, (expires_at, key))
+            
+            self._sweep(limit=_SWEEP_BATCH)
+            self._evict()
             return True
         except Exception as e:
             logger.error(f"Cache set error: {str(e)}")
             return False
     
+    async def get_many(self, keys: List[str]) -> List[Optional[Any]]:
+        """批量获取缓存值"""
+        return [await self.get(key) for key in keys]
+    
+    async def set_many(
+        self,
+        items: Dict[str, Any],
+        ttl: Optional[int] = None
+    ) -> bool:
+        """批量设置缓存值"""
+        results = [await self.set(key, value, ttl) for key, value in items.items()]
+        return all(results)
+    
     async def delete(self, key: str) -> bool:
         """删除缓存值"""
         try:
-            self._storage.pop(key, None)
-            self._expiry.pop(key, None)
+            self._remove(key)
             return True
         except Exception as e:
             logger.error(f"Cache delete error: {str(e)}")
@@ -73,8 +211,49 @@ class Cache:
         """清空所有缓存"""
         try:
             self._storage.clear()
-            self._expiry.clear()
+            self._expiry_heap.clear()
+            self._bytes = 0
             return True
         except Exception as e:
             logger.error(f"Cache clear error: {str(e)}")
-            return False 
\ No newline at end of file
+            return False
+    
+    def stats(self) -> Dict[str, int]:
+        """缓存统计：命中、未命中、淘汰、过期次数及当前容量"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "entries": len(self._storage),
+            "bytes": self._bytes,
+        }
+
+def create_cache(config: Any):
+    """根据配置创建缓存后端
+
+    cache.backend 为 redis 且配置了 redis_url 时使用Redis（内存缓存作为降级），
+    否则使用进程内存缓存。
+    """
+    memory_cache = Cache(
+        default_ttl=config.default_ttl,
+        max_entries=config.max_entries,
+        max_bytes=config.max_bytes,
+        sweep_interval=config.sweep_interval_seconds
+    )
+    if config.backend != "redis":
+        return memory_cache
+    if not config.redis_url:
+        logger.warning("cache.backend为redis但未配置redis_url，使用内存缓存")
+        return memory_cache
+    
+    from utils.redis_cache import RedisCache
+    return RedisCache(
+        redis_url=config.redis_url,
+        default_ttl=config.default_ttl,
+        key_prefix=config.key_prefix,
+        pool_size=config.redis_pool_size,
+        socket_timeout=config.redis_socket_timeout,
+        retry_interval=config.redis_retry_interval,
+        fallback=memory_cache
+    )
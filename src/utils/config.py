@@ -1,6 +1,6 @@
 import os
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional
 import yaml
 from pydantic import BaseModel
 from dotenv import load_dotenv
@@ -26,17 +26,38 @@ DEFAULT_CONFIG = {
         "cors_origins": ["*"],
         "rate_limit": {
             "requests_per_minute": 60,
-            "burst_limit": 100
-        }
+            "burst_limit": 100,
+            "backend": os.getenv("RATE_LIMIT_BACKEND", "memory"),
+            "redis_url": ""
+        },
+        "token_quota": {
+            "enabled": False,
+            "window_seconds": 3600,
+            "client_tokens": 200000,
+            "api_key_tokens": 1000000,
+            "api_key_header": "X-API-Key",
+            "backend": os.getenv("RATE_LIMIT_BACKEND", "memory"),
+            "redis_url": ""
+        },
+        "server_timing": True
     },
     "security": {
         "jwt_secret": os.getenv("JWT_SECRET", "dev-secret-key"),
         "token_expire_minutes": 1440,
-        "algorithm": "HS256"
+        "algorithm": "HS256",
+        "admin_token": os.getenv("ADMIN_TOKEN", "")
     },
     "cache": {
+        "backend": os.getenv("CACHE_BACKEND", "memory"),
         "redis_url": os.getenv("REDIS_URL", "redis://localhost:6379/0"),
-        "default_ttl": 3600
+        "default_ttl": 3600,
+        "key_prefix": "ai_analyst:",
+        "redis_pool_size": 50,
+        "redis_socket_timeout": 0.5,
+        "redis_retry_interval": 5,
+        "max_entries": 10000,
+        "max_bytes": 268435456,
+        "sweep_interval_seconds": 30
     },
     "llm": {
         "default_provider": "ollama",
@@ -45,20 +66,98 @@ DEFAULT_CONFIG = {
                 "model": "qwen3:0.6b",
                 "temperature": 0.7,
                 "max_tokens": 2000,
-                "api_base": "http://localhost:11434"
+                "api_base": "http://localhost:11434",
+                "pool_size": 20,
+                "keepalive_timeout": 60,
+                "connect_timeout": 5,
+                "read_timeout": 120,
+                "max_retries": 2,
+                "retry_backoff": 0.5,
+                "embed_batch_size": 64,
+                "embed_batch_tokens": 8192,
+                "embed_concurrency": 4,
+                "max_concurrency": 2,
+                "max_queue": 64
             },
             "openai": {
                 "model": "gpt-4-turbo-preview",
                 "temperature": 0.7,
                 "max_tokens": 2000,
-                "api_key": os.getenv("OPENAI_API_KEY", "")
+                "api_key": os.getenv("OPENAI_API_KEY", ""),
+                "api_base": "https://api.openai.com/v1",
+                "max_concurrency": 16
             }
+        },
+        "scheduler": {
+            "interactive_timeout": 30,
+            "batch_timeout": 600,
+            "background_timeout": 0
+        },
+        "routing": {
+            "enabled": False,
+            "fallback_providers": ["openai"],
+            "hedge_delay": 2.0,
+            "failure_threshold": 5,
+            "cooldown": 30,
+            "ewma_alpha": 0.2
         }
     },
     "vector_store": {
         "provider": "chroma",
         "collection_name": "ai_analyst",
-        "embedding_model": "all-MiniLM-L6-v2"
+        "embedding_model": "all-MiniLM-L6-v2",
+        "persist_directory": "data/chroma",
+        "embedding_provider": "chroma",
+        "embedding_backend": "torch",
+        "embedding_device": "cpu",
+        "embedding_batch_size": 32,
+        "embedding_max_wait_ms": 5,
+        "embedding_workers": 1,
+        "embedding_threads": 0,
+        "embedding_cache": True,
+        "embedding_cache_dir": "data/embedding_cache",
+        "epoch_partition_field": "category",
+        "search_workers": 4,
+        "search_max_queue": 256,
+        "write_workers": 1,
+        "hybrid_search": True,
+        "lexical_top_k": 20,
+        "vector_top_k": 0,
+        "rrf_k": 60,
+        "lexical_save_interval": 30,
+        "metadata_index_fields": ["category", "department", "type"],
+        "metadata_date_field": "date",
+        "filter_max_candidate_ids": 5000,
+        "filter_overfetch": 4
+    },
+    "ingest": {
+        "chunk_max_tokens": 512,
+        "chunk_overlap_tokens": 64,
+        "batch_size": 64,
+        "max_pending_batches": 4,
+        "write_concurrency": 2,
+        "max_line_bytes": 8388608
+    },
+    "qa": {
+        "semantic_cache": {
+            "enabled": False,
+            "similarity_threshold": 0.92,
+            "max_entries": 5000,
+            "max_scopes": 256,
+            "ttl": 3600
+        },
+        "context": {
+            "top_k": 5,
+            "max_tokens": 1500,
+            "max_tokens_per_hit": 400,
+            "min_tokens_per_hit": 32,
+            "max_distance": 0.0,
+            "dedup_threshold": 0.85
+        },
+        "batch": {
+            "max_questions": 500,
+            "concurrency": 4
+        }
     },
     "data_sources": {},
     "insight_agent": {
@@ -70,7 +169,8 @@ DEFAULT_CONFIG = {
 def _load_yaml_config() -> Dict[str, Any]:
     """加载YAML配置文件"""
     try:
-        config_path = Path(__file__).parent.parent.parent / "config" / "config.yaml"
+        # CONFIG_PATH 可指定其它配置文件（如压测使用的临时配置）
+        config_path = Path(os.getenv("CONFIG_PATH") or Path(__file__).parent.parent.parent / "config" / "config.yaml")
         if config_path.exists():
             with open(config_path, "r", encoding="utf-8") as f:
                 return yaml.safe_load(f)
@@ -98,6 +198,17 @@ class AppConfig(BaseModel):
 class RateLimitConfig(BaseModel):
     requests_per_minute: int
     burst_limit: int
+    backend: str = "memory"  # memory 或 redis，redis 时多个worker共享限额
+    redis_url: str = ""  # 为空时使用 cache.redis_url
+
+class TokenQuotaConfig(BaseModel):
+    enabled: bool = False
+    window_seconds: int = 3600  # 额度在该时长内匀速回满
+    client_tokens: int = 200000  # 每个客户端IP的额度（prompt+completion token），0表示不限制
+    api_key_tokens: int = 1000000  # 每个API Key的额度，0表示不限制
+    api_key_header: str = "X-API-Key"
+    backend: str = "memory"  # memory 或 redis，redis 时多个worker共享额度
+    redis_url: str = ""  # 为空时使用 cache.redis_url
 
 class ApiConfig(BaseModel):
     host: str
@@ -105,26 +216,69 @@ class ApiConfig(BaseModel):
     prefix: str
     cors_origins: list[str]
     rate_limit: RateLimitConfig
+    token_quota: TokenQuotaConfig = TokenQuotaConfig()
+    server_timing: bool = True  # 响应头返回各阶段耗时（Server-Timing）
 
 class SecurityConfig(BaseModel):
     jwt_secret: str
     token_expire_minutes: int
     algorithm: str
+    admin_token: str = ""  # 管理接口令牌（请求头 X-Admin-Token），为空时管理接口不可用
 
 class CacheConfig(BaseModel):
+    backend: str = "memory"  # memory 或 redis
     redis_url: str
     default_ttl: int
+    key_prefix: str = "ai_analyst:"
+    redis_pool_size: int = 50
+    redis_socket_timeout: float = 0.5
+    redis_retry_interval: float = 5.0
+    max_entries: int = 10000
+    max_bytes: int = 268435456  # 256MB
+    sweep_interval_seconds: float = 30.0
 
 class LLMProviderConfig(BaseModel):
     model: str
     temperature: float
     max_tokens: int
+    type: str = ""  # ollama / openai（OpenAI兼容接口），为空时使用提供方名称
     api_key: str = ""
     api_base: str = ""
+    # HTTP连接池与重试设置
+    pool_size: int = 20
+    keepalive_timeout: float = 60.0
+    connect_timeout: float = 5.0
+    read_timeout: float = 120.0
+    max_retries: int = 2
+    retry_backoff: float = 0.5
+    # 向量化设置，embedding_model为空时 ollama 使用 vector_store.embedding_model，openai 使用 text-embedding-3-small
+    embedding_model: str = ""
+    embed_batch_size: int = 64
+    embed_batch_tokens: int = 8192
+    embed_concurrency: int = 4
+    # 准入控制：同时执行的生成请求数与排队上限
+    max_concurrency: int = 2
+    max_queue: int = 64
+
+class LLMSchedulerConfig(BaseModel):
+    # 各优先级请求的默认截止时间（秒），预计排队时间超过时直接返回503，0表示不限制
+    interactive_timeout: float = 30.0
+    batch_timeout: float = 600.0
+    background_timeout: float = 0.0
+
+class LLMRoutingConfig(BaseModel):
+    enabled: bool = False
+    fallback_providers: List[str] = []
+    hedge_delay: float = 2.0  # 请求超过该时间（秒）未完成时向次优后端发送对冲请求，0表示不对冲
+    failure_threshold: int = 5  # 连续失败次数达到该值时熔断
+    cooldown: float = 30.0  # 熔断持续时间（秒）
+    ewma_alpha: float = 0.2
 
 class LLMConfig(BaseModel):
     default_provider: str
     providers: Dict[str, LLMProviderConfig]
+    scheduler: LLMSchedulerConfig = LLMSchedulerConfig()
+    routing: LLMRoutingConfig = LLMRoutingConfig()
 
 class VectorStoreConfig(BaseModel):
     provider: str
@@ -132,6 +286,61 @@ class VectorStoreConfig(BaseModel):
     embedding_model: str = "nomic-embed-text"  # 默认使用 nomic-embed-text
     ollama_api_base: str = "http://localhost:11434"
     openai_api_key: str = ""
+    persist_directory: str = "data/chroma"
+    embedding_provider: str = "chroma"  # chroma: 集合内置向量化；llm: 使用LLM的批量向量化接口；local: 进程内向量化引擎
+    embedding_backend: str = "torch"  # local 引擎的推理方式：torch / int8 / onnx
+    embedding_device: str = "cpu"
+    embedding_batch_size: int = 32
+    embedding_max_wait_ms: float = 5.0
+    embedding_workers: int = 1
+    embedding_threads: int = 0  # 0表示使用库默认线程数
+    embedding_cache: bool = True  # 持久化向量缓存，按模型区分
+    embedding_cache_dir: str = "data/embedding_cache"
+    epoch_partition_field: Optional[str] = "category"  # 按该元数据字段分区维护知识库版本
+    search_workers: int = 4
+    search_max_queue: int = 256
+    write_workers: int = 1
+    hybrid_search: bool = True  # 向量检索与BM25词项检索融合
+    lexical_top_k: int = 20
+    vector_top_k: int = 0  # 0表示与请求的top_k相同
+    rrf_k: int = 60
+    lexical_save_interval: float = 30.0
+    metadata_index_fields: List[str] = ["category", "department", "type"]
+    metadata_date_field: Optional[str] = "date"
+    filter_max_candidate_ids: int = 5000  # 候选集不超过该值时按ID限定向量检索范围
+    filter_overfetch: int = 4
+
+class IngestConfig(BaseModel):
+    chunk_max_tokens: int = 512
+    chunk_overlap_tokens: int = 64
+    batch_size: int = 64
+    max_pending_batches: int = 4
+    write_concurrency: int = 2
+    max_line_bytes: int = 8388608  # 批量入库时单行NDJSON的最大字节数，0表示不限制
+
+class SemanticCacheConfig(BaseModel):
+    enabled: bool = False
+    similarity_threshold: float = 0.92
+    max_entries: int = 5000
+    max_scopes: int = 256
+    ttl: int = 3600
+
+class ContextConfig(BaseModel):
+    top_k: int = 5
+    max_tokens: int = 1500
+    max_tokens_per_hit: int = 400
+    min_tokens_per_hit: int = 32
+    max_distance: float = 0.0
+    dedup_threshold: float = 0.85
+
+class BatchConfig(BaseModel):
+    max_questions: int = 500
+    concurrency: int = 4
+
+class QAConfig(BaseModel):
+    semantic_cache: SemanticCacheConfig = SemanticCacheConfig()
+    context: ContextConfig = ContextConfig()
+    batch: BatchConfig = BatchConfig()
 
 class Settings(BaseModel):
     app: AppConfig
@@ -140,6 +349,8 @@ class Settings(BaseModel):
     cache: CacheConfig
     llm: LLMConfig
     vector_store: VectorStoreConfig
+    ingest: IngestConfig = IngestConfig()
+    qa: QAConfig = QAConfig()
     data_sources: Dict[str, Dict[str, str]]
     insight_agent: Dict[str, Any]
 
@@ -0,0 +1,204 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from pathlib import Path
+import hashlib
+import json
+import os
+import re
+import threading
+import numpy as np
+from utils.logger import get_logger
+from utils.metrics import record_cache
+
+logger = get_logger(__name__)
+
+# 键为文本的128位哈希，拆成两个uint64存储
+_KEY_DTYPE = np.dtype([("hi", "<u8"), ("lo", "<u8")])
+
+def _text_keys(texts: List[str]) -> np.ndarray:
+    """文本转换为哈希键数组"""
+    digests = b"".join(
+        hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest() for text in texts
+    )
+    return np.frombuffer(digests, dtype=_KEY_DTYPE)
+
+class EmbeddingCache:
+    """持久化向量缓存
+    
+    每个向量化模型（namespace）一个目录：vectors.f32 为只追加的 float32 向量文件，通过内存映射读取；
+    keys.bin 为与向量逐行对应的文本哈希。启动时加载哈希并排序，查询用二分查找批量定位行号，
+    返回内存映射上的零拷贝视图。新写入的键先放在字典中，积累到一定数量再合并进有序数组。
+    更换模型即更换目录，旧模型的缓存自然失效。只支持单进程写入。
+    """
+    
+    def __init__(self, directory: str, namespace: str):
+        slug = re.sub(r"[^A-Za-z0-9._-]+", "_", namespace).strip("_")[:64]
+        digest = hashlib.blake2b(namespace.encode("utf-8"), digest_size=4).hexdigest()
+        self.namespace = namespace
+        self.path = Path(directory) / f"{slug}-{digest}"
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._vectors_path = self.path / "vectors.f32"
+        self._keys_path = self.path / "keys.bin"
+        self._meta_path = self.path / "meta.json"
+        self._lock = threading.Lock()
+        self.dim: Optional[int] = None
+        self.rows = 0
+        self._sorted_keys = np.zeros(0, dtype=_KEY_DTYPE)
+        self._sorted_rows = np.zeros(0, dtype=np.int64)
+        self._recent: Dict[bytes, int] = {}
+        self._mmap: Optional[np.memmap] = None
+        self.hits = 0
+        self.misses = 0
+        self._load()
+    
+    def _load(self):
+        """加载哈希索引，截掉异常退出时写了一半的记录"""
+        if not self._meta_path.exists():
+            return
+        self.dim = json.loads(self._meta_path.read_text())["dim"]
+        row_bytes = self.dim * 4
+        vector_rows = self._vectors_path.stat().st_size // row_bytes if self._vectors_path.exists() else 0
+        key_rows = self._keys_path.stat().st_size // _KEY_DTYPE.itemsize if self._keys_path.exists() else 0
+        self.rows = min(vector_rows, key_rows)
+        # 先写向量后写哈希，两个文件行数不一致时以较少的为准
+        for path, row_size in ((self._vectors_path, row_bytes), (self._keys_path, _KEY_DTYPE.itemsize)):
+            if path.exists() and path.stat().st_size != self.rows * row_size:
+                os.truncate(path, self.rows * row_size)
+        
+        keys = np.fromfile(self._keys_path, dtype=_KEY_DTYPE) if self.rows else np.zeros(0, dtype=_KEY_DTYPE)
+        order = np.argsort(keys, order=("hi", "lo"))
+        self._sorted_keys = keys[order]
+        self._sorted_rows = order.astype(np.int64)
+        logger.info(f"向量缓存 {self.namespace} 已加载，条目数: {self.rows}")
+    
+    def __len__(self) -> int:
+        return self.rows
+    
+    def _merge_recent(self):
+        """把新写入的键合并进有序数组"""
+        keys = np.frombuffer(b"".join(self._recent), dtype=_KEY_DTYPE)
+        rows = np.fromiter(self._recent.values(), dtype=np.int64, count=len(self._recent))
+        keys = np.concatenate([self._sorted_keys, keys])
+        rows = np.concatenate([self._sorted_rows, rows])
+        order = np.argsort(keys, order=("hi", "lo"))
+        self._sorted_keys = keys[order]
+        self._sorted_rows = rows[order]
+        self._recent = {}
+    
+    def _find_rows(self, keys: np.ndarray) -> np.ndarray:
+        """批量查找行号，未命中为-1"""
+        rows = np.full(len(keys), -1, dtype=np.int64)
+        if len(self._sorted_keys):
+            positions = np.searchsorted(self._sorted_keys, keys)
+            found = positions < len(self._sorted_keys)
+            candidates = self._sorted_keys[np.minimum(positions, len(self._sorted_keys) - 1)]
+            found &= candidates == keys
+            rows[found] = self._sorted_rows[positions[found]]
+        if self._recent:
+            for i in np.flatnonzero(rows < 0):
+                rows[i] = self._recent.get(keys[i].tobytes(), -1)
+        return rows
+    
+    def _mapped(self) -> np.memmap:
+        """向量文件的内存映射，文件增长后重新映射"""
+        if self._mmap is None or len(self._mmap) < self.rows:
+            self._mmap = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(self.rows, self.dim))
+        return self._mmap
+    
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """批量查询，命中的返回内存映射上的只读视图"""
+        if not texts:
+            return []
+        keys = _text_keys(texts)
+        with self._lock:
+            rows = self._find_rows(keys)
+            vectors = self._mapped() if self.rows else None
+        hits = int((rows >= 0).sum())
+        self.hits += hits
+        self.misses += len(rows) - hits
+        record_cache("embedding", hits, len(rows) - hits)
+        return [vectors[row] if row >= 0 else None for row in rows.tolist()]
+    
+    def put_many(self, texts: List[str], vectors: List[Any]):
+        """追加写入，已存在的文本跳过"""
+        if not texts:
+            return
+        matrix = np.asarray(vectors, dtype=np.float32)
+        keys = _text_keys(texts)
+        with self._lock:
+            if self.dim is None:
+                self.dim = int(matrix.shape[1])
+                self._meta_path.write_text(json.dumps({"namespace": self.namespace, "dim": self.dim}))
+            elif matrix.shape[1] != self.dim:
+                raise ValueError(
+                    f"embedding dimension {matrix.shape[1]} does not match cache dimension {self.dim}"
+                )
+            
+            # 同一批内重复的文本只写一次
+            _, first = np.unique(keys, return_index=True)
+            first.sort()
+            new = first[self._find_rows(keys[first]) < 0]
+            if not len(new):
+                return
+            with open(self._vectors_path, "ab") as f:
+                f.write(np.ascontiguousarray(matrix[new]).tobytes())
+            with open(self._keys_path, "ab") as f:
+                f.write(keys[new].tobytes())
+            for offset, i in enumerate(new.tolist()):
+                self._recent[keys[i].tobytes()] = self.rows + offset
+            self.rows += len(new)
+            if len(self._recent) > max(4096, len(self._sorted_keys) // 8):
+                self._merge_recent()
+    
+    def close(self):
+        """释放内存映射"""
+        with self._lock:
+            self._mmap = None
+    
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计"""
+        return {
+            "namespace": self.namespace,
+            "entries": self.rows,
+            "dim": self.dim,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+class CachedEmbedder:
+    """先查向量缓存的向量化包装，只对未命中的文本调用 embed_fn"""
+    
+    def __init__(
+        self,
+        embed_fn: Callable[[List[str]], Awaitable[List[List[float]]]],
+        cache: EmbeddingCache
+    ):
+        self.embed_fn = embed_fn
+        self.cache = cache
+    
+    async def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """批量文本向量化"""
+        cached = self.cache.get_many(texts)
+        missing: Dict[str, List[int]] = {}
+        for i, vector in enumerate(cached):
+            if vector is None:
+                missing.setdefault(texts[i], []).append(i)
+        
+        embeddings: List[Any] = list(cached)
+        if missing:
+            missing_texts = list(missing)
+            computed = await self.embed_fn(missing_texts)
+            try:
+                self.cache.put_many(missing_texts, computed)
+            except Exception as e:
+                logger.error(f"Embedding cache write error: {str(e)}")
+            for text, vector in zip(missing_texts, computed):
+                for i in missing[text]:
+                    embeddings[i] = vector
+        return [
+            vector.tolist() if isinstance(vector, np.ndarray) else list(vector)
+            for vector in embeddings
+        ]
+    
+    async def embed_text(self, text: str) -> List[float]:
+        """文本向量化"""
+        return (await self.embed_texts([text]))[0]
@@ -0,0 +1,77 @@
+from typing import Any, Callable, Dict
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+from utils.metrics import EXECUTOR_ACTIVE, EXECUTOR_QUEUE_DEPTH, EXECUTOR_REJECTED
+
+class ExecutorQueueFullError(Exception):
+    """线程池等待队列已满"""
+    pass
+
+class BoundedExecutor:
+    """有界线程池，用于把同步阻塞调用移出事件循环
+    
+    同时运行的任务数不超过 max_workers，其余协程在事件循环内排队等待；
+    max_queue 大于0时，排队数达到上限的新任务直接拒绝。
+    排队数与执行中的任务数按线程池名称导出为 Prometheus 指标。
+    """
+    
+    def __init__(self, name: str, max_workers: int, max_queue: int = 0):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix=name
+        )
+        self._slots = asyncio.Semaphore(max_workers)
+        self.waiting = 0
+        self.active = 0
+        self.completed = 0
+        self.rejected = 0
+        self._queue_gauge = EXECUTOR_QUEUE_DEPTH.labels(name)
+        self._active_gauge = EXECUTOR_ACTIVE.labels(name)
+    
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """在线程池中执行同步函数"""
+        if self.max_queue and self.waiting >= self.max_queue:
+            self.rejected += 1
+            EXECUTOR_REJECTED.labels(self.name).inc()
+            raise ExecutorQueueFullError(
+                f"{self.name} executor queue is full ({self.waiting} waiting)"
+            )
+        
+        self.waiting += 1
+        self._queue_gauge.inc()
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+            self._queue_gauge.dec()
+        
+        self.active += 1
+        self._active_gauge.inc()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor,
+                functools.partial(fn, *args, **kwargs)
+            )
+        finally:
+            self.active -= 1
+            self._active_gauge.dec()
+            self.completed += 1
+            self._slots.release()
+    
+    def stats(self) -> Dict[str, int]:
+        """线程池统计：排队数（queue depth）、执行中、已完成和被拒绝的任务数"""
+        return {
+            "max_workers": self.max_workers,
+            "waiting": self.waiting,
+            "active": self.active,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+    
+    def shutdown(self, wait: bool = True):
+        """关闭线程池"""
+        self._executor.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,215 @@
+from typing import Optional
+from contextlib import contextmanager
+import asyncio
+import os
+import time
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+from starlette.requests import Request
+from starlette.responses import Response
+
+# 多进程部署（多个 uvicorn/gunicorn worker）时设置 PROMETHEUS_MULTIPROC_DIR，
+# 各进程把指标写入该目录下的文件，/metrics 汇总所有进程的数据。
+# 所有标签取值都是固定的有限集合（路由模板、阶段名、提供方等），不包含问题文本或文档ID。
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+_LLM_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+# HTTP请求
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template",
+    ["method", "route", "status"],
+    buckets=_LATENCY_BUCKETS
+)
+
+# 检索
+RETRIEVAL_LATENCY = Histogram(
+    "retriever_search_duration_seconds",
+    "Retriever latency by stage",
+    ["stage"],
+    buckets=_LATENCY_BUCKETS
+)
+RETRIEVAL_HITS = Histogram(
+    "retriever_search_hits",
+    "Number of documents returned per query",
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50)
+)
+
+# LLM
+LLM_LATENCY = Histogram(
+    "llm_request_duration_seconds",
+    "LLM request latency",
+    ["provider", "operation", "outcome"],
+    buckets=_LLM_BUCKETS
+)
+LLM_TIME_TO_FIRST_TOKEN = Histogram(
+    "llm_time_to_first_token_seconds",
+    "Time until the first streamed token",
+    ["provider"],
+    buckets=_LLM_BUCKETS
+)
+LLM_PHASE = Histogram(
+    "llm_phase_duration_seconds",
+    "Server-reported prompt prefill and generation time",
+    ["provider", "phase"],
+    buckets=_LLM_BUCKETS
+)
+LLM_TOKENS = Counter(
+    "llm_tokens",
+    "Prompt and completion tokens",
+    ["provider", "type"]
+)
+
+# LLM调度
+LLM_QUEUE_DEPTH = Gauge(
+    "llm_scheduler_queue_depth",
+    "Number of LLM requests waiting for a slot",
+    ["provider", "priority"],
+    multiprocess_mode="livesum"
+)
+LLM_ACTIVE = Gauge(
+    "llm_scheduler_active",
+    "Number of LLM requests currently running",
+    ["provider"],
+    multiprocess_mode="livesum"
+)
+LLM_QUEUE_WAIT = Histogram(
+    "llm_scheduler_wait_seconds",
+    "Time LLM requests spend waiting for a slot",
+    ["provider", "priority"],
+    buckets=(0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+)
+LLM_SHED = Counter(
+    "llm_scheduler_shed_total",
+    "LLM requests rejected by admission control",
+    ["provider", "priority", "reason"]
+)
+
+# 线程池（pool 为 BoundedExecutor 的名称，如 chroma-search / chroma-write / embedding）
+EXECUTOR_QUEUE_DEPTH = Gauge(
+    "executor_queue_depth",
+    "Number of tasks waiting for a worker thread",
+    ["pool"],
+    multiprocess_mode="livesum"
+)
+EXECUTOR_ACTIVE = Gauge(
+    "executor_active",
+    "Number of tasks currently running in worker threads",
+    ["pool"],
+    multiprocess_mode="livesum"
+)
+EXECUTOR_REJECTED = Counter(
+    "executor_rejected",
+    "Tasks rejected because the executor queue was full",
+    ["pool"]
+)
+
+# 缓存（cache: memory / redis / semantic / embedding）
+CACHE_REQUESTS = Counter(
+    "cache_requests",
+    "Cache lookups by result",
+    ["cache", "result"]
+)
+CACHE_EVICTIONS = Counter(
+    "cache_evictions",
+    "Cache entries removed before being read again",
+    ["cache", "reason"]
+)
+
+# 请求合并（mode: call / stream；result: executed 实际执行、coalesced 合并到进行中的请求）
+SINGLEFLIGHT_REQUESTS = Counter(
+    "singleflight_requests",
+    "Requests handled by request coalescing",
+    ["mode", "result"]
+)
+
+# 洞察Agent
+INSIGHT_SCAN_DURATION = Histogram(
+    "insight_scan_duration_seconds",
+    "Duration of one InsightAgent analysis run",
+    ["outcome"],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+)
+
+def record_llm_usage(
+    provider: str,
+    prompt_tokens: Optional[int],
+    completion_tokens: Optional[int],
+    prefill_seconds: Optional[float] = None,
+    generation_seconds: Optional[float] = None
+):
+    """记录一次LLM调用的token数和服务端耗时"""
+    if prompt_tokens:
+        LLM_TOKENS.labels(provider, "prompt").inc(prompt_tokens)
+    if completion_tokens:
+        LLM_TOKENS.labels(provider, "completion").inc(completion_tokens)
+    if prefill_seconds is not None:
+        LLM_PHASE.labels(provider, "prefill").observe(prefill_seconds)
+    if generation_seconds is not None:
+        LLM_PHASE.labels(provider, "generation").observe(generation_seconds)
+
+@contextmanager
+def observe_llm(provider: str, operation: str):
+    """记录一次LLM调用的耗时，按成功、失败、被取消区分"""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    except (asyncio.CancelledError, GeneratorExit):
+        outcome = "cancelled"
+        raise
+    finally:
+        LLM_LATENCY.labels(provider, operation, outcome).observe(time.perf_counter() - started)
+
+def record_cache(cache: str, hits: int, misses: int):
+    """记录缓存命中与未命中次数"""
+    if hits:
+        CACHE_REQUESTS.labels(cache, "hit").inc(hits)
+    if misses:
+        CACHE_REQUESTS.labels(cache, "miss").inc(misses)
+
+async def metrics_endpoint(request: Request) -> Response:
+    """/metrics 接口，多进程模式下汇总所有worker的指标"""
+    registry = REGISTRY
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+def mark_process_dead():
+    """多进程模式下进程退出时清理该进程的实时指标（livesum 类型的Gauge）"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(os.getpid())
+
+class RequestMetricsMiddleware:
+    """按路由模板记录请求耗时的ASGI中间件，流式响应计到最后一个数据块发送完"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        status = 500
+        
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+        
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # 未匹配到路由的请求（扫描、404）归为一类，避免路径进入标签
+            route = scope.get("route")
+            template = (route.path or "/") if route is not None else "unmatched"
+            REQUEST_LATENCY.labels(
+                scope["method"], template, f"{status // 100}xx"
+            ).observe(time.perf_counter() - started)
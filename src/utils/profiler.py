@@ -0,0 +1,116 @@
+from typing import Any, Dict, Optional
+import cProfile
+import io
+import marshal
+import pstats
+import threading
+import time
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+class RequestProfiler:
+    """按需对接下来的N个请求做cProfile分析，并汇总结果
+    
+    同一时间只分析一个请求，其它请求照常处理；分析期间事件循环线程上的所有执行
+    （包括并发的其它请求）都会计入。未开启时中间件只做一次计数判断。
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.remaining = 0
+        self.profiled = 0
+        self.active = False
+        self.path_prefix = ""
+        self.started_at: Optional[float] = None
+        self._stats: Optional[pstats.Stats] = None
+    
+    def start(self, requests: int, path_prefix: str = ""):
+        """开始分析接下来的 requests 个请求，清空之前的结果"""
+        with self._lock:
+            self.remaining = requests
+            self.profiled = 0
+            self.path_prefix = path_prefix
+            self.started_at = time.time()
+            self._stats = None
+        logger.info(f"开始分析接下来的 {requests} 个请求 (path_prefix={path_prefix or '*'})")
+    
+    def stop(self):
+        """停止分析，保留已汇总的结果"""
+        with self._lock:
+            self.remaining = 0
+    
+    def _acquire(self, path: str) -> bool:
+        """当前请求是否需要分析"""
+        with self._lock:
+            if self.remaining <= 0 or self.active or not path.startswith(self.path_prefix):
+                return False
+            self.remaining -= 1
+            self.active = True
+            return True
+    
+    def _collect(self, profile: cProfile.Profile):
+        """把一次分析结果合并到汇总中"""
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+            self.profiled += 1
+            self.active = False
+            if self.remaining <= 0:
+                logger.info(f"请求分析完成，共 {self.profiled} 个请求")
+    
+    def status(self) -> Dict[str, Any]:
+        """分析状态"""
+        return {
+            "remaining": self.remaining,
+            "profiled": self.profiled,
+            "active": self.active,
+            "path_prefix": self.path_prefix,
+            "started_at": self.started_at,
+        }
+    
+    def dump(self) -> Optional[bytes]:
+        """汇总结果的 pstats 二进制格式，可用 snakeviz、pstats 等工具打开"""
+        with self._lock:
+            if self._stats is None:
+                return None
+            return marshal.dumps(self._stats.stats)
+    
+    def report(self, sort: str = "cumulative", limit: int = 50) -> Optional[str]:
+        """汇总结果的文本报告"""
+        with self._lock:
+            if self._stats is None:
+                return None
+            stream = io.StringIO()
+            self._stats.stream = stream
+            self._stats.sort_stats(sort).print_stats(limit)
+            return stream.getvalue()
+
+# 应用内共享的分析器
+request_profiler = RequestProfiler()
+
+class ProfilerMiddleware:
+    """按 request_profiler 的设置分析请求的ASGI中间件"""
+    
+    def __init__(self, app, profiler: RequestProfiler = request_profiler):
+        self.app = app
+        self.profiler = profiler
+    
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or self.profiler.remaining <= 0
+            or not self.profiler._acquire(scope["path"])
+        ):
+            await self.app(scope, receive, send)
+            return
+        
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            profile.disable()
+            self.profiler._collect(profile)
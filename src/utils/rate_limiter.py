@@ -1,55 +1,196 @@
-from typing import Optional
+from typing import Any, Optional
+from collections import OrderedDict
+import json
+import math
 import time
-from fastapi import Request, HTTPException
-from starlette.middleware.base import BaseHTTPMiddleware
-from utils.cache import Cache
+import redis.asyncio as redis
+from utils.logger import get_logger
 
-class RateLimitMiddleware(BaseHTTPMiddleware):
-    """请求限流中间件"""
+logger = get_logger(__name__)
+
+class GCRALimiter:
+    """进程内GCRA限流（等价于令牌桶）
+    
+    每个客户端只保存一个理论到达时间（TAT），请求到达时 TAT 前移一个发放间隔，
+    超出突发容量则拒绝，检查和更新为 O(1) 且不跨 await，并发请求不会少计。
+    桶按最近一次放行的顺序排列，TAT 不晚于当前时间的桶与不存在等价，
+    每次放行顺带从队首清理至多两个这样的空闲桶，桶数只与近期活跃的客户端数相关。
+    """
+    
+    def __init__(self, rate: float, burst: int):
+        """
+        Args:
+            rate: 每秒补充的请求数
+            burst: 突发容量（连续放行的最大请求数）
+        """
+        self.interval = 1.0 / rate
+        self.tolerance = self.interval * max(burst, 1)
+        self._tat: "OrderedDict[str, float]" = OrderedDict()
+    
+    def __len__(self) -> int:
+        return len(self._tat)
+    
+    def check(self, key: str, cost: float = 1, force: bool = False) -> float:
+        """放行返回0，否则返回需要等待的秒数
+        
+        cost 为本次消耗的额度，负数表示退还；force 为True时无论是否超额都记账（用于按实际用量补扣）。
+        """
+        now = time.monotonic()
+        tats = self._tat
+        tat = tats.get(key, now)
+        if tat < now:
+            tat = now
+        new_tat = tat + self.interval * cost
+        # 先算积压再减容量，空闲桶一次用满突发容量时不会因浮点舍入被拒
+        wait = (tat - now) + self.interval * cost - self.tolerance
+        if wait > 0 and not force:
+            return wait
+        
+        tats[key] = new_tat
+        tats.move_to_end(key)
+        for _ in range(2):
+            # 退还额度可能让刚写入的桶也回满并被清理
+            if not tats:
+                break
+            oldest = next(iter(tats))
+            if tats[oldest] > now:
+                break
+            del tats[oldest]
+        return 0.0
+    
+    async def acquire(self, key: str, cost: float = 1, force: bool = False) -> float:
+        """放行返回0，否则返回需要等待的秒数"""
+        return self.check(key, cost, force)
+    
+    async def close(self):
+        pass
+
+# KEYS[1] 为客户端键；ARGV[1] 本次消耗对应的时长（发放间隔×消耗，可为负）、ARGV[2] 突发容量对应的时长，
+# 单位均为微秒；ARGV[3] 为1时超额也记账。
+# 使用Redis服务器时间，多个worker之间没有时钟偏差；键的过期时间即桶回满的时间，空闲桶由Redis自动清理。
+_GCRA_SCRIPT = """
+local increment = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000000 + tonumber(time[2])
+local tat = tonumber(redis.call('GET', KEYS[1])) or now
+if tat < now then
+    tat = now
+end
+local new_tat = tat + increment
+local wait = new_tat - now - tolerance
+if wait > 0 and ARGV[3] ~= '1' then
+    return wait
+end
+if new_tat <= now then
+    redis.call('DEL', KEYS[1])
+else
+    redis.call('SET', KEYS[1], new_tat, 'PX', math.ceil((new_tat - now) / 1000))
+end
+return 0
+"""
+
+class RedisRateLimiter:
+    """基于Redis的GCRA限流，多个worker共享同一份限额
+    
+    每次检查是一次原子的Lua脚本调用（EVALSHA）。Redis不可用时降级到进程内限流，
+    并在 retry_interval 秒后再次尝试Redis。
+    """
     
     def __init__(
         self,
-        app,
-        requests_per_minute: int = 60,
-        burst_limit: int = 100
+        redis_url: str,
+        rate: float,
+        burst: int,
+        key_prefix: str = "ai_analyst:",
+        socket_timeout: float = 0.5,
+        retry_interval: float = 5.0
     ):
-        super().__init__(app)
-        self.requests_per_minute = requests_per_minute
-        self.burst_limit = burst_limit
-        self.cache = Cache()
+        self.interval_us = 1_000_000 / rate
+        self.tolerance_us = int(self.interval_us * max(burst, 1))
+        self.key_prefix = f"{key_prefix}rate_limit:"
+        self.retry_interval = retry_interval
+        self.fallback = GCRALimiter(rate, burst)
+        self._client = redis.Redis.from_url(
+            redis_url,
+            socket_timeout=socket_timeout,
+            socket_connect_timeout=socket_timeout
+        )
+        self._script = self._client.register_script(_GCRA_SCRIPT)
+        self._down_until = 0.0
+        self.errors = 0
+    
+    async def acquire(self, key: str, cost: float = 1, force: bool = False) -> float:
+        """放行返回0，否则返回需要等待的秒数"""
+        if self._down_until and time.monotonic() < self._down_until:
+            return self.fallback.check(key, cost, force)
+        try:
+            wait = await self._script(
+                keys=[self.key_prefix + key],
+                args=[int(self.interval_us * cost), self.tolerance_us, int(force)]
+            )
+            self._down_until = 0.0
+            return int(wait) / 1_000_000
+        except Exception as e:
+            self.errors += 1
+            self._down_until = time.monotonic() + self.retry_interval
+            logger.error(f"Redis rate limiter error, using in-process limiter: {str(e)}")
+            return self.fallback.check(key, cost, force)
     
-    async def dispatch(
+    async def close(self):
+        """关闭连接池"""
+        await self._client.aclose()
+
+def create_rate_limiter(config: Any, redis_url: str = "", key_prefix: str = "ai_analyst:"):
+    """根据 api.rate_limit 配置创建限流器
+    
+    backend 为 redis 时多个worker共享限额，rate_limit.redis_url 为空时使用缓存的 redis_url。
+    """
+    rate = config.requests_per_minute / 60
+    if config.backend != "redis":
+        return GCRALimiter(rate, config.burst_limit)
+    url = config.redis_url or redis_url
+    if not url:
+        logger.warning("rate_limit.backend为redis但未配置redis_url，使用进程内限流")
+        return GCRALimiter(rate, config.burst_limit)
+    return RedisRateLimiter(url, rate, config.burst_limit, key_prefix=key_prefix)
+
+class RateLimitMiddleware:
+    """按客户端IP限流的ASGI中间件
+    
+    平均速率为 requests_per_minute，允许连续突发 burst_limit 个请求，
+    超出时返回429并在 Retry-After 中给出可重试的秒数。
+    """
+    
+    def __init__(
         self,
-        request: Request,
-        call_next
+        app,
+        requests_per_minute: int = 60,
+        burst_limit: int = 100,
+        limiter: Optional[Any] = None
     ):
-        # 获取客户端IP
-        client_ip = request.client.host
-        
-        # 检查是否超过突发限制
-        burst_key = f"rate_limit:burst:{client_ip}"
-        burst_count = await self.cache.get(burst_key) or 0
-        
-        if burst_count >= self.burst_limit:
-            raise HTTPException(
-                status_code=429,
-                detail="Too many requests"
-            )
-        
-        # 检查是否超过每分钟请求限制
-        minute_key = f"rate_limit:minute:{client_ip}"
-        minute_count = await self.cache.get(minute_key) or 0
-        
-        if minute_count >= self.requests_per_minute:
-            raise HTTPException(
-                status_code=429,
-                detail="Rate limit exceeded"
-            )
+        self.app = app
+        self.limiter = limiter if limiter is not None else GCRALimiter(requests_per_minute / 60, burst_limit)
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
         
-        # 更新计数器
-        await self.cache.set(burst_key, burst_count + 1, ttl=1)  # 1秒
-        await self.cache.set(minute_key, minute_count + 1, ttl=60)  # 1分钟
+        client = scope.get("client")
+        wait = await self.limiter.acquire(client[0] if client else "unknown")
+        if wait <= 0:
+            await self.app(scope, receive, send)
+            return
         
-        # 处理请求
-        response = await call_next(request)
-        return response 
\ No newline at end of file
+        body = json.dumps({"detail": "Rate limit exceeded"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(math.ceil(wait)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
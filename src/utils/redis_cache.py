@@ -0,0 +1,225 @@
+from typing import Any, Dict, List, Optional
+import json
+import time
+import zlib
+import redis.asyncio as redis
+from utils.cache import Cache
+from utils.logger import get_logger
+from utils.metrics import record_cache
+
+logger = get_logger(__name__)
+
+# 序列化格式头：J为原始JSON，Z为zlib压缩后的JSON
+_RAW = b"J"
+_COMPRESSED = b"Z"
+# 超过该长度的值才压缩，短值压缩收益不抵CPU开销
+_COMPRESS_THRESHOLD = 1024
+
+def serialize(value: Any) -> bytes:
+    """将缓存值序列化为紧凑的二进制格式"""
+    data = json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if len(data) > _COMPRESS_THRESHOLD:
+        return _COMPRESSED + zlib.compress(data, 6)
+    return _RAW + data
+
+def deserialize(data: bytes) -> Any:
+    """反序列化缓存值"""
+    header, body = data[:1], data[1:]
+    if header == _COMPRESSED:
+        body = zlib.decompress(body)
+    return json.loads(body)
+
+class RedisCache:
+    """Redis缓存实现，多个worker共享同一份缓存
+    
+    Redis不可用时自动降级到进程内存缓存，并在 retry_interval 秒后再次尝试Redis。
+    """
+    
+    def __init__(
+        self,
+        redis_url: str,
+        default_ttl: int = 3600,
+        key_prefix: str = "ai_analyst:",
+        pool_size: int = 50,
+        socket_timeout: float = 0.5,
+        retry_interval: float = 5.0,
+        fallback: Optional[Cache] = None
+    ):
+        """初始化Redis缓存（连接在connect中建立）"""
+        self.redis_url = redis_url
+        self.default_ttl = default_ttl
+        self.key_prefix = key_prefix
+        self.pool_size = pool_size
+        self.socket_timeout = socket_timeout
+        self.retry_interval = retry_interval
+        self.fallback = fallback or Cache(default_ttl=default_ttl)
+        self._client: Optional[redis.Redis] = None
+        self._down_until = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.fallback_ops = 0
+    
+    async def connect(self):
+        """创建连接池并检测Redis是否可用"""
+        await self.fallback.connect()
+        pool = redis.ConnectionPool.from_url(
+            self.redis_url,
+            max_connections=self.pool_size,
+            socket_timeout=self.socket_timeout,
+            socket_connect_timeout=self.socket_timeout,
+        )
+        self._client = redis.Redis(connection_pool=pool)
+        try:
+            await self._client.ping()
+            logger.info(f"Redis缓存已连接: {self.redis_url}")
+        except Exception as e:
+            self._mark_down(e)
+    
+    async def close(self):
+        """关闭连接池"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        await self.fallback.close()
+    
+    def _key(self, key: str) -> str:
+        """添加命名空间前缀"""
+        return f"{self.key_prefix}{key}"
+    
+    def _available(self) -> bool:
+        """Redis是否可用（故障后等待 retry_interval 再重试）"""
+        return self._client is not None and time.monotonic() >= self._down_until
+    
+    def _mark_down(self, error: Exception):
+        """记录Redis故障，冷却期内的操作走降级缓存"""
+        self.errors += 1
+        self._down_until = time.monotonic() + self.retry_interval
+        logger.warning(
+            f"Redis不可用，{self.retry_interval}秒内降级为内存缓存: {str(error)}"
+        )
+    
+    async def get(self, key: str) -> Optional[Any]:
+        """获取缓存值"""
+        if not self._available():
+            self.fallback_ops += 1
+            return await self.fallback.get(key)
+        try:
+            data = await self._client.get(self._key(key))
+        except Exception as e:
+            self._mark_down(e)
+            self.fallback_ops += 1
+            return await self.fallback.get(key)
+        if data is None:
+            self.misses += 1
+            record_cache("redis", 0, 1)
+            return None
+        self.hits += 1
+        record_cache("redis", 1, 0)
+        return deserialize(data)
+    
+    async def get_many(self, keys: List[str]) -> List[Optional[Any]]:
+        """批量获取缓存值，一次MGET往返"""
+        if not keys:
+            return []
+        if not self._available():
+            self.fallback_ops += 1
+            return await self.fallback.get_many(keys)
+        try:
+            values = await self._client.mget([self._key(k) for k in keys])
+        except Exception as e:
+            self._mark_down(e)
+            self.fallback_ops += 1
+            return await self.fallback.get_many(keys)
+        results = [deserialize(data) if data is not None else None for data in values]
+        hits = sum(1 for data in values if data is not None)
+        self.hits += hits
+        self.misses += len(values) - hits
+        record_cache("redis", hits, len(values) - hits)
+        return results
+    
+    async def set(
+        self,
+        key: str,
+        value: Any,
+        ttl: Optional[int] = None
+    ) -> bool:
+        """设置缓存值"""
+        if not self._available():
+            self.fallback_ops += 1
+            return await self.fallback.set(key, value, ttl)
+        try:
+            await self._client.set(
+                self._key(key),
+                serialize(value),
+                ex=int(ttl or self.default_ttl)
+            )
+            return True
+        except Exception as e:
+            self._mark_down(e)
+            self.fallback_ops += 1
+            return await self.fallback.set(key, value, ttl)
+    
+    async def set_many(
+        self,
+        items: Dict[str, Any],
+        ttl: Optional[int] = None
+    ) -> bool:
+        """批量设置缓存值，通过pipeline一次往返写入"""
+        if not items:
+            return True
+        if not self._available():
+            self.fallback_ops += 1
+            return await self.fallback.set_many(items, ttl)
+        try:
+            expire = int(ttl or self.default_ttl)
+            async with self._client.pipeline(transaction=False) as pipe:
+                for key, value in items.items():
+                    pipe.set(self._key(key), serialize(value), ex=expire)
+                await pipe.execute()
+            return True
+        except Exception as e:
+            self._mark_down(e)
+            self.fallback_ops += 1
+            return await self.fallback.set_many(items, ttl)
+    
+    async def delete(self, key: str) -> bool:
+        """删除缓存值"""
+        await self.fallback.delete(key)
+        if not self._available():
+            return True
+        try:
+            await self._client.delete(self._key(key))
+            return True
+        except Exception as e:
+            self._mark_down(e)
+            return False
+    
+    async def clear(self) -> bool:
+        """清空当前命名空间下的所有缓存"""
+        await self.fallback.clear()
+        if not self._available():
+            return True
+        try:
+            batch = []
+            async for key in self._client.scan_iter(match=f"{self.key_prefix}*", count=500):
+                batch.append(key)
+                if len(batch) >= 500:
+                    await self._client.unlink(*batch)
+                    batch = []
+            if batch:
+                await self._client.unlink(*batch)
+            return True
+        except Exception as e:
+            self._mark_down(e)
+            return False
+    
+    def stats(self) -> Dict[str, Any]:
+        """缓存统计"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "fallback_ops": self.fallback_ops,
+            "fallback": self.fallback.stats(),
+        }
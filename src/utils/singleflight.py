@@ -0,0 +1,147 @@
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set
+import asyncio
+from utils.logger import get_logger
+from utils.metrics import SINGLEFLIGHT_REQUESTS
+
+logger = get_logger(__name__)
+
+class _StreamBroadcast:
+    """把一个流的输出广播给多个订阅者，后加入的订阅者会先回放已产生的部分"""
+    
+    def __init__(self):
+        self.items: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._changed = asyncio.Condition()
+    
+    async def publish(self, item: Any):
+        """发布一个数据块"""
+        async with self._changed:
+            self.items.append(item)
+            self._changed.notify_all()
+    
+    async def finish(self, error: Optional[BaseException] = None):
+        """结束广播"""
+        async with self._changed:
+            self.done = True
+            self.error = error
+            self._changed.notify_all()
+    
+    async def subscribe(self) -> AsyncIterator[Any]:
+        """订阅广播，依次产出全部数据块"""
+        position = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(
+                    lambda: position < len(self.items) or self.done
+                )
+                pending = self.items[position:]
+                finished = self.done
+                error = self.error
+            for item in pending:
+                yield item
+            position += len(pending)
+            if finished and position >= len(self.items):
+                if error is not None:
+                    raise error
+                return
+
+class SingleFlight:
+    """请求合并：同一个键上并发的相同请求只执行一次
+    
+    第一个调用者触发实际工作，其余并发调用者等待同一个结果（或订阅同一个流）。
+    实际工作在独立任务中执行，发起者断开连接不会影响其他等待者；
+    do 的所有等待者都被取消后，结果已无人需要，实际工作随之取消。
+    """
+    
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[asyncio.Task, int] = {}
+        self._streams: Dict[str, _StreamBroadcast] = {}
+        self._pumps: Set[asyncio.Task] = set()
+        self.executed = 0
+        self.coalesced = 0
+    
+    def _forget_call(self, key: str, task: asyncio.Task):
+        """任务结束后移除键，并消费异常避免未检索警告"""
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()
+    
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """执行或等待键对应的调用"""
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._forget_call(key, t))
+            self.executed += 1
+            SINGLEFLIGHT_REQUESTS.labels("call", "executed").inc()
+        else:
+            self.coalesced += 1
+            SINGLEFLIGHT_REQUESTS.labels("call", "coalesced").inc()
+        
+        waiters = self._waiters
+        waiters[task] = waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            waiters[task] -= 1
+            if not waiters[task]:
+                del waiters[task]
+                # 任务未完成说明最后一个等待者被取消（如客户端断开）
+                if not task.done():
+                    task.cancel()
+    
+    async def stream(
+        self,
+        key: str,
+        fn: Callable[[], AsyncIterator[Any]]
+    ) -> AsyncIterator[Any]:
+        """执行或订阅键对应的流"""
+        broadcast = self._streams.get(key)
+        if broadcast is None:
+            broadcast = _StreamBroadcast()
+            self._streams[key] = broadcast
+            task = asyncio.create_task(self._pump(key, broadcast, fn))
+            self._pumps.add(task)
+            task.add_done_callback(self._pumps.discard)
+            self.executed += 1
+            SINGLEFLIGHT_REQUESTS.labels("stream", "executed").inc()
+        else:
+            self.coalesced += 1
+            SINGLEFLIGHT_REQUESTS.labels("stream", "coalesced").inc()
+        
+        async for item in broadcast.subscribe():
+            yield item
+    
+    async def _pump(
+        self,
+        key: str,
+        broadcast: _StreamBroadcast,
+        fn: Callable[[], AsyncIterator[Any]]
+    ):
+        """驱动上游流并广播其输出"""
+        error: Optional[BaseException] = None
+        try:
+            async for item in fn():
+                await broadcast.publish(item)
+        except asyncio.CancelledError as e:
+            error = e
+            raise
+        except Exception as e:
+            logger.error(f"SingleFlight stream {key} error: {str(e)}")
+            error = e
+        finally:
+            if self._streams.get(key) is broadcast:
+                del self._streams[key]
+            await broadcast.finish(error)
+    
+    def stats(self) -> Dict[str, int]:
+        """合并统计"""
+        return {
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._calls) + len(self._streams),
+        }
@@ -0,0 +1,83 @@
+from typing import Dict, List, Optional, Tuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+import time
+
+_timings: ContextVar[Optional["RequestTimings"]] = ContextVar("request_timings", default=None)
+
+class RequestTimings:
+    """一次请求内各阶段的耗时，同名阶段累加"""
+    
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: Dict[str, float] = {}
+    
+    def add(self, name: str, duration: float):
+        """记录一个阶段的耗时（秒）"""
+        self.spans[name] = self.spans.get(name, 0.0) + duration
+    
+    def as_dict(self) -> Dict[str, float]:
+        """各阶段耗时（毫秒）"""
+        return {name: round(duration * 1000, 2) for name, duration in self.spans.items()}
+    
+    def server_timing(self) -> str:
+        """格式化为 Server-Timing 响应头，附带到目前为止的总耗时"""
+        entries: List[Tuple[str, float]] = [
+            *self.spans.items(),
+            ("total", time.perf_counter() - self.started)
+        ]
+        return ", ".join(f"{name};dur={duration * 1000:.2f}" for name, duration in entries)
+
+def current_timings() -> Optional[RequestTimings]:
+    """当前请求的计时对象，未开启计时时返回None"""
+    return _timings.get()
+
+def start_timings() -> RequestTimings:
+    """在当前上下文中开始计时，已开始时返回已有的计时对象"""
+    timings = _timings.get()
+    if timings is None:
+        timings = RequestTimings()
+        _timings.set(timings)
+    return timings
+
+@contextmanager
+def span(name: str):
+    """记录代码块耗时，当前请求未开启计时时不做任何事"""
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - started)
+
+class ServerTimingMiddleware:
+    """为每个HTTP请求开启计时，并在响应头中返回 Server-Timing
+    
+    响应头在开始发送响应时写入，流式响应只包含首个数据块之前完成的阶段。
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        timings = RequestTimings()
+        token = _timings.set(timings)
+        
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timings.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _timings.reset(token)
@@ -0,0 +1,145 @@
+from typing import Any, List, Optional, Tuple
+from contextvars import ContextVar
+import hashlib
+from utils.logger import get_logger
+from utils.rate_limiter import GCRALimiter, RedisRateLimiter
+
+logger = get_logger(__name__)
+
+class TokenQuotaExceededError(Exception):
+    """token额度用尽"""
+    
+    def __init__(self, scope: str, retry_after: float):
+        self.scope = scope
+        self.retry_after = retry_after
+        super().__init__(f"{scope} token quota exceeded, retry after {retry_after:.1f}s")
+
+class TokenUsage:
+    """一次LLM调用中模型服务报告的token数"""
+    
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.reported = False
+    
+    @property
+    def total(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+# 当前请求的额度主体：[(范围, 键)]，由 TokenQuotaMiddleware 设置，后台任务中为None
+_principals: ContextVar[Optional[List[Tuple[str, str]]]] = ContextVar("quota_principals", default=None)
+# 当前LLM调用的用量，由 QuotaLLM 设置，模型服务返回token数时累加
+_usage: ContextVar[Optional[TokenUsage]] = ContextVar("llm_usage", default=None)
+
+def current_principals() -> Optional[List[Tuple[str, str]]]:
+    """当前请求的额度主体"""
+    return _principals.get()
+
+def record_usage(prompt_tokens: Optional[int], completion_tokens: Optional[int]):
+    """记录模型服务报告的token数，计入当前LLM调用"""
+    usage = _usage.get()
+    if usage is None:
+        return
+    usage.prompt_tokens += prompt_tokens or 0
+    usage.completion_tokens += completion_tokens or 0
+    usage.reported = True
+
+def start_usage() -> Tuple[TokenUsage, Any]:
+    """为一次LLM调用开始统计用量，返回用量对象和用于恢复的token"""
+    usage = TokenUsage()
+    return usage, _usage.set(usage)
+
+def reset_usage(token: Any):
+    """结束用量统计"""
+    _usage.reset(token)
+
+class TokenQuota:
+    """按 prompt+completion token 计的额度，每个客户端IP和每个API Key各一个桶
+    
+    桶在 window_seconds 内匀速回满。LLM调用前按估算值预扣（客户端和API Key都要有余额，
+    单次预扣不超过桶容量），调用结束后按模型服务报告的实际用量多退少补；
+    未报告用量（如调用失败）时保留预扣值。缓存命中不调用LLM，不消耗额度。
+    """
+    
+    def __init__(self, limiters: List[Tuple[str, Any, int]]):
+        """
+        Args:
+            limiters: [(范围, 限流器, 桶容量)]，范围为 client 或 api_key
+        """
+        self.limiters = {scope: (limiter, capacity) for scope, limiter, capacity in limiters}
+    
+    async def reserve(self, principals: List[Tuple[str, str]], tokens: int) -> List[Tuple[str, str, int]]:
+        """预扣额度，任一主体余额不足时撤销已预扣的部分并抛出 TokenQuotaExceededError"""
+        reserved: List[Tuple[str, str, int]] = []
+        for scope, key in principals:
+            if scope not in self.limiters:
+                continue
+            limiter, capacity = self.limiters[scope]
+            cost = min(tokens, capacity)
+            wait = await limiter.acquire(f"tokens:{scope}:{key}", cost)
+            if wait > 0:
+                await self.release(reserved)
+                raise TokenQuotaExceededError(scope, wait)
+            reserved.append((scope, key, cost))
+        return reserved
+    
+    async def reconcile(self, reserved: List[Tuple[str, str, int]], actual: int):
+        """按实际用量补扣或退还"""
+        for scope, key, cost in reserved:
+            if actual != cost:
+                limiter, _ = self.limiters[scope]
+                await limiter.acquire(f"tokens:{scope}:{key}", actual - cost, force=True)
+    
+    async def release(self, reserved: List[Tuple[str, str, int]]):
+        """退还预扣的额度"""
+        await self.reconcile(reserved, 0)
+    
+    async def close(self):
+        for limiter, _ in self.limiters.values():
+            await limiter.close()
+
+def create_token_quota(config: Any, redis_url: str = "", key_prefix: str = "ai_analyst:") -> Optional[TokenQuota]:
+    """根据 api.token_quota 配置创建额度，未开启时返回None"""
+    if not config.enabled:
+        return None
+    url = config.redis_url or redis_url
+    if config.backend == "redis" and not url:
+        logger.warning("token_quota.backend为redis但未配置redis_url，使用进程内额度")
+    
+    limiters = []
+    for scope, capacity in (("client", config.client_tokens), ("api_key", config.api_key_tokens)):
+        if capacity <= 0:
+            continue
+        rate = capacity / config.window_seconds
+        if config.backend == "redis" and url:
+            limiter = RedisRateLimiter(url, rate, capacity, key_prefix=key_prefix)
+        else:
+            limiter = GCRALimiter(rate, capacity)
+        limiters.append((scope, limiter, capacity))
+    return TokenQuota(limiters)
+
+class TokenQuotaMiddleware:
+    """从请求中识别额度主体（客户端IP、API Key）的ASGI中间件"""
+    
+    def __init__(self, app, api_key_header: str = "X-API-Key"):
+        self.app = app
+        self.api_key_header = api_key_header.lower().encode("latin-1")
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        client = scope.get("client")
+        principals = [("client", client[0] if client else "unknown")]
+        for name, value in scope["headers"]:
+            if name == self.api_key_header and value:
+                # 只保存API Key的哈希，不把原文写入内存或Redis的键
+                principals.append(("api_key", hashlib.blake2b(value, digest_size=12).hexdigest()))
+                break
+        
+        token = _principals.set(principals)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _principals.reset(token)
@@ -0,0 +1,37 @@
+from typing import List
+import re
+
+# CJK统一表意文字、日文假名、韩文音节，每个字符大致对应一个token
+_CJK_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]")
+_WORD_PATTERN = re.compile(r"[A-Za-z0-9_]+|[^\sA-Za-z0-9_]")
+_CJK_RUN_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+")
+_TERM_PATTERN = re.compile(r"[A-Za-z0-9_]+(?:\.[0-9]+)?")
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算文本的token数量
+    
+    不依赖具体模型的分词器：CJK字符按1个token计，英文单词按每4个字符1个token计，
+    其余标点符号各计1个token。用于切分批次和预算上下文长度，不要求精确。
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    if cjk:
+        text = _CJK_PATTERN.sub(" ", text)
+    tokens = cjk
+    for word in _WORD_PATTERN.findall(text):
+        tokens += (len(word) + 3) // 4
+    return tokens
+
+def split_terms(text: str) -> List[str]:
+    """切分用于词项匹配的词：英文单词和数字转小写，连续CJK字符取相邻二字组
+    
+    不依赖分词词典，中文二字组足以覆盖大部分词语的匹配。
+    """
+    terms = [term.lower() for term in _TERM_PATTERN.findall(_CJK_RUN_PATTERN.sub(" ", text))]
+    for run in _CJK_RUN_PATTERN.findall(text):
+        if len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
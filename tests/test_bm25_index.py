@@ -0,0 +1,76 @@
+import threading
+import pytest
+from retriever import bm25_index
+from retriever.bm25_index import BM25Index
+
+DOCS = {
+    "d1": "2024年第二季度华东区销售额同比增长15.3%",
+    "d2": "2024年第二季度华北区销售额同比下降2.1%",
+    "d3": "产品 SKU-9931 的库存周转天数为42天",
+    "d4": "客户续约率与NPS调查结果",
+}
+
+@pytest.fixture
+def index(tmp_path):
+    index = BM25Index(tmp_path / "docs.bm25.pkl")
+    index.add(list(DOCS), list(DOCS.values()))
+    return index
+
+def test_search_ranks_exact_terms(index):
+    hits = index.search("华东区销售额", top_k=2)
+    assert hits[0][0] == "d1"
+    assert index.search("9931")[0][0] == "d3"
+    assert index.search("不存在的词项xyz") == []
+
+def test_search_respects_allowed_ids(index):
+    hits = index.search("销售额", allowed={"d2", "d3"})
+    assert [doc_id for doc_id, _ in hits] == ["d2"]
+
+def test_add_replaces_and_remove_deletes(index):
+    index.add(["d3"], ["华南区门店客流"])
+    assert index.search("9931") == []
+    assert index.search("华南区")[0][0] == "d3"
+    index.remove(["d1", "d3"])
+    assert len(index) == 2
+    assert index.search("华东区") == []
+
+def test_save_and_load_round_trip_compacts_slots(index, tmp_path):
+    index.remove(["d2", "d4"])
+    index.add(["d5"], ["华东区渠道ROI最高"])
+    expected = index.search("华东区", top_k=5)
+    index.save()
+    assert not index.dirty
+    
+    loaded = BM25Index(tmp_path / "docs.bm25.pkl")
+    assert loaded.load()
+    assert len(loaded) == 3
+    assert loaded.search("华东区", top_k=5) == expected
+    # 加载后可以继续增删
+    loaded.remove(["d5"])
+    assert [doc_id for doc_id, _ in loaded.search("华东区")] == ["d1"]
+
+def test_load_rejects_missing_file(tmp_path):
+    assert not BM25Index(tmp_path / "missing.pkl").load()
+
+def test_save_serializes_outside_the_lock(index, monkeypatch):
+    original_dump = bm25_index.pickle.dump
+    lock_free = []
+    
+    def dump(data, f, protocol=None):
+        # 序列化期间其他线程可以检索
+        result = []
+        thread = threading.Thread(target=lambda: result.append(index.search("9931")))
+        thread.start()
+        thread.join(timeout=1)
+        lock_free.append(bool(result))
+        original_dump(data, f, protocol=protocol)
+    
+    monkeypatch.setattr(bm25_index.pickle, "dump", dump)
+    index.save()
+    assert lock_free == [True]
+
+def test_save_if_due(index):
+    index.saved_at -= 100
+    index.save_if_due(30)
+    assert not index.dirty
+    assert index.path.exists()
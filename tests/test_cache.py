@@ -0,0 +1,79 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+from utils import cache as cache_module
+from utils.cache import Cache
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_module, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+@pytest.mark.asyncio
+async def test_least_recently_used_key_is_evicted():
+    cache = Cache(max_entries=2, sweep_interval=0)
+    await cache.set("a", 1)
+    await cache.set("b", 2)
+    assert await cache.get("a") == 1
+    await cache.set("c", 3)
+    assert await cache.get("b") is None
+    assert await cache.get("a") == 1 and await cache.get("c") == 3
+    assert cache.stats()["entries"] == 2
+    assert cache.stats()["evictions"] == 1
+
+@pytest.mark.asyncio
+async def test_max_bytes_evicts_until_under_limit():
+    cache = Cache(max_entries=0, max_bytes=3000, sweep_interval=0)
+    for key in "abc":
+        await cache.set(key, "x" * 1000)
+    assert cache.stats()["bytes"] <= 3000
+    assert await cache.get("a") is None
+    assert await cache.get("c") is not None
+    await cache.delete("c")
+    await cache.delete("b")
+    assert cache.stats()["bytes"] == 0
+
+@pytest.mark.asyncio
+async def test_expired_key_misses(clock):
+    cache = Cache(default_ttl=60, sweep_interval=0)
+    await cache.set("short", "v", ttl=10)
+    await cache.set("long", "v")
+    clock[0] += 11
+    assert await cache.get("short") is None
+    assert await cache.get("long") == "v"
+    assert cache.stats()["expirations"] == 1
+    assert cache.stats()["misses"] == 1
+
+@pytest.mark.asyncio
+async def test_set_sweeps_expired_keys(clock):
+    cache = Cache(default_ttl=10, sweep_interval=0)
+    for i in range(5):
+        await cache.set(f"k{i}", i)
+    clock[0] += 11
+    await cache.set("fresh", 1)
+    assert cache.stats()["entries"] == 1
+    assert cache.stats()["expirations"] == 5
+
+@pytest.mark.asyncio
+async def test_overwritten_key_keeps_new_expiry(clock):
+    cache = Cache(default_ttl=10, sweep_interval=0)
+    await cache.set("k", "old")
+    clock[0] += 5
+    await cache.set("k", "new", ttl=60)
+    # 堆里仍有旧值的过期时间，清理时不能误删新值
+    clock[0] += 6
+    await cache.set("other", 1)
+    assert await cache.get("k") == "new"
+    assert cache.stats()["expirations"] == 0
+
+@pytest.mark.asyncio
+async def test_background_sweeper_removes_expired_keys():
+    cache = Cache(default_ttl=0.05, sweep_interval=0.05)
+    await cache.connect()
+    try:
+        await cache.set("k", "v")
+        await asyncio.sleep(0.2)
+        assert cache.stats()["entries"] == 0
+    finally:
+        await cache.close()
@@ -0,0 +1,59 @@
+import threading
+import pytest
+import pytest_asyncio
+from retriever.chroma_retriever import ChromaRetriever
+from utils.config import VectorStoreConfig
+from utils.embedding_cache import EmbeddingCache
+
+def _fake_embedding(texts):
+    return [[float(len(text)), 1.0, 0.0] for text in texts]
+
+@pytest_asyncio.fixture
+async def retriever(tmp_path):
+    config = VectorStoreConfig(
+        provider="chroma",
+        collection_name="test_docs",
+        persist_directory=str(tmp_path / "chroma"),
+    )
+    retriever = ChromaRetriever(config, embedding_cache=EmbeddingCache(str(tmp_path / "cache"), "fake"))
+    retriever.embedding_function = _fake_embedding
+    yield retriever
+    await retriever.close()
+
+@pytest.mark.asyncio
+async def test_ingest_embedding_runs_on_write_pool(retriever):
+    documents = [{"content": f"第{i}季度销售额", "metadata": {"category": "sales"}} for i in range(3)]
+    assert await retriever.add_documents(documents)
+    assert retriever._search_executor.stats()["completed"] == 0
+    assert retriever._write_executor.stats()["completed"] >= 2
+    
+    # 检索时向量化走检索线程池，已入库的文本命中缓存
+    await retriever.embed_texts(["新的问题"])
+    assert retriever._search_executor.stats()["completed"] == 1
+    assert retriever.embedding_cache.get_many(["第0季度销售额"])[0] is not None
+
+@pytest.mark.asyncio
+async def test_hybrid_search_fuses_lexical_hits_off_the_event_loop(retriever):
+    retriever.config.vector_top_k = 1
+    await retriever.add_documents([
+        {"id": "near", "content": "库存周转天数"},
+        {"id": "sku", "content": "产品 SKU-9931 的库存周转天数为42天，低于行业平均水平"},
+        {"id": "other", "content": "华东区销售额同比增长15.3%，主要来自线上渠道和新开门店的贡献，华北区持平"},
+    ])
+    
+    threads = []
+    search = retriever.lexical.search
+    
+    def spy(*args, **kwargs):
+        threads.append(threading.current_thread().name)
+        return search(*args, **kwargs)
+    
+    retriever.lexical.search = spy
+    hits = await retriever.search("SKU-9931 库存", top_k=3)
+    contents = [hit["content"] for hit in hits]
+    
+    # 向量检索只取最近的1条；两路都命中的文档排在最前，只在词项检索中命中的文档通过RRF并入结果
+    assert contents == ["库存周转天数", "产品 SKU-9931 的库存周转天数为42天，低于行业平均水平"]
+    assert hits[0]["score"] == pytest.approx(1 / 61 + 1 / 62)
+    assert hits[1]["score"] == pytest.approx(1 / 61)
+    assert threads and all(name.startswith("chroma-search") for name in threads)
@@ -0,0 +1,49 @@
+import json
+import multiprocessing
+import os
+from pathlib import Path
+from retriever.epochs import CorpusEpochs
+
+def _bump_many(path: str, times: int):
+    epochs = CorpusEpochs(Path(path), partition_field="category")
+    for i in range(times):
+        epochs.bump([{"category": "sales"}, {"category": f"p{i % 2}"}])
+
+def test_concurrent_bumps_from_processes_are_not_lost(tmp_path):
+    path = tmp_path / "docs.epochs.json"
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=_bump_many, args=(str(path), 50)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=30)
+        assert worker.exitcode == 0
+    
+    data = json.loads(path.read_text(encoding="utf-8"))
+    assert data["epoch"] == 200
+    assert data["partitions"] == {"sales": 200, "p0": 100, "p1": 100}
+
+def test_bump_builds_on_writes_from_other_instances(tmp_path):
+    path = tmp_path / "docs.epochs.json"
+    first = CorpusEpochs(path, partition_field="category")
+    second = CorpusEpochs(path, partition_field="category")
+    first.bump([{"category": "sales"}])
+    second.bump([{"category": "sales"}])
+    first.bump([{"category": "hr"}])
+    assert first.token() == "all:3"
+    assert second.token({"category": "sales"}) == "category=sales:2"
+    assert second.token({"category": {"$eq": "hr"}}) == "category=hr:1"
+
+def test_token_sees_write_with_unchanged_mtime(tmp_path):
+    path = tmp_path / "docs.epochs.json"
+    writer = CorpusEpochs(path)
+    writer.bump()
+    reader = CorpusEpochs(path)
+    assert reader.token() == "all:1"
+    
+    # 同一时间戳粒度内的第二次写入：原地改写，修改时间、inode和大小都不变
+    stat = os.stat(path)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"epoch": 2, "partitions": {}}, f)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert reader.token() == "all:2"
@@ -0,0 +1,50 @@
+import asyncio
+import threading
+import pytest
+from prometheus_client import REGISTRY
+from utils.executor import BoundedExecutor, ExecutorQueueFullError
+
+def _gauge(name: str, pool: str) -> float:
+    return REGISTRY.get_sample_value(name, {"pool": pool}) or 0.0
+
+@pytest.mark.asyncio
+async def test_queue_depth_and_active_gauges():
+    executor = BoundedExecutor("test-gauges", max_workers=1, max_queue=2)
+    release = threading.Event()
+    try:
+        tasks = [asyncio.ensure_future(executor.run(release.wait, 5)) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        assert _gauge("executor_active", "test-gauges") == 1
+        assert _gauge("executor_queue_depth", "test-gauges") == 2
+        assert executor.stats()["waiting"] == 2
+        
+        # 排队已满时直接拒绝
+        with pytest.raises(ExecutorQueueFullError):
+            await executor.run(release.wait, 5)
+        assert REGISTRY.get_sample_value("executor_rejected_total", {"pool": "test-gauges"}) == 1
+        
+        release.set()
+        await asyncio.gather(*tasks)
+        assert _gauge("executor_active", "test-gauges") == 0
+        assert _gauge("executor_queue_depth", "test-gauges") == 0
+        assert executor.stats()["completed"] == 3
+    finally:
+        release.set()
+        executor.shutdown()
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_leaves_queue():
+    executor = BoundedExecutor("test-cancel", max_workers=1)
+    release = threading.Event()
+    try:
+        running = asyncio.ensure_future(executor.run(release.wait, 5))
+        waiting = asyncio.ensure_future(executor.run(release.wait, 5))
+        await asyncio.sleep(0.05)
+        waiting.cancel()
+        await asyncio.sleep(0)
+        assert _gauge("executor_queue_depth", "test-cancel") == 0
+        release.set()
+        await running
+    finally:
+        release.set()
+        executor.shutdown()
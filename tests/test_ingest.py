@@ -0,0 +1,46 @@
+import json
+from typing import List
+import pytest
+from retriever.ingest import iter_ndjson
+
+async def _chunks(data: bytes, size: int):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+async def _parse(data: bytes, size: int, max_line_bytes: int = 0):
+    errors: List[str] = []
+    documents = [doc async for doc in iter_ndjson(_chunks(data, size), errors, max_line_bytes)]
+    return documents, errors
+
+def _ndjson(*documents) -> bytes:
+    return "".join(json.dumps(doc, ensure_ascii=False) + "\n" for doc in documents).encode("utf-8")
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("size", [1, 7, 64, 4096])
+async def test_lines_split_across_chunks(size):
+    data = _ndjson({"content": "华东区销售额"}, {"content": "b", "metadata": {"k": 1}}) + b'{"content": "no newline"}'
+    documents, errors = await _parse(data, size)
+    assert [doc["content"] for doc in documents] == ["华东区销售额", "b", "no newline"]
+    assert errors == []
+
+@pytest.mark.asyncio
+async def test_invalid_lines_are_reported_and_skipped():
+    data = b'{"content": "a"}\n\nnot json\n{"content": 1}\n{"content": "b"}\n'
+    documents, errors = await _parse(data, 5)
+    assert [doc["content"] for doc in documents] == ["a", "b"]
+    assert [error.split(":")[0] for error in errors] == ["line 3", "line 4"]
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("size", [3, 50, 10000])
+async def test_oversized_lines_are_rejected(size):
+    long_line = json.dumps({"content": "x" * 500}).encode()
+    data = _ndjson({"content": "a"}) + long_line + b"\n" + _ndjson({"content": "b"}) + long_line
+    documents, errors = await _parse(data, size, max_line_bytes=100)
+    assert [doc["content"] for doc in documents] == ["a", "b"]
+    assert errors == ["line 2: line exceeds 100 bytes", "line 4: line exceeds 100 bytes"]
+
+@pytest.mark.asyncio
+async def test_line_at_the_limit_is_accepted():
+    line = json.dumps({"content": "abc"}).encode()
+    documents, errors = await _parse(line + b"\n", 4, max_line_bytes=len(line))
+    assert documents == [{"content": "abc"}] and errors == []
@@ -0,0 +1,24 @@
+from llm.factory import embedding_model_for
+from utils.config import LLMProviderConfig, settings
+
+def _settings(**providers):
+    copy = settings.model_copy(deep=True)
+    copy.llm.providers = {
+        name: LLMProviderConfig(model="m", temperature=0.7, max_tokens=100, **config)
+        for name, config in providers.items()
+    }
+    copy.vector_store.embedding_model = "all-MiniLM-L6-v2"
+    return copy
+
+def test_ollama_defaults_to_vector_store_embedding_model():
+    assert embedding_model_for("ollama", _settings(ollama={})) == "all-MiniLM-L6-v2"
+
+def test_openai_uses_its_own_default_embedding_model():
+    config = _settings(openai={}, vllm={"type": "openai"})
+    assert embedding_model_for("openai", config) == "text-embedding-3-small"
+    assert embedding_model_for("vllm", config) == "text-embedding-3-small"
+
+def test_configured_embedding_model_wins():
+    config = _settings(openai={"embedding_model": "bge-m3"}, ollama={"embedding_model": "nomic-embed-text"})
+    assert embedding_model_for("openai", config) == "bge-m3"
+    assert embedding_model_for("ollama", config) == "nomic-embed-text"
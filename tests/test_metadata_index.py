@@ -0,0 +1,69 @@
+import pytest
+from retriever.metadata_index import MetadataIndex
+
+@pytest.fixture
+def index():
+    index = MetadataIndex(fields=["category", "department"], date_field="date")
+    index.add(
+        ["d1", "d2", "d3", "d4"],
+        [
+            {"category": "sales", "department": "east", "date": "2024-03-31"},
+            {"category": "sales", "department": "north", "date": "2024-06-30"},
+            {"category": "marketing", "department": "east", "date": "2024-06-30T12:00"},
+            None,
+        ]
+    )
+    return index
+
+def test_resolve_by_field_values(index):
+    assert index.resolve({"category": "sales"}) == {"d1", "d2"}
+    assert index.resolve({"category": ["sales", "marketing"], "department": "east"}) == {"d1", "d3"}
+    assert index.resolve({"category": "hr"}) == set()
+    assert index.resolve({}) == {"d1", "d2", "d3", "d4"}
+
+def test_date_range_is_inclusive(index):
+    assert index.resolve({"date_from": "2024-06-30"}) == {"d2", "d3"}
+    assert index.resolve({"date_to": "2024-06-30"}) == {"d1", "d2", "d3"}
+    assert index.resolve({"date_from": "2024-04-01", "date_to": "2024-05-31"}) == set()
+    assert index.resolve({"category": "sales", "date_to": "2024-04-30"}) == {"d1"}
+
+def test_replace_and_remove(index):
+    index.add(["d1"], [{"category": "marketing", "date": "2024-09-30"}])
+    assert index.resolve({"category": "sales"}) == {"d2"}
+    assert index.resolve({"category": "marketing"}) == {"d1", "d3"}
+    assert index.resolve({"date_from": "2024-07-01"}) == {"d1"}
+    
+    index.remove(["d2", "d3", "missing"])
+    assert len(index) == 2
+    assert index.resolve({"category": ["sales", "marketing"]}) == {"d1"}
+    assert index.resolve({"date_to": "2024-06-30"}) == set()
+
+def test_freed_slots_are_reused_without_stale_bits(index):
+    index.remove(["d1"])
+    index.add(["d5"], [{"category": "hr", "department": "west"}])
+    assert index.resolve({"department": "east"}) == {"d3"}
+    assert index.resolve({"category": "hr"}) == {"d5"}
+    assert index.resolve({"date_to": "2024-03-31"}) == set()
+
+def test_duplicate_ids_in_one_batch_keep_the_last(index):
+    index.add(
+        ["d6", "d6", "d7"],
+        [
+            {"category": "sales", "date": "2024-01-31"},
+            {"category": "finance", "date": "2024-12-31"},
+            {"category": "sales"},
+        ]
+    )
+    assert index.resolve({"category": "finance"}) == {"d6"}
+    assert index.resolve({"category": "sales"}) == {"d1", "d2", "d7"}
+    assert index.resolve({"date_from": "2024-12-01"}) == {"d6"}
+    assert index.resolve({"date_to": "2024-01-31"}) == set()
+    
+    index.remove(["d6"])
+    assert index.resolve({"category": "finance"}) == set()
+    assert len(index) == 5
+
+def test_rebuild_replaces_contents(index):
+    index.rebuild(["x"], [{"category": "sales"}])
+    assert len(index) == 1
+    assert index.resolve({"category": "sales"}) == {"x"}
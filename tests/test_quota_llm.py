@@ -0,0 +1,85 @@
+from typing import Any, AsyncIterator, Dict, List, Optional
+import time
+import pytest
+from llm.base import BaseLLM
+from llm.quota import QuotaLLM
+from llm.scheduler import LLMOverloadedError
+from utils.rate_limiter import GCRALimiter
+from utils.token_quota import TokenQuota, _principals, record_usage
+
+class FakeLLM(BaseLLM):
+    """按设定行为返回结果或抛出异常的LLM"""
+    
+    def __init__(self, error: Optional[BaseException] = None, usage: Optional[tuple] = None):
+        self.error = error
+        self.usage = usage
+        super().__init__({"max_tokens": 500})
+    
+    def _initialize_model(self) -> Any:
+        return None
+    
+    async def generate(self, prompt: str, system_message=None, temperature=None, max_tokens=None) -> str:
+        if self.error is not None:
+            raise self.error
+        if self.usage:
+            record_usage(*self.usage)
+        return "ok"
+    
+    async def generate_with_history(self, messages: List[Dict[str, str]], temperature=None, max_tokens=None) -> str:
+        return await self.generate("")
+    
+    async def generate_stream(self, prompt: str, system_message=None, temperature=None, max_tokens=None) -> AsyncIterator[str]:
+        if self.error is not None:
+            raise self.error
+        yield "ok"
+        if self.usage:
+            record_usage(*self.usage)
+    
+    async def embed_text(self, text: str) -> List[float]:
+        return [0.0]
+
+def _quota() -> tuple:
+    limiter = GCRALimiter(rate=0.001, burst=1000)
+    return limiter, TokenQuota([("client", limiter, 1000)])
+
+def _used(limiter: GCRALimiter) -> int:
+    """桶中已用额度（约数）"""
+    tat = limiter._tat.get("tokens:client:c")
+    return 0 if tat is None else round((tat - time.monotonic()) / limiter.interval)
+
+@pytest.fixture(autouse=True)
+def principal():
+    token = _principals.set([("client", "c")])
+    yield
+    _principals.reset(token)
+
+@pytest.mark.asyncio
+async def test_reported_usage_is_charged():
+    limiter, quota = _quota()
+    await QuotaLLM(FakeLLM(usage=(30, 6)), quota).generate("问题")
+    assert _used(limiter) == 36
+
+@pytest.mark.asyncio
+async def test_overloaded_request_is_refunded():
+    limiter, quota = _quota()
+    llm = QuotaLLM(FakeLLM(error=LLMOverloadedError("busy", 1.0)), quota)
+    with pytest.raises(LLMOverloadedError):
+        await llm.generate("问题")
+    assert _used(limiter) == 0
+
+@pytest.mark.asyncio
+async def test_stream_overloaded_before_first_token_is_refunded():
+    limiter, quota = _quota()
+    llm = QuotaLLM(FakeLLM(error=LLMOverloadedError("busy", 1.0)), quota)
+    with pytest.raises(LLMOverloadedError):
+        async for _ in llm.generate_stream("问题"):
+            pass
+    assert _used(limiter) == 0
+
+@pytest.mark.asyncio
+async def test_unreported_failure_keeps_reservation():
+    limiter, quota = _quota()
+    llm = QuotaLLM(FakeLLM(error=RuntimeError("connection reset")), quota)
+    with pytest.raises(RuntimeError):
+        await llm.generate("问题")
+    assert _used(limiter) > 500
@@ -0,0 +1,96 @@
+from types import SimpleNamespace
+import pytest
+from utils import rate_limiter
+from utils.rate_limiter import GCRALimiter, RateLimitMiddleware, RedisRateLimiter
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rate_limiter, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+async def _ok_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+async def _call(middleware: RateLimitMiddleware, client: str = "10.0.0.1", type_: str = "http"):
+    """发送一个请求，返回状态码和响应头"""
+    messages = []
+    
+    async def send(message):
+        messages.append(message)
+    
+    await middleware({"type": type_, "client": (client, 50000)}, None, send)
+    start = messages[0]
+    return start["status"], dict(start["headers"])
+
+@pytest.mark.asyncio
+async def test_burst_then_429_with_retry_after(clock):
+    middleware = RateLimitMiddleware(_ok_app, requests_per_minute=60, burst_limit=3)
+    for _ in range(3):
+        assert (await _call(middleware))[0] == 200
+    status, headers = await _call(middleware)
+    assert status == 429
+    assert headers[b"retry-after"] == b"1"
+    assert headers[b"content-type"] == b"application/json"
+    
+    # 其他客户端不受影响；一个发放间隔后原客户端恢复一个请求
+    assert (await _call(middleware, client="10.0.0.2"))[0] == 200
+    clock[0] += 1.0
+    assert (await _call(middleware))[0] == 200
+    assert (await _call(middleware))[0] == 429
+
+@pytest.mark.asyncio
+async def test_rejected_requests_do_not_consume_quota(clock):
+    middleware = RateLimitMiddleware(_ok_app, requests_per_minute=60, burst_limit=1)
+    assert (await _call(middleware))[0] == 200
+    for _ in range(10):
+        assert (await _call(middleware))[0] == 429
+    clock[0] += 1.0
+    assert (await _call(middleware))[0] == 200
+
+@pytest.mark.asyncio
+async def test_non_http_scope_is_not_limited():
+    middleware = RateLimitMiddleware(_ok_app, requests_per_minute=60, burst_limit=1)
+    for _ in range(3):
+        assert (await _call(middleware, type_="websocket"))[0] == 200
+    assert len(middleware.limiter) == 0
+
+def test_admissions_sweep_refilled_buckets(clock):
+    limiter = GCRALimiter(rate=1.0, burst=5)
+    for i in range(100):
+        assert limiter.check(f"idle-{i}") == 0
+    assert len(limiter) == 100
+    
+    # 空闲桶回满后，每次放行从队首清理至多两个
+    clock[0] += 2.0
+    for i in range(10):
+        assert limiter.check(f"active-{i}") == 0
+    assert len(limiter) == 100 + 10 - 20
+    for i in range(100):
+        limiter.check(f"active-{i % 10}")
+    assert len(limiter) == 10
+
+def test_sweep_keeps_buckets_that_are_not_refilled(clock):
+    limiter = GCRALimiter(rate=1.0, burst=5)
+    for _ in range(3):
+        limiter.check("busy")
+    clock[0] += 2.0
+    limiter.check("other")
+    assert len(limiter) == 2
+    # 还剩一个请求的积压，只能再放行四个
+    for _ in range(4):
+        assert limiter.check("busy") == 0
+    assert limiter.check("busy") > 0
+
+@pytest.mark.asyncio
+async def test_redis_limiter_falls_back_when_redis_is_down():
+    limiter = RedisRateLimiter("redis://127.0.0.1:1/0", rate=1.0, burst=2, socket_timeout=0.2)
+    try:
+        assert await limiter.acquire("c") == 0
+        assert await limiter.acquire("c") == 0
+        assert await limiter.acquire("c") > 0
+        # 降级期间不再尝试连接Redis
+        assert limiter.errors == 1
+    finally:
+        await limiter.close()
@@ -0,0 +1,76 @@
+import asyncio
+import fakeredis
+import pytest
+import pytest_asyncio
+from utils.redis_cache import RedisCache, deserialize, serialize
+
+@pytest_asyncio.fixture
+async def cache():
+    cache = RedisCache("redis://localhost:6379/0", default_ttl=60, key_prefix="test:")
+    await cache.fallback.connect()
+    cache._client = fakeredis.FakeAsyncRedis(server=fakeredis.FakeServer())
+    yield cache
+    await cache.close()
+
+def test_serialize_round_trip():
+    small = {"answer": "答案", "prompt_tokens": 12}
+    large = {"context": "销售额增长" * 500}
+    assert serialize(small)[:1] == b"J"
+    assert serialize(large)[:1] == b"Z"
+    assert len(serialize(large)) < len(str(large).encode("utf-8"))
+    assert deserialize(serialize(small)) == small
+    assert deserialize(serialize(large)) == large
+
+@pytest.mark.asyncio
+async def test_hit_and_miss(cache):
+    assert await cache.get("q1") is None
+    assert await cache.set("q1", {"answer": "42"})
+    assert await cache.get("q1") == {"answer": "42"}
+    assert cache.hits == 1 and cache.misses == 1
+    assert await cache._client.exists("test:q1")
+
+@pytest.mark.asyncio
+async def test_get_many_and_set_many(cache):
+    assert await cache.set_many({"a": 1, "b": [1, 2]})
+    assert await cache.get_many(["a", "missing", "b"]) == [1, None, [1, 2]]
+
+@pytest.mark.asyncio
+async def test_ttl_expiry(cache):
+    await cache.set("short", "v", ttl=1)
+    await cache.set("default", "v")
+    assert await cache._client.ttl("test:default") == 60
+    await asyncio.sleep(1.1)
+    assert await cache.get("short") is None
+    assert await cache.get("default") == "v"
+
+@pytest.mark.asyncio
+async def test_clear_only_removes_own_namespace(cache):
+    await cache.set("a", 1)
+    await cache._client.set("other:a", b"J1")
+    assert await cache.clear()
+    assert await cache.get("a") is None
+    assert await cache._client.get("other:a") == b"J1"
+
+@pytest.mark.asyncio
+async def test_falls_back_to_memory_when_redis_down(cache):
+    server = fakeredis.FakeServer()
+    server.connected = False
+    cache._client = fakeredis.FakeAsyncRedis(server=server)
+    assert await cache.set("q", {"answer": "fallback"})
+    assert cache.errors == 1
+    # 冷却期内不再访问Redis，直接使用内存缓存
+    assert await cache.get("q") == {"answer": "fallback"}
+    assert cache.errors == 1
+    assert cache.fallback_ops == 2
+
+@pytest.mark.asyncio
+async def test_connect_to_unreachable_redis_uses_fallback():
+    cache = RedisCache("redis://127.0.0.1:1/0", socket_timeout=0.2, retry_interval=60)
+    await cache.connect()
+    try:
+        assert cache.errors == 1
+        assert await cache.set("k", "v")
+        assert await cache.get("k") == "v"
+        assert cache.fallback_ops == 2
+    finally:
+        await cache.close()
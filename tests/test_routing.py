@@ -0,0 +1,242 @@
+import asyncio
+import json
+import time
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from llm.openai_llm import OpenAILLM
+from llm.routing import RoutingLLM
+from utils.token_quota import reset_usage, start_usage
+
+class StubOpenAI:
+    """进程内的OpenAI兼容服务：可设置延迟和失败，记录收到的请求"""
+    
+    def __init__(self, name: str, delay: float = 0.0):
+        self.name = name
+        self.delay = delay
+        self.fail = False
+        self.requests = 0
+        self.url = ""
+        self._runner = None
+    
+    async def chat(self, request: web.Request) -> web.StreamResponse:
+        self.requests += 1
+        body = await request.json()
+        if self.fail:
+            return web.json_response({"error": {"message": "boom"}}, status=500)
+        await asyncio.sleep(self.delay)
+        if not body.get("stream"):
+            return web.json_response({
+                "id": "x", "object": "chat.completion", "created": 0, "model": body["model"],
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": self.name}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 3, "completion_tokens": 1, "total_tokens": 4},
+            })
+        
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for token in (self.name, "-", "ok"):
+            chunk = {
+                "id": "x", "object": "chat.completion.chunk", "created": 0, "model": body["model"],
+                "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        if (body.get("stream_options") or {}).get("include_usage"):
+            usage = {
+                "id": "x", "object": "chat.completion.chunk", "created": 0, "model": body["model"], "choices": [],
+                "usage": {"prompt_tokens": 3, "completion_tokens": 3, "total_tokens": 6},
+            }
+            await response.write(f"data: {json.dumps(usage)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        return response
+    
+    async def embeddings(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        # 故意倒序返回，客户端需按 index 还原顺序
+        data = [
+            {"object": "embedding", "index": i, "embedding": [float(len(text)), 1.0]}
+            for i, text in reversed(list(enumerate(body["input"])))
+        ]
+        return web.json_response({"object": "list", "model": body["model"], "data": data,
+                                  "usage": {"prompt_tokens": 1, "total_tokens": 1}})
+    
+    async def start(self):
+        app = web.Application()
+        app.add_routes([
+            web.post("/v1/chat/completions", self.chat),
+            web.post("/v1/embeddings", self.embeddings),
+        ])
+        # 关闭时不等待仍在模拟延迟的请求
+        self._runner = web.AppRunner(app, shutdown_timeout=0.1)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}/v1"
+    
+    async def stop(self):
+        await self._runner.cleanup()
+
+def _llm(stub: StubOpenAI, **config) -> OpenAILLM:
+    return OpenAILLM({"model": "stub", "api_base": stub.url, "max_retries": 0, **config})
+
+@pytest_asyncio.fixture
+async def stubs():
+    fast, slow = StubOpenAI("fast"), StubOpenAI("slow")
+    await fast.start()
+    await slow.start()
+    yield fast, slow
+    await fast.stop()
+    await slow.stop()
+
+@pytest_asyncio.fixture
+async def router(stubs):
+    fast, slow = stubs
+    routing = RoutingLLM(
+        [("primary", _llm(slow)), ("fallback", _llm(fast))],
+        hedge_delay=0.2,
+        failure_threshold=2,
+        cooldown=0.3,
+    )
+    yield routing
+    await routing.close()
+
+@pytest.mark.asyncio
+async def test_openai_llm_against_stub(stubs):
+    fast, _ = stubs
+    llm = _llm(fast, embed_batch_size=2)
+    try:
+        assert await llm.generate("hi") == "fast"
+        assert [token async for token in llm.generate_stream("hi")] == ["fast", "-", "ok"]
+        assert await llm.embed_texts(["a", "bb", "ccc"]) == [[1.0, 1.0], [2.0, 1.0], [3.0, 1.0]]
+    finally:
+        await llm.close()
+
+@pytest.mark.asyncio
+async def test_openai_stream_records_usage(stubs):
+    fast, _ = stubs
+    llm = _llm(fast)
+    usage, token = start_usage()
+    try:
+        assert [token async for token in llm.generate_stream("hi")] == ["fast", "-", "ok"]
+    finally:
+        reset_usage(token)
+        await llm.close()
+    assert usage.reported
+    assert (usage.prompt_tokens, usage.completion_tokens) == (3, 3)
+
+@pytest.mark.asyncio
+async def test_breaker_opens_after_failures_and_half_opens(router, stubs):
+    fast, slow = stubs
+    slow.fail = True
+    primary, fallback = router.backends
+    # 让 primary 的得分保持更优，每次都先走 primary，失败后转移到 fallback
+    fallback.latency = 10.0
+    for _ in range(2):
+        assert await router.generate("hi") == "fast"
+    assert primary.consecutive_failures == 2
+    assert router.stats()["primary"]["circuit_open"]
+    
+    # 熔断期间不再向 primary 发请求
+    sent = slow.requests
+    assert await router.generate("hi") == "fast"
+    assert slow.requests == sent
+    
+    # 冷却结束后放行一个探测请求，成功即恢复
+    slow.fail = False
+    await asyncio.sleep(0.35)
+    assert await router.generate("hi") == "slow"
+    assert slow.requests == sent + 1
+    assert not router.stats()["primary"]["circuit_open"]
+    assert primary.consecutive_failures == 0
+
+@pytest.mark.asyncio
+async def test_failed_half_open_probe_reopens_breaker(router, stubs):
+    fast, slow = stubs
+    slow.fail = True
+    primary, fallback = router.backends
+    fallback.latency = 10.0
+    for _ in range(2):
+        await router.generate("hi")
+    await asyncio.sleep(0.35)
+    assert await router.generate("hi") == "fast"
+    assert primary.open_until > time.monotonic()
+    assert not primary.half_open_probe
+
+@pytest.mark.asyncio
+async def test_hedge_fires_after_delay_and_cancels_loser(router, stubs):
+    fast, slow = stubs
+    slow.delay = 2.0
+    primary, fallback = router.backends
+    
+    started = time.monotonic()
+    assert await router.generate("hi") == "fast"
+    elapsed = time.monotonic() - started
+    assert 0.2 <= elapsed < 1.0
+    assert slow.requests == 1 and fast.requests == 1
+    assert fallback.hedged == 1
+    
+    # 慢请求在返回前已被取消：不在途、不计失败、也没有记录延迟样本
+    assert primary.in_flight == 0
+    assert primary.failures == 0
+    assert primary.latency == 1.0
+    assert fallback.latency < 1.0
+
+@pytest.mark.asyncio
+async def test_no_hedge_when_primary_is_fast(router, stubs):
+    fast, slow = stubs
+    assert await router.generate("hi") == "slow"
+    assert fast.requests == 0
+    assert router.stats()["fallback"]["hedged"] == 0
+
+@pytest.mark.asyncio
+async def test_stream_fails_over_before_first_token(router, stubs):
+    fast, slow = stubs
+    slow.fail = True
+    tokens = [token async for token in router.generate_stream("hi")]
+    assert tokens == ["fast", "-", "ok"]
+    assert slow.requests == 1
+    stats = router.stats()
+    assert stats["primary"]["failures"] == 1
+    assert stats["fallback"]["failures"] == 0
+    assert stats["primary"]["in_flight"] == 0 and stats["fallback"]["in_flight"] == 0
+
+@pytest.mark.asyncio
+async def test_stream_raises_when_all_backends_fail(router, stubs):
+    fast, slow = stubs
+    slow.fail = fast.fail = True
+    with pytest.raises(Exception):
+        async for _ in router.generate_stream("hi"):
+            pass
+    assert slow.requests == 1 and fast.requests == 1
+
+@pytest.mark.asyncio
+async def test_cancelled_probe_stream_allows_next_probe(router, stubs):
+    fast, slow = stubs
+    slow.fail = True
+    primary, fallback = router.backends
+    fallback.latency = 10.0
+    for _ in range(2):
+        await router.generate("hi")
+    assert router.stats()["primary"]["circuit_open"]
+    
+    # 冷却结束后的探测是流式请求，首个token之前客户端断开
+    slow.fail = False
+    slow.delay = 5.0
+    await asyncio.sleep(0.35)
+    
+    async def consume():
+        async for _ in router.generate_stream("hi"):
+            pass
+    
+    task = asyncio.ensure_future(consume())
+    await asyncio.sleep(0.2)
+    assert primary.half_open_probe
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert not primary.half_open_probe
+    
+    # 下一个请求仍可作为探测发往 primary
+    slow.delay = 0.0
+    assert await router.generate("hi") == "slow"
+    assert not router.stats()["primary"]["circuit_open"]
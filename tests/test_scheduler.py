@@ -0,0 +1,126 @@
+import asyncio
+import time
+import pytest
+from llm.scheduler import LLMOverloadedError, LLMScheduler, Priority, llm_priority
+
+async def _queued(scheduler: LLMScheduler, priority: Priority, order: list, name: str):
+    await scheduler.acquire(priority)
+    order.append(name)
+    scheduler.release(0.01)
+
+@pytest.mark.asyncio
+async def test_queue_is_ordered_by_priority_then_arrival():
+    scheduler = LLMScheduler("test", max_concurrency=1, max_queue=10)
+    await scheduler.acquire(Priority.INTERACTIVE)
+    order = []
+    tasks = []
+    for name, priority in (
+        ("background", Priority.BACKGROUND),
+        ("batch-1", Priority.BATCH),
+        ("interactive", Priority.INTERACTIVE),
+        ("batch-2", Priority.BATCH),
+    ):
+        tasks.append(asyncio.ensure_future(_queued(scheduler, priority, order, name)))
+        await asyncio.sleep(0)
+    assert scheduler.stats()["waiting"] == {"interactive": 1, "batch": 2, "background": 1}
+    
+    scheduler.release(0.01)
+    await asyncio.gather(*tasks)
+    assert order == ["interactive", "batch-1", "batch-2", "background"]
+    assert scheduler.active == 0
+
+@pytest.mark.asyncio
+async def test_full_queue_preempts_lower_priority():
+    scheduler = LLMScheduler("test", max_concurrency=1, max_queue=1)
+    await scheduler.acquire(Priority.INTERACTIVE)
+    background = asyncio.ensure_future(scheduler.acquire(Priority.BACKGROUND))
+    await asyncio.sleep(0)
+    interactive = asyncio.ensure_future(scheduler.acquire(Priority.INTERACTIVE))
+    await asyncio.sleep(0)
+    
+    with pytest.raises(LLMOverloadedError, match="preempted"):
+        await background
+    # 不比队尾优先的新请求直接拒绝
+    with pytest.raises(LLMOverloadedError, match="queue_full"):
+        await scheduler.acquire(Priority.BATCH)
+    
+    scheduler.release(0.01)
+    await interactive
+    scheduler.release(0.01)
+    assert scheduler.active == 0
+    assert scheduler.stats()["waiting"] == {"interactive": 0, "batch": 0, "background": 0}
+
+@pytest.mark.asyncio
+async def test_max_queue_zero_rejects_instead_of_queueing():
+    scheduler = LLMScheduler("test", max_concurrency=1, max_queue=0)
+    await scheduler.acquire(Priority.BACKGROUND)
+    with pytest.raises(LLMOverloadedError, match="queue_full"):
+        await scheduler.acquire(Priority.INTERACTIVE)
+    scheduler.release(0.01)
+    await scheduler.acquire(Priority.INTERACTIVE)
+    assert scheduler.active == 1
+
+@pytest.mark.asyncio
+async def test_estimated_wait_beyond_deadline_is_rejected_at_admission():
+    scheduler = LLMScheduler("test", max_concurrency=1, timeouts={Priority.INTERACTIVE: 1.0}, initial_service_time=5.0)
+    await scheduler.acquire()
+    started = time.monotonic()
+    with pytest.raises(LLMOverloadedError, match="deadline") as error:
+        await scheduler.acquire()
+    assert time.monotonic() - started < 0.1
+    assert error.value.retry_after >= 1.0
+
+@pytest.mark.asyncio
+async def test_queued_request_is_shed_when_deadline_passes():
+    # 估算的等待时间很短，入队被接受，但持有槽位的请求迟迟不释放
+    scheduler = LLMScheduler("test", max_concurrency=1, initial_service_time=0.01)
+    await scheduler.acquire()
+    started = time.monotonic()
+    with llm_priority(Priority.INTERACTIVE, timeout=0.1):
+        with pytest.raises(LLMOverloadedError, match="deadline"):
+            await asyncio.wait_for(scheduler.acquire(), 2)
+    assert 0.09 <= time.monotonic() - started < 0.5
+    assert scheduler.stats()["waiting"]["interactive"] == 0
+    
+    # 被放弃的请求不会再占用槽位
+    scheduler.release(0.01)
+    assert scheduler.active == 0
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_leaves_the_queue():
+    scheduler = LLMScheduler("test", max_concurrency=1)
+    await scheduler.acquire()
+    waiter = asyncio.ensure_future(scheduler.acquire(Priority.BATCH))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    assert scheduler.stats()["waiting"]["batch"] == 0
+    scheduler.release(0.01)
+    assert scheduler.active == 0
+
+@pytest.mark.asyncio
+async def test_slot_handed_to_cancelled_waiter_is_passed_on():
+    scheduler = LLMScheduler("test", max_concurrency=1)
+    await scheduler.acquire()
+    first = asyncio.ensure_future(scheduler.acquire(Priority.INTERACTIVE))
+    second = asyncio.ensure_future(scheduler.acquire(Priority.INTERACTIVE))
+    await asyncio.sleep(0)
+    # 槽位移交给 first 后、first 恢复执行前被取消
+    scheduler.release(0.01)
+    first.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await first
+    await asyncio.wait_for(second, 1)
+    assert scheduler.active == 1
+
+@pytest.mark.asyncio
+async def test_run_updates_service_time():
+    scheduler = LLMScheduler("test", max_concurrency=2, initial_service_time=1.0)
+    
+    async def work():
+        return "ok"
+    
+    assert await scheduler.run(work) == "ok"
+    assert scheduler.service_time < 1.0
+    assert scheduler.completed == 1 and scheduler.active == 0
@@ -0,0 +1,88 @@
+from types import SimpleNamespace
+import pytest
+from qa_engine import semantic_cache
+from qa_engine.semantic_cache import SemanticCache
+
+async def _same_vector(question: str):
+    # 最差情况的向量模型：任何问题的相似度都是1
+    return [1.0, 0.0, 0.0]
+
+def _result(question: str) -> dict:
+    return {"question": question, "answer": f"answer to {question}"}
+
+async def _remember(cache: SemanticCache, question: str, scope: str = ""):
+    _, vector = await cache.lookup(question, scope)
+    cache.store(vector, _result(question), scope)
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("cached, asked", [
+    ("2024年第二季度华东区的销售额是多少？", "2024年第三季度华东区的销售额是多少？"),
+    ("2024年第二季度华东区的销售额是多少？", "2024年第二季度华北区的销售额是多少？"),
+    ("2024年第二季度华东区的销售额是多少？", "2023年第二季度华东区的销售额是多少？"),
+    ("本季度销售部的业绩如何", "上季度销售部的业绩如何"),
+    ("What were Q2 sales in East?", "What were Q3 sales in East?"),
+    ("What were Q2 sales in East?", "What were Q2 sales in West?"),
+])
+async def test_near_miss_questions_do_not_match(cached, asked):
+    cache = SemanticCache(_same_vector)
+    await _remember(cache, cached)
+    hit, _ = await cache.lookup(asked)
+    assert hit is None
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("cached, asked", [
+    ("2024年第二季度华东区的销售额是多少？", "华东区2024年第2季度销售额多少"),
+    ("What were Q2 sales in East?", "Show Q2 sales for East"),
+])
+async def test_paraphrase_with_same_key_terms_matches(cached, asked):
+    cache = SemanticCache(_same_vector)
+    await _remember(cache, cached)
+    hit, _ = await cache.lookup(asked)
+    assert hit["answer"] == f"answer to {cached}"
+    assert cache.stats()["hits"] == 1
+
+@pytest.mark.asyncio
+async def test_scopes_do_not_share_answers():
+    cache = SemanticCache(_same_vector)
+    await _remember(cache, "各区域的销售额", scope="category=sales")
+    assert (await cache.lookup("各区域的销售额", scope="category=hr"))[0] is None
+    assert (await cache.lookup("各区域的销售额", scope="category=sales"))[0] is not None
+
+@pytest.mark.asyncio
+async def test_least_recently_used_entry_is_evicted():
+    cache = SemanticCache(_same_vector, max_entries=2)
+    for question in ("Q1销售额", "Q2销售额"):
+        await _remember(cache, question)
+    # 读取Q1后它比Q2更新，写入Q3时淘汰Q2
+    assert (await cache.lookup("Q1销售额"))[0] is not None
+    await _remember(cache, "Q3销售额")
+    assert (await cache.lookup("Q2销售额"))[0] is None
+    assert (await cache.lookup("Q1销售额"))[0] is not None
+    assert (await cache.lookup("Q3销售额"))[0] is not None
+    assert cache.stats()["entries"] == 2
+    assert cache.stats()["evictions"] == 1
+
+@pytest.mark.asyncio
+async def test_least_recently_used_scope_is_evicted():
+    cache = SemanticCache(_same_vector, max_scopes=2)
+    for scope in ("a", "b"):
+        await _remember(cache, "销售额", scope=scope)
+    await cache.lookup("销售额", scope="a")
+    await _remember(cache, "销售额", scope="c")
+    assert (await cache.lookup("销售额", scope="b"))[0] is None
+    assert (await cache.lookup("销售额", scope="a"))[0] is not None
+    assert cache.stats()["scopes"] == 2
+
+@pytest.mark.asyncio
+async def test_expired_entry_misses_and_slot_is_reused(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(semantic_cache, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    cache = SemanticCache(_same_vector, max_entries=1, ttl=60)
+    await _remember(cache, "Q1销售额")
+    now[0] += 61
+    assert (await cache.lookup("Q1销售额"))[0] is None
+    
+    # 过期条目的位置直接复用，不算作淘汰
+    await _remember(cache, "Q2销售额")
+    assert (await cache.lookup("Q2销售额"))[0] is not None
+    assert cache.stats()["evictions"] == 0
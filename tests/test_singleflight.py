@@ -0,0 +1,143 @@
+import asyncio
+import pytest
+from prometheus_client import REGISTRY
+from utils.singleflight import SingleFlight
+
+@pytest.mark.asyncio
+async def test_do_coalesces_concurrent_calls():
+    flight = SingleFlight()
+    calls = 0
+    
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return "answer"
+    
+    results = await asyncio.gather(*(flight.do("q", work) for _ in range(5)))
+    assert results == ["answer"] * 5
+    assert calls == 1
+    assert flight.stats() == {"executed": 1, "coalesced": 4, "in_flight": 0}
+    
+    # 前一次调用结束后同一个键重新执行
+    assert await flight.do("q", work) == "answer"
+    assert calls == 2
+
+@pytest.mark.asyncio
+async def test_do_propagates_errors_to_all_waiters():
+    flight = SingleFlight()
+    
+    async def work():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+    
+    results = await asyncio.gather(*(flight.do("q", work) for _ in range(3)), return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
+
+@pytest.mark.asyncio
+async def test_cancelling_one_waiter_keeps_work_for_others():
+    flight = SingleFlight()
+    
+    async def work():
+        await asyncio.sleep(0.05)
+        return "answer"
+    
+    first = asyncio.ensure_future(flight.do("q", work))
+    second = asyncio.ensure_future(flight.do("q", work))
+    await asyncio.sleep(0.01)
+    first.cancel()
+    assert await second == "answer"
+    assert first.cancelled()
+
+@pytest.mark.asyncio
+async def test_cancelling_last_waiter_cancels_work():
+    flight = SingleFlight()
+    started = asyncio.Event()
+    cancelled = asyncio.Event()
+    
+    async def work():
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+    
+    waiters = [asyncio.ensure_future(flight.do("q", work)) for _ in range(2)]
+    await started.wait()
+    for waiter in waiters:
+        waiter.cancel()
+    await asyncio.wait_for(cancelled.wait(), 1)
+    await asyncio.sleep(0)
+    assert flight.stats()["in_flight"] == 0
+
+@pytest.mark.asyncio
+async def test_stream_coalesces_and_replays_for_late_subscribers():
+    flight = SingleFlight()
+    calls = 0
+    
+    async def tokens():
+        nonlocal calls
+        calls += 1
+        for token in ("a", "b", "c"):
+            await asyncio.sleep(0.01)
+            yield token
+    
+    async def collect(delay: float):
+        await asyncio.sleep(delay)
+        return [token async for token in flight.stream("q", tokens)]
+    
+    results = await asyncio.gather(collect(0), collect(0.015))
+    assert results == [["a", "b", "c"], ["a", "b", "c"]]
+    assert calls == 1
+    assert flight.stats()["coalesced"] == 1
+
+@pytest.mark.asyncio
+async def test_stream_subscriber_leaving_does_not_stop_others():
+    flight = SingleFlight()
+    
+    async def tokens():
+        for token in ("a", "b", "c"):
+            await asyncio.sleep(0.01)
+            yield token
+    
+    async def first_only():
+        async for token in flight.stream("q", tokens):
+            return token
+    
+    async def collect():
+        return [token async for token in flight.stream("q", tokens)]
+    
+    first, full = await asyncio.gather(first_only(), collect())
+    assert first == "a"
+    assert full == ["a", "b", "c"]
+
+@pytest.mark.asyncio
+async def test_stream_error_reaches_subscribers():
+    flight = SingleFlight()
+    
+    async def tokens():
+        yield "a"
+        raise RuntimeError("upstream failed")
+    
+    received = []
+    with pytest.raises(RuntimeError):
+        async for token in flight.stream("q", tokens):
+            received.append(token)
+    assert received == ["a"]
+
+@pytest.mark.asyncio
+async def test_coalesced_requests_are_exported_as_metrics():
+    flight = SingleFlight()
+    
+    def coalesced() -> float:
+        return REGISTRY.get_sample_value("singleflight_requests_total", {"mode": "call", "result": "coalesced"}) or 0.0
+    
+    before = coalesced()
+    
+    async def work():
+        await asyncio.sleep(0.01)
+        return 1
+    
+    await asyncio.gather(*(flight.do("q", work) for _ in range(3)))
+    assert coalesced() - before == 2
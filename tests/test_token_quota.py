@@ -0,0 +1,36 @@
+import pytest
+from utils.rate_limiter import GCRALimiter
+from utils.token_quota import TokenQuota, TokenQuotaExceededError
+
+def test_refund_of_only_bucket_does_not_break_sweep():
+    limiter = GCRALimiter(rate=1.0, burst=10)
+    assert limiter.check("a", 5) == 0
+    assert limiter.check("a", -5, force=True) == 0
+    assert len(limiter) == 0
+    assert limiter.check("b", 1) == 0
+
+@pytest.mark.asyncio
+async def test_reserve_then_reject_releases_earlier_scopes():
+    client = GCRALimiter(rate=1.0, burst=1000)
+    api_key = GCRALimiter(rate=1.0, burst=1000)
+    quota = TokenQuota([("client", client, 1000), ("api_key", api_key, 1000)])
+    principals = [("client", "10.0.0.1"), ("api_key", "k1")]
+    
+    # API Key 额度已用完，新客户端的预扣需要退还
+    assert api_key.check("tokens:api_key:k1", 1000) == 0
+    with pytest.raises(TokenQuotaExceededError) as error:
+        await quota.reserve(principals, 500)
+    assert error.value.scope == "api_key"
+    assert "tokens:client:10.0.0.1" not in client._tat
+
+@pytest.mark.asyncio
+async def test_reconcile_charges_actual_usage():
+    limiter = GCRALimiter(rate=0.001, burst=1000)
+    quota = TokenQuota([("client", limiter, 1000)])
+    reserved = await quota.reserve([("client", "c")], 800)
+    await quota.reconcile(reserved, 100)
+    
+    # 实际只用了100，剩余约900
+    assert await quota.reserve([("client", "c")], 850)
+    with pytest.raises(TokenQuotaExceededError):
+        await quota.reserve([("client", "c")], 100)